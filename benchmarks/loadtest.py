@@ -0,0 +1,408 @@
+"""Load test of the vote path against a stand-in homeserver.
+
+Runs the bot, wired up as ioibot.main does it, against a fake Matrix
+homeserver served locally with aiohttp and a throwaway Postgres database.
+Leaders send `!c vote` commands all at once, and the time from a vote
+entering the homeserver's timeline to the bot's reply arriving is measured.
+
+The homeserver implements only what the bot uses on the vote path: sync,
+filter upload, sending events, fetching an event and joining rooms. It also
+serves the datasource CSVs, generated by benchmarks.roster.
+
+Usage:
+
+    python -m benchmarks.loadtest --database postgresql://user@localhost/postgres
+
+The database URL is only used to create and drop a database of its own, the
+database it names is left untouched.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import asyncpg
+import yaml
+from aiohttp import web
+from nio import AsyncClient, AsyncClientConfig
+
+from benchmarks import roster
+from ioibot.config import Config
+from ioibot.main import setup_client, upload_sync_filter
+from ioibot.outbound import room_send_rate_limited
+from ioibot.polls import poll_cache_lookups
+from ioibot.storage import DATASOURCES, Storage, db_pool_wait
+
+logger = logging.getLogger(__name__)
+
+API = "/_matrix/client/v3"
+BOT_LOCALPART = "ioibot"
+
+
+class FakeHomeserver:
+    """A single-user homeserver keeping one timeline shared by all rooms.
+
+    Every event gets the next position in the timeline, sync tokens are
+    positions. Each room is a DM between the bot and one leader.
+
+    Args:
+        datasources: Datasource name -> CSV contents, served at /datasource/<name>.csv.
+    """
+
+    def __init__(self, datasources: Dict[str, bytes]):
+        self.datasources = datasources
+        self.server_name = ""
+        self.bot_user_id = ""
+        # room ID -> MXID of the leader in it
+        self.rooms: Dict[str, str] = {}
+        self.timeline: List[Tuple[str, dict]] = []
+        self.events: Dict[str, dict] = {}
+        self._changed = asyncio.Condition()
+        # room ID -> perf_counter() of the votes not answered yet, oldest first
+        self._pending: Dict[str, Deque[float]] = defaultdict(deque)
+        self._unanswered = 0
+        self._answered = asyncio.Event()
+        self.latencies: List[float] = []
+        self.replies: List[str] = []
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.first_sync = asyncio.Event()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(f"{API}/sync", self.sync)
+        app.router.add_post(f"{API}/user/{{user_id}}/filter", self.filter)
+        app.router.add_put(f"{API}/rooms/{{room_id}}/send/{{type}}/{{txn_id}}", self.send)
+        app.router.add_get(f"{API}/rooms/{{room_id}}/event/{{event_id}}", self.event)
+        app.router.add_post(f"{API}/join/{{room_id}}", self.join)
+        app.router.add_post(f"{API}/rooms/{{room_id}}/join", self.join)
+        app.router.add_get("/datasource/{name}.csv", self.datasource)
+        return app
+
+    def add_room(self, user_id: str) -> str:
+        room_id = f"!dm{len(self.rooms)}:{self.server_name}"
+        self.rooms[room_id] = user_id
+        return room_id
+
+    def _append(self, room_id: str, sender: str, content: dict) -> dict:
+        event = {
+            "type": "m.room.message",
+            "event_id": f"${len(self.timeline)}:{self.server_name}",
+            "sender": sender,
+            "origin_server_ts": int(time.time() * 1000),
+            "content": content,
+            "unsigned": {},
+        }
+        self.timeline.append((room_id, event))
+        self.events[event["event_id"]] = event
+        return event
+
+    async def inject(self, room_id: str, body: str):
+        """Post a message of the room's leader, as if sent by their client"""
+        self._append(room_id, self.rooms[room_id], {"msgtype": "m.text", "body": body})
+        self._pending[room_id].append(time.perf_counter())
+        self._unanswered += 1
+        self._answered.clear()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_answered(self, timeout: float):
+        """Wait until the bot has replied to every injected message"""
+        await asyncio.wait_for(self._answered.wait(), timeout)
+
+    def _room_state(self, room_id: str) -> List[dict]:
+        state = [{
+            "type": "m.room.create", "state_key": "", "event_id": f"$create{room_id}",
+            "sender": self.bot_user_id, "origin_server_ts": 0,
+            "content": {"creator": self.bot_user_id}, "unsigned": {},
+        }]
+        for user_id in (self.bot_user_id, self.rooms[room_id]):
+            state.append({
+                "type": "m.room.member", "state_key": user_id,
+                "event_id": f"$member{room_id}{user_id}", "sender": user_id,
+                "origin_server_ts": 0, "content": {"membership": "join"}, "unsigned": {},
+            })
+        return state
+
+    async def sync(self, request: web.Request) -> web.Response:
+        self.requests["sync"] += 1
+        since = request.query.get("since")
+        position = int(since) if since else 0
+        timeout = int(request.query.get("timeout", 0)) / 1000
+
+        if position >= len(self.timeline) and timeout:
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: len(self.timeline) > position), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        timelines = defaultdict(list)
+        for room_id, event in self.timeline[position:]:
+            timelines[room_id].append(event)
+
+        # the initial sync tells the bot about all of its rooms
+        room_ids = self.rooms if since is None else timelines
+        join = {
+            room_id: {
+                "timeline": {
+                    "events": timelines[room_id], "limited": False, "prev_batch": str(position)},
+                "state": {"events": self._room_state(room_id) if since is None else []},
+                "ephemeral": {"events": []},
+                "account_data": {"events": []},
+                "summary": {"m.joined_member_count": 2, "m.invited_member_count": 0},
+                "unread_notifications": {"notification_count": 0, "highlight_count": 0},
+            }
+            for room_id in room_ids
+        }
+        self.first_sync.set()
+        return web.json_response({
+            "next_batch": str(len(self.timeline)),
+            "rooms": {"join": join, "invite": {}, "leave": {}},
+            "to_device": {"events": []},
+            "presence": {"events": []},
+            "account_data": {"events": []},
+            "device_lists": {"changed": [], "left": []},
+            "device_one_time_keys_count": {},
+        })
+
+    async def filter(self, request: web.Request) -> web.Response:
+        self.requests["filter"] += 1
+        return web.json_response({"filter_id": "0"})
+
+    async def send(self, request: web.Request) -> web.Response:
+        self.requests["send"] += 1
+        room_id = request.match_info["room_id"]
+        content = await request.json()
+        event = self._append(room_id, self.bot_user_id, content)
+
+        pending = self._pending[room_id]
+        if pending:
+            self.latencies.append(time.perf_counter() - pending.popleft())
+            self.replies.append(content.get("body", ""))
+            self._unanswered -= 1
+            if not self._unanswered:
+                self._answered.set()
+
+        async with self._changed:
+            self._changed.notify_all()
+        return web.json_response({"event_id": event["event_id"]})
+
+    async def event(self, request: web.Request) -> web.Response:
+        self.requests["event"] += 1
+        event = self.events.get(request.match_info["event_id"])
+        if event is None:
+            return web.json_response(
+                {"errcode": "M_NOT_FOUND", "error": "Event not found"}, status=404)
+        return web.json_response({**event, "room_id": request.match_info["room_id"]})
+
+    async def join(self, request: web.Request) -> web.Response:
+        self.requests["join"] += 1
+        return web.json_response({"room_id": request.match_info["room_id"]})
+
+    async def datasource(self, request: web.Request) -> web.Response:
+        body = self.datasources.get(request.match_info["name"])
+        if body is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=body, content_type="text/csv")
+
+
+def percentile(quantiles: List[float], p: int) -> float:
+    """The p-th percentile from the 99 cut points of statistics.quantiles, in ms"""
+    return round(quantiles[p - 1] * 1000, 2)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    tables = roster.generate(teams=args.teams)
+    datasources = {name: table.to_csv(index=False).encode() for name, table in tables.items()}
+    server = FakeHomeserver(datasources)
+
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    homeserver_url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    # the bot takes the server name of the roster's MXIDs from the homeserver URL
+    # like this too
+    server.server_name = homeserver_url[8:]
+    server.bot_user_id = f"@{BOT_LOCALPART}:{server.server_name}"
+
+    admin = await asyncpg.connect(args.database)
+    database = f"ioibot_loadtest_{os.getpid()}"
+    await admin.execute(f'CREATE DATABASE "{database}"')
+
+    try:
+        with tempfile.TemporaryDirectory() as store_path:
+            config_path = os.path.join(store_path, "config.yaml")
+            with open(config_path, "w") as f:
+                yaml.safe_dump({
+                    "command_prefix": "!c",
+                    "matrix": {
+                        "user_id": server.bot_user_id,
+                        "user_token": "loadtest",
+                        "homeserver_url": homeserver_url,
+                        "device_id": "LOADTEST",
+                    },
+                    "storage": {
+                        "database": urlsplit(args.database)._replace(path=f"/{database}").geturl(),
+                        "store_path": store_path,
+                        "pool": {"min_size": args.pool_size, "max_size": args.pool_size},
+                    },
+                    "events": {"workers": args.workers},
+                    "logging": {
+                        "level": "WARNING",
+                        "file_logging": {"enabled": False},
+                        "console_logging": {"enabled": True},
+                    },
+                    "datasource": {
+                        option: f"{homeserver_url}/datasource/{name}.csv"
+                        for name, option in DATASOURCES.items()
+                    },
+                }, f)
+
+            return await run_bot(args, Config(config_path), server, tables)
+    finally:
+        await admin.execute(f'DROP DATABASE IF EXISTS "{database}"')
+        await admin.close()
+        await runner.cleanup()
+
+
+async def run_bot(args, config: Config, server: FakeHomeserver, tables) -> dict:
+    store = Storage(config)
+    await store.load()
+
+    client = AsyncClient(
+        config.homeserver_url,
+        config.user_id,
+        device_id=config.device_id,
+        store_path=config.store_path,
+        config=AsyncClientConfig(max_limit_exceeded=0, max_timeouts=0, encryption_enabled=False),
+    )
+    client.access_token = config.user_token
+    client.user_id = config.user_id
+    setup_client(client, store, config)
+
+    leaders = tables["leaders"]
+    voters = leaders.loc[leaders["Role"].isin(["Team Leader", "Deputy Leader"])]
+    voters = voters.head(args.leaders) if args.leaders else voters
+    rooms = [server.add_room(f"@{user_id}:{server.server_name}") for user_id in voters["UserID"]]
+    rng = random.Random(0)
+
+    async with store.db_connect():
+        choices = [f"Choice {i}" for i in range(1, args.choices + 1)]
+        poll = await store.polls.create(
+            "Load test", choices, [str(i) for i in range(1, args.choices + 1)],
+            args.anonymous, False, True, True)
+
+        sync_task = asyncio.create_task(client.sync_forever(
+            timeout=30000, sync_filter=await upload_sync_filter(client, config)))
+        try:
+            await asyncio.wait_for(server.first_sync.wait(), 30)
+            # let the callbacks of the initial sync settle
+            await asyncio.sleep(0.5)
+
+            acquires = db_pool_wait.labels().count
+            sends = server.requests["send"]
+            syncs = server.requests["sync"]
+            rate_limited = room_send_rate_limited.labels().value
+            cache_misses = poll_cache_lookups.labels("miss").value
+
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                for room_id in rooms:
+                    await server.inject(room_id, f"!c vote {rng.randint(1, args.choices)}")
+                await server.wait_answered(args.timeout)
+            elapsed = time.perf_counter() - start
+
+            votes = len(rooms) * args.rounds
+            acquires = db_pool_wait.labels().count - acquires
+            if args.anonymous:
+                teams_voted = await store.conn.fetchval(
+                    "SELECT count(DISTINCT team_code) FROM poll_anonym_active_votes")
+            else:
+                teams_voted = await store.conn.fetchval(
+                    "SELECT count(DISTINCT team_code) FROM poll_votes WHERE poll_id = $1",
+                    poll.poll_id)
+        finally:
+            sync_task.cancel()
+            await asyncio.gather(sync_task, return_exceptions=True)
+            await client.close()
+
+    quantiles = statistics.quantiles(server.latencies, n=100)
+    return {
+        "teams": args.teams,
+        "leaders": len(rooms),
+        "rounds": args.rounds,
+        "votes": votes,
+        "recorded": sum("has been recorded" in reply for reply in server.replies),
+        "teams_voted": teams_voted,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_votes_per_s": round(votes / elapsed, 1),
+        "latency_ms": {
+            "p50": percentile(quantiles, 50),
+            "p90": percentile(quantiles, 90),
+            "p99": percentile(quantiles, 99),
+            "max": round(max(server.latencies) * 1000, 2),
+        },
+        "db_acquires": acquires,
+        "db_acquires_per_vote": round(acquires / votes, 2),
+        "poll_cache_misses": poll_cache_lookups.labels("miss").value - cache_misses,
+        "room_sends": server.requests["send"] - sends,
+        "room_sends_rate_limited": room_send_rate_limited.labels().value - rate_limited,
+        "syncs": server.requests["sync"] - syncs,
+    }
+
+
+def report(results: dict):
+    latency = results["latency_ms"]
+    print(f"{results['votes']} votes from {results['leaders']} leaders of "
+          f"{results['teams']} teams in {results['rounds']} rounds")
+    print(f"  recorded:     {results['recorded']} ({results['teams_voted']} teams in the database)")
+    print(f"  elapsed:      {results['elapsed_s']} s")
+    print(f"  throughput:   {results['throughput_votes_per_s']} votes/s")
+    print(f"  latency (ms): p50 {latency['p50']}  p90 {latency['p90']}  "
+          f"p99 {latency['p99']}  max {latency['max']}")
+    print(f"  database:     {results['db_acquires']} connection acquires "
+          f"({results['db_acquires_per_vote']} per vote), "
+          f"{results['poll_cache_misses']:g} poll cache misses")
+    print(f"  homeserver:   {results['room_sends']} sends "
+          f"({results['room_sends_rate_limited']:g} rate limited), {results['syncs']} syncs")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database", required=True,
+        help="URL of a Postgres server to create the throwaway database on")
+    parser.add_argument("--teams", type=int, default=92, help="number of teams in the roster")
+    parser.add_argument(
+        "--leaders", type=int, default=0,
+        help="number of leaders voting, all team and deputy leaders by default")
+    parser.add_argument("--rounds", type=int, default=3, help="times every leader votes")
+    parser.add_argument("--choices", type=int, default=4, help="choices of the poll")
+    parser.add_argument("--anonymous", action="store_true", help="make the poll anonymous")
+    parser.add_argument("--workers", type=int, default=8, help="event dispatcher workers")
+    parser.add_argument("--pool-size", type=int, default=10, help="database connections")
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="seconds to wait for the replies of a round")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
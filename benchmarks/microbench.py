@@ -0,0 +1,316 @@
+"""Microbenchmarks of the code running on every event and request.
+
+The roster is read from datasource CSVs of the size of a real IOI, generated
+by benchmarks.roster, the way Storage reads the downloaded sheets. Nothing
+talks to a homeserver or a database: sent messages are discarded and the
+poll queries are answered by a stub pool.
+
+Usage:
+
+    python -m benchmarks.microbench --output before.json
+    python -m benchmarks.microbench --output after.json --compare before.json
+
+The results are written as JSON, the time per call of every benchmark in
+microseconds, so runs before and after a change can be compared.
+"""
+
+import argparse
+import asyncio
+import datetime
+import inspect
+import json
+import platform
+import statistics
+import tempfile
+import time
+import types
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+from unittest.mock import Mock
+
+import nio
+import pandas as pd
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from benchmarks import roster
+from ioibot import queries
+from ioibot.bot_commands import Command, User
+from ioibot.http_server import PollResultCache, polls_active, result_cache_key, store_key
+from ioibot.message_responses import Message
+from ioibot.outbound import set_scheduler
+from ioibot.polls import PollRepository
+from ioibot.storage import Roster, Storage
+
+HOMESERVER = "ioi.example"
+
+# a batch of calls is timed as a whole, it is made long enough to time reliably
+MIN_BATCH_SECONDS = 0.05
+
+
+class DiscardingScheduler:
+    """Stands in for the OutboundScheduler, dropping every event it is given"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, room_id, message_type, content, coalesce=False):
+        self.sent += 1
+        return None
+
+    async def join(self):
+        pass
+
+
+class StubConnection:
+    """Answers the poll queries with fixed rows"""
+
+    def __init__(self, rows: Dict[str, list]):
+        self.rows = rows
+
+    async def fetch(self, query, *args):
+        return self.rows[query]
+
+    async def fetchrow(self, query, *args):
+        rows = self.rows[query]
+        return rows[0] if rows else None
+
+    def transaction(self, **kwargs):
+        return _NO_TRANSACTION
+
+
+class _NoTransaction:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+_NO_TRANSACTION = _NoTransaction()
+
+
+class StubPool(StubConnection):
+    """A pool of a single StubConnection"""
+
+    def __init__(self, rows: Dict[str, list]):
+        super().__init__(rows)
+        self.connection = StubConnection(rows)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.connection
+
+
+def load_fixtures(directory: str, teams: int) -> Dict[str, pd.DataFrame]:
+    """Generate the datasource CSVs into directory and read them back"""
+    paths = roster.write_csvs(roster.generate(teams=teams), directory)
+    return {name: pd.read_csv(path) for name, path in paths.items()}
+
+
+def make_store(tables: Dict[str, pd.DataFrame], directory: str) -> Storage:
+    """Set up a Storage holding the tables, as if they had just been loaded"""
+    config = types.SimpleNamespace(
+        homeserver_url=f"https://{HOMESERVER}", store_path=directory)
+    store = Storage(config)
+    for name, table in tables.items():
+        setattr(store, name, table)
+    store.roster = Roster(
+        tables['teams'], tables['leaders'], HOMESERVER, tables['objection_rooms'])
+    return store
+
+
+def poll_rows(tables: Dict[str, pd.DataFrame], choices: int) -> Dict[str, list]:
+    """Rows of a displayed, active, non-anonymous poll every team voted in"""
+    poll = (1, "Do you accept the tasks?", 1, True, False, False)
+    poll_choices = [(choice_id, f"Choice {choice_id}", f"{choice_id}")
+                    for choice_id in range(1, choices + 1)]
+    voted_at = datetime.datetime(2025, 8, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    leaders = tables['leaders']
+    team_leaders = leaders.loc[leaders['Role'] == 'Team Leader']
+    votes = [
+        (index % choices + 1, team_code, user_id, voted_at)
+        for index, (team_code, user_id) in enumerate(
+            zip(team_leaders['TeamCode'], team_leaders['UserID']))
+    ]
+    return {
+        queries.ACTIVE_POLL: [poll],
+        queries.DISPLAYED_POLL: [poll],
+        queries.POLL_CHOICES: poll_choices,
+        queries.POLL_VOTES: votes,
+    }
+
+
+def fake_event(sender: str, room_id: str) -> nio.RoomMessageText:
+    return nio.RoomMessageText.from_dict({
+        "type": "m.room.message",
+        "event_id": "$event",
+        "sender": sender,
+        "origin_server_ts": 0,
+        "room_id": room_id,
+        "content": {"msgtype": "m.text", "body": "hello"},
+    })
+
+
+async def measure(func: Callable[[], Union[None, Awaitable[None]]], repeat: int) -> dict:
+    """Time func, awaiting its calls if it is a coroutine function.
+
+    The number of calls per batch is doubled until a batch takes at least
+    MIN_BATCH_SECONDS, then repeat batches of that many calls are timed.
+
+    Returns:
+        The calls per batch and the best and median time per call in microseconds.
+    """
+    is_async = inspect.iscoroutinefunction(func)
+
+    async def batch(calls: int) -> float:
+        start = time.perf_counter()
+        if is_async:
+            for _ in range(calls):
+                await func()
+        else:
+            for _ in range(calls):
+                func()
+        return time.perf_counter() - start
+
+    calls = 1
+    while await batch(calls) < MIN_BATCH_SECONDS:
+        calls *= 2
+
+    times = [await batch(calls) / calls * 1e6 for _ in range(repeat)]
+    return {
+        'calls': calls,
+        'best_us': round(min(times), 3),
+        'median_us': round(statistics.median(times), 3),
+    }
+
+
+def benchmarks(
+    store: Storage, tables: Dict[str, pd.DataFrame], choices: int
+) -> Dict[str, Callable]:
+    """Set up the benchmarks.
+
+    Returns:
+        Benchmark name -> function making one call of the benchmarked code.
+    """
+    config = store.config
+    client = Mock(spec=nio.AsyncClient)
+    set_scheduler(client, DiscardingScheduler())
+
+    leaders = tables['leaders']
+    team_leader = leaders.loc[leaders['Role'] == 'Team Leader'].iloc[0]
+    htc = leaders.loc[leaders['Role'] == 'HTC'].iloc[0]
+    # committee members are listed under a team too, so teams differ in size
+    largest_team = leaders['TeamCode'].value_counts().idxmax()
+
+    room = nio.MatrixRoom("!dm:" + HOMESERVER, "@ioibot:" + HOMESERVER)
+    leader_mxid = f"@{team_leader['UserID']}:{HOMESERVER}"
+    htc_mxid = f"@{htc['UserID']}:{HOMESERVER}"
+
+    def command(text: str, sender: str = leader_mxid) -> Command:
+        return Command(client, store, config, text, room, fake_event(sender, room.room_id))
+
+    display = command("poll list", htc_mxid)._get_poll_display
+    poll_choices = [(choice_id, f"Choice number {choice_id}", f"{choice_id}")
+                    for choice_id in range(choices, 0, -1)]
+    user_choices = [1, choices // 2]
+
+    message = Message(
+        client, store, config, "hello", room, fake_event(leader_mxid, room.room_id))
+
+    rows = poll_rows(tables, choices)
+    store.polls = PollRepository(StubPool(rows), store.poll_changed)
+    app = web.Application()
+    app[store_key] = store
+    app[result_cache_key] = PollResultCache(store)
+    request = make_mocked_request("GET", "/api/polls", app=app)
+
+    async def polls_active_cached():
+        await polls_active(request)
+
+    async def polls_active_rebuilt():
+        store.poll_changed()
+        await polls_active(request)
+
+    async def polls_active_uncached():
+        store.polls.cache.invalidate()
+        store.poll_changed()
+        await polls_active(request)
+
+    return {
+        'user_leader': lambda: User(store, config, leader_mxid),
+        'user_unknown': lambda: User(store, config, f"@nobody:{HOMESERVER}"),
+        'poll_display': lambda: display(
+            1, "Question?", 1, True, False, True, poll_choices),
+        'poll_display_voted': lambda: display(
+            1, "Question?", 1, True, False, True, poll_choices, user_choices),
+        'polls_active_cached': polls_active_cached,
+        'polls_active_rebuilt': polls_active_rebuilt,
+        'polls_active_uncached': polls_active_uncached,
+        'message_other_room': message.process,
+        'info_team': command(f"info {largest_team}")._show_info,
+        'info_tc': command("info tc")._show_info,
+        'info_sc': command("info sc")._show_info,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(prefix="ioibot-microbench-") as directory:
+        tables = load_fixtures(args.fixtures or directory, args.teams)
+        store = make_store(tables, directory)
+
+        results = {}
+        for name, func in benchmarks(store, tables, args.choices).items():
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = await measure(func, args.repeat)
+            print(f"{name:<24} {results[name]['best_us']:>12.2f} us")
+
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'teams': len(tables['teams']),
+        'users': len(store.roster.users),
+        'contestants': len(tables['contestants']),
+        'choices': args.choices,
+        'repeat': args.repeat,
+        'benchmarks': results,
+    }
+
+
+def compare(results: dict, previous: dict):
+    """Print the change of every benchmark against a previous run"""
+    print()
+    for name, result in results['benchmarks'].items():
+        before = previous['benchmarks'].get(name)
+        if before is None:
+            continue
+        ratio = result['best_us'] / before['best_us']
+        print(f"{name:<24} {before['best_us']:>12.2f} -> {result['best_us']:>12.2f} us"
+              f"  {ratio:6.2f}x")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--output", default="microbench.json", help="file to write the results to")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    parser.add_argument("--filter", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--teams", type=int, default=92, help="number of teams in the roster")
+    parser.add_argument("--choices", type=int, default=50, help="choices of the poll")
+    parser.add_argument("--repeat", type=int, default=5, help="timed batches per benchmark")
+    parser.add_argument(
+        "--fixtures", help="directory to keep the generated CSVs in, a temporary one by default")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Generated datasource tables of the size of a real IOI.
+
+The tables have the columns of the spreadsheets the bot reads, filled with
+made-up people, so the load test and the benchmarks work on realistic
+amounts of data without access to the real sheets.
+"""
+
+import os
+import random
+import string
+from typing import Dict
+
+import pandas as pd
+
+# roles of the leaders table that belong to a team, and how many of each a team has
+TEAM_ROLES = {
+    'Team Leader': 1,
+    'Deputy Leader': 1,
+    'Guest': 5,
+    'Invited Observer/Guest': 2,
+    'Remote Adjunct (not on site)': 2,
+}
+
+# committee roles and how many members each has
+COMMITTEE_ROLES = {
+    'President': 1,
+    'Chair of IOI / IC Member': 1,
+    'IC Member': 12,
+    'Secretary': 1,
+    'Treasurer': 1,
+    'ISC Member': 10,
+    'HSC': 15,
+    'Invited HSC': 5,
+    'ITC Member': 8,
+    'HTC': 12,
+    'Invited HTC': 4,
+}
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank', 'Grace', 'Heidi',
+               'Ivan', 'Judy', 'Mallory', 'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil',
+               'Trent', 'Uma', 'Victor', 'Walter']
+LAST_NAMES = ['Smith', 'Nagy', 'Kowalski', 'Tanaka', 'Silva', 'Novak', 'Ivanov',
+              'Garcia', 'Kim', 'Nguyen', 'Müller', 'Rossi', 'Dubois', 'Jensen']
+
+
+def generate(
+    teams: int = 92, contestants_per_team: int = 4, seed: int = 0
+) -> Dict[str, pd.DataFrame]:
+    """Generate every datasource table.
+
+    Args:
+        teams: The number of teams.
+
+        contestants_per_team: The number of contestants of each team.
+
+        seed: Seed of the random names, codes and passwords.
+
+    Returns:
+        Datasource name -> table, the names of storage.DATASOURCES.
+    """
+    rng = random.Random(seed)
+
+    codes = set()
+    while len(codes) < teams:
+        codes.add(''.join(rng.choices(string.ascii_uppercase, k=3)))
+    codes = sorted(codes)
+
+    def name():
+        return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+    def password():
+        return ''.join(rng.choices(string.ascii_letters + string.digits, k=12))
+
+    team_rows = [
+        {'Code': code, 'Name': f'Country {code}', 'Voting': 1, 'Visible': 1} for code in codes]
+
+    leader_rows = []
+    for code in codes:
+        for role, count in TEAM_ROLES.items():
+            for _ in range(count):
+                first, last = name()
+                leader_rows.append({
+                    'TeamCode': code, 'RealTeamCode': code, 'Name': f'{first} {last}',
+                    'Role': role, 'UserID': f'user{len(leader_rows)}', 'Chair': 0,
+                })
+    for role, count in COMMITTEE_ROLES.items():
+        for i in range(count):
+            first, last = name()
+            code = rng.choice(codes)
+            leader_rows.append({
+                'TeamCode': code, 'RealTeamCode': code, 'Name': f'{first} {last}',
+                'Role': role, 'UserID': f'user{len(leader_rows)}', 'Chair': int(i == 0),
+            })
+
+    contestant_rows = []
+    for code in codes:
+        for i in range(1, contestants_per_team + 1):
+            first, last = name()
+            contestant_rows.append({
+                'ContestantCode': f'{code}{i}', 'RealTeamCode': code, 'FirstName': first,
+                'LastName': last, 'Online': int(rng.random() < 0.1), 'Password': password(),
+            })
+
+    testing_rows = [
+        {**row, 'ContestantCode': f"{row['ContestantCode']}-test", 'Password': password()}
+        for row in contestant_rows
+    ]
+    for row in testing_rows:
+        del row['Online']
+
+    tasks = 6
+    objection_room_rows = [
+        {'Objection Room ID': f'!objection{i}:ioi.example', 'SC Room ID': f'!sc{i}:ioi.example'}
+        for i in range(tasks)
+    ]
+
+    return {
+        'teams': pd.DataFrame(team_rows),
+        'leaders': pd.DataFrame(leader_rows),
+        'contestants': pd.DataFrame(contestant_rows),
+        'testing_acc': pd.DataFrame(testing_rows),
+        'translation_acc': pd.DataFrame(
+            [{'TeamCode': code, 'Password': password()} for code in codes]),
+        'objection_rooms': pd.DataFrame(objection_room_rows),
+        'tokens': pd.DataFrame(
+            [{'UserID': row['UserID'], 'Token': password()} for row in leader_rows]),
+    }
+
+
+def write_csvs(tables: Dict[str, pd.DataFrame], directory: str) -> Dict[str, str]:
+    """Save the tables as <name>.csv in directory.
+
+    Returns:
+        Datasource name -> path of its CSV file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for table_name, table in tables.items():
+        paths[table_name] = os.path.join(directory, f'{table_name}.csv')
+        table.to_csv(paths[table_name], index=False)
+    return paths
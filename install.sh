@@ -37,7 +37,6 @@ VENV="$PROJECT_DIR/venv"
 BOT="$VENV/bin/ioibot"
 CONFIG="$DATA_DIR/config.yaml"
 TEMPLATE="$PROJECT_DIR/etc/sample.config.yaml"
-INIT_SQL="$PROJECT_DIR/ioibot/init.sql"
 
 if [ ! -d "$VENV" ]; then
   python3 -m venv "$VENV"
@@ -60,15 +59,7 @@ if [ ! -f "$CONFIG" ]; then
   fi
 fi
 
-# Initialize database schema if init.sql exists
-if [ -f "$INIT_SQL" ]; then
-  echo "Initializing database schema from $INIT_SQL"
-  psql -f "$INIT_SQL"
-else
-  echo "$INIT_SQL not found. Skipping database initialization."
-  echo "Please initialize your database manually."
-fi
-
+# The database schema is created and migrated by the bot when it starts
 # Create data store
 mkdir -p "$DATA_DIR/store"
 
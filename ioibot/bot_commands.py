@@ -1,20 +1,155 @@
-from itertools import repeat
 import logging
 import shlex
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional
 
+from ioibot import queries
 from ioibot.chat_functions import (
     make_pill,
     react_to_event,
+    register_templates,
+    send_file_to_room,
     send_text_to_room,
     send_text_to_thread,
+    split_message,
 )
 from ioibot.config import Config
+from ioibot.errors import DatasourceError, PollError
+from ioibot.metrics import Counter, Histogram
+from ioibot.polls import STATUSES
 from ioibot.storage import Storage
-from nio import AsyncClient, MatrixRoom, RoomMessageText
+from nio import AsyncClient, MatrixRoom, RoomMessageText, RoomSendResponse
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+command_invocations = Counter(
+    "ioibot_command_invocations_total", "Commands dispatched to a handler", ["command"])
+command_errors = Counter(
+    "ioibot_command_errors_total", "Command handlers that raised an exception", ["command"])
+command_latency = Histogram(
+    "ioibot_command_latency_seconds", "Time spent in command handlers", ["command"])
+
+class CommandSpec:
+    """A command the bot understands.
+
+    Args:
+        name: The name of the command, i.e. the first word of the message.
+
+        handler: The Command method handling the command.
+
+        aliases: Other names the command can be invoked with.
+
+        allowed: A predicate on the User sending the command. The handler is only
+            called if it holds, otherwise `denied` is sent to the room.
+
+        denied: The message sent to users who are not allowed to use the command.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[["Command"], Awaitable[None]],
+        aliases: Iterable[str] = (),
+        allowed: Optional[Callable[["User"], bool]] = None,
+        denied: Optional[str] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.allowed = allowed
+        self.denied = denied
+
+# command name or alias -> CommandSpec, filled by the @command decorator
+COMMANDS: Dict[str, CommandSpec] = {}
+
+def command(name, aliases=(), allowed=None, denied=None):
+    """Register the decorated Command method as the handler of a command"""
+    def decorator(func):
+        spec = CommandSpec(name, func, aliases, allowed, denied)
+        for key in (name, *spec.aliases):
+            COMMANDS[key] = spec
+        return func
+    return decorator
+
+NOT_AUTHORIZED = "You are not authorized to use this bot. Please contact HTC for details."
+ONLY_HTC = "Only HTC can use this command."
+ONLY_LEADERS = "Only Team Leader and Deputy Leader can use this command."
+ONLY_OBJECTION_ROLES = "Only Team Leaders, Deputy Leaders and SC members can use this command."
+NO_ACTIVE_POLL = "There is no active poll."
+
+HELP_TEXT = (
+    "Hello, I am IOI 2025 bot. I understand several commands:  \n\n"
+    "- `info`: shows various team information\n"
+    "- `accounts`: shows various accounts for your team\n"
+    "- `vote`: casts vote for your team\n"
+)
+
+INFO_USAGE = (
+    "Usage:  \n\n"
+    "`info <3-letter-country-code>|ic|sc|tc`: shows team/IC/SC/TC members  \n\n"
+    "Examples:  \n\n"
+    "- `info IDN`  \n"
+    "- `info ic`  \n"
+)
+
+ACCOUNTS_USAGE = (
+    "Usage:  \n\n"
+    "- `accounts early-practice`: Show accounts for the early practice contest  \n"
+    "- `accounts contest`: Show online contestant accounts for the actual practice/contest days  \n"
+    "- `accounts translation`: Show team account for translation system  \n"
+)
+
+OBJECTION_USAGE = (
+    "Usage:  \n\n"
+    "- `!c objection <Optional: Major/Minor> <content>`: Send objection to the SC.  \n\n"
+    "Examples:  \n"
+    "- `!c objection Major We had a very similar problem in our practice contest!`: Send Major objection to the SC.  \n"
+    "- `!c objection It is not specified for the intervals whether they are open or closed`: Send (default) Minor objection to the SC.  \n"
+)
+
+# polls shown by one `poll list`
+POLL_LIST_PAGE_SIZE = 10
+
+POLL_USAGE = (
+    "Usage:  \n\n"
+    '- `poll new [--options ...] "<question>" "<mark1>/<choice 1>" "<mark 2>/<choice 2>" "<mark3>/<choice 3>" ... `: create new poll  \n'
+    '- `poll update <poll-id> [--options ...] "<question>" "<mark 1>/<choice 1>" "<mark 2>/<choice 2>" "<mark 3>/<choice 3>" ...`: update existing poll  \n'
+    '- `poll update <poll-id> [--options ...] "[question]"`: update existing poll but leave the choices  \n'
+    f'- `poll list [--status inactive|active|closed] [--since <poll-id>] [--page <poll-id>]`: show the created polls, {POLL_LIST_PAGE_SIZE} per page, starting at poll `--since` or after poll `--page`, the last one of the previous page  \n'
+    '- `poll export <poll-id>|all`: export the votes of non-anonymous polls as CSV  \n'
+    '- `poll clear-display`: clears the displayed poll from the web interface  \n'
+    '- `poll activate <poll-id>`: activate a poll  \n'
+    '- `poll close`: deactivate all polls  \n\n'
+
+    'Ooptions for `new` and `update`:  \n'
+    '    - `-a, --anonymous`: make the poll anonymous  \n'
+    '    - `-m, --multiple-choice`: allow multiple choices  \n'
+    '    - `-d, --display`: set to show  \n'
+    '    - `-s, --start`: set to active if no other pool is open  \n\n'
+
+    'Note:  if an argument consists of multiple words you can wrap it in double quotes, otherwise you don\'t have to.  \n\n'
+
+    "Examples:  \n"
+    '- `poll new "What is your favorite color?" 🟥/Red 🟧/Orange 🟨/Yellow 🟩/Green 🟦/Blue`: creates a poll  \n'
+    '- `poll new -ds "Question?" "✅/Vote for motion" "❌/Vote against motion" "➖/Abstain"`: creates, displays and starts a poll   \n'
+    '- `poll new --anonymous "What is your favorite number?" "1️⃣/One" "2️⃣/Two" "3️⃣/Three" "4️⃣/Four"`: creates an anonymous poll   \n'
+
+    '- `poll new  --multiple-choice --anonymous "What is your favorite letter?" "A" "B" "🅾️/O"`: creates an anonym, multiple choice poll   \n'
+    '- `poll new "Is this a question?" yes no abstain"`: creates a poll with the default markers  \n'
+    '- `poll update 1 -ma "What is 1+1?" one two three`: changes the existing poll 1 to be anonym and multiple choice, also rewrites the question and answers  \n'
+    '- `poll update 1 -d`: sets poll 1 to be displayed  \n'
+    '- `poll activate 10`: opens poll 10 for voting  \n'
+    '- `poll list --status closed --page 14`: shows the closed polls after poll 14  \n'
+)
+
+# these are sent over and over again, render them once
+register_templates(
+    NOT_AUTHORIZED, ONLY_HTC, ONLY_LEADERS, ONLY_OBJECTION_ROLES, NO_ACTIVE_POLL,
+    HELP_TEXT, INFO_USAGE, ACCOUNTS_USAGE, OBJECTION_USAGE, POLL_USAGE,
+)
+
 def assume(pred, message):
     def decorator(func):
         async def wrapper(self, *args, **kwargs):
@@ -32,26 +167,23 @@ class User():
         self.config = config
         self.role = "Unknown"
 
-        users = store.leaders
-        teams = store.teams
-
-        user = users.loc[self._get_username(users['UserID']) == username, \
-                        ['TeamCode', 'RealTeamCode', 'Name', 'Role', 'UserID']]
+        roster = store.roster
+        user = roster.users.get(username)
 
-        if not user.empty:
-            country = teams.loc[teams['Code'] == user.iat[0, 0], ['Name']]
+        if user is not None:
+            team = roster.teams.get(user['TeamCode'])
             # if the user is not specified in the spreadsheet,
             # or if the country code is not found,
             # assume that the user is unauthorized to use this bot.
-            if country.empty:
+            if team is None:
                 self.role = "Unknown"
             else:
-                self.team = user.iat[0, 0]
-                self.real_team = user.iat[0, 1]
-                self.name = user.iat[0, 2]
-                self.role = user.iat[0, 3]
-                self.country = country.iat[0, 0]
-                self.user_id = user.iat[0, 4]
+                self.team = user['TeamCode']
+                self.real_team = user['RealTeamCode']
+                self.name = user['Name']
+                self.role = user['Role']
+                self.country = team['Name']
+                self.user_id = user['UserID']
 
     def is_leader(self):
         return self.is_tc() or self.role in ['Team Leader', 'Deputy Leader']
@@ -62,10 +194,6 @@ class User():
     def is_sc(self):
         return 'SC' in self.role
 
-    def _get_username(self, name):
-        homeserver = self.config.homeserver_url[8:]
-        return "@" + name + ":" + homeserver
-
 class Command:
     def __init__(
         self,
@@ -107,107 +235,37 @@ class Command:
         self.user = user
 
         if self.user.role == "Unknown":
-            await send_text_to_room(
-                self.client, self.room.room_id,
-                "You are not authorized to use this bot. Please contact HTC for details."
-            )
+            await send_text_to_room(self.client, self.room.room_id, NOT_AUTHORIZED)
             return
 
         """Process the command"""
-        if self.command.startswith("echo"):
-            await self._echo()
-
-        elif self.command.startswith("react"):
-            await self._react()
-
-        elif self.command.startswith("help"):
-            await self._show_help()
-
-        elif self.command.startswith("info"):
-            await self._show_info()
-
-        elif self.command.startswith("refresh"):
-            if not self.user.is_tc():
-              await send_text_to_room(
-                  self.client, self.room.room_id,
-                  "Only HTC can use this command."
-              )
-              return
-            await self._refresh()
-
-        elif self.command.startswith("poll"):
-            if not self.user.is_tc():
-                await send_text_to_room(
-                    self.client, self.room.room_id,
-                    "Only HTC can use this command."
-                )
-                return
-
-            await self._manage_poll()
-
-        elif self.command.startswith("vote"):
-            if not self.user.is_leader():
-                await send_text_to_room(
-                    self.client, self.room.room_id,
-                    "Only Team Leader and Deputy Leader can use this command."
-                )
-                return
-
-            if self.user.is_tc():
-              if len(self.args) == 0:
-                await send_text_to_room(
-                    self.client, self.room.room_id,
-                    "Usage: `vote <3-letter-country-code> [choices]`"
-                )
-                return
-              if await self._validate(len(self.args) > 0, "Usage: `vote [choices]`"): return;
-              team_code = self.args[0].upper()
-              # if team code to upper does not exists
-              if await self._validate(not self.store.teams.loc[self.store.teams['Code'] == team_code].empty, f"Team {team_code} not found."): return;
-
-              self.args = self.args[1:]
-            else:
-              team_code = self.user.team
-
-            team = self.store.teams.loc[self.store.teams['Code'] == team_code]
-            if not team.empty and team.iloc[0]['Voting'] == 0:
-                await send_text_to_room(
-                    self.client, self.room.room_id,
-                    "Sorry, you are not allowed to vote."
-                )
-                return
-
-            self.user.team = team_code
-            await self._vote()
-
-        elif self.command.startswith("accounts"):
-            if not self.user.is_leader():
-                await send_text_to_room(
-                    self.client, self.room.room_id,
-                    "Only Team Leader and Deputy Leader can use this command."
-                )
-                return
-
-            await self._show_accounts()
-
-        elif self.command.startswith("objection"):
-            if not self.user.is_leader() and not self.user.is_sc():
-                await send_text_to_room(
-                    self.client, self.room.room_id,
-                    "Only Team Leaders, Deputy Leaders and SC members can use this command."
-                )
-                return
-
-            await self._objection()
-
-        else:
+        words = self.command.split(maxsplit=1)
+        spec = COMMANDS.get(words[0].lower()) if words else None
+        if spec is None:
             await self._unknown_command()
+            return
 
+        if spec.allowed is not None and not spec.allowed(self.user):
+            await send_text_to_room(self.client, self.room.room_id, spec.denied)
+            return
+
+        command_invocations.labels(spec.name).inc()
+        start = time.perf_counter()
+        try:
+            await spec.handler(self)
+        except Exception:
+            command_errors.labels(spec.name).inc()
+            raise
+        finally:
+            command_latency.labels(spec.name).observe(time.perf_counter() - start)
+
+    @command("echo")
     async def _echo(self):
         """Echo back the command's arguments"""
         response = " ".join(self.args)
         await send_text_to_room(self.client, self.room.room_id, response)
 
+    @command("react")
     async def _react(self):
         """Make the bot react to the command message"""
         # React with a start emoji
@@ -222,27 +280,17 @@ class Command:
             self.client, self.room.room_id, self.event.event_id, reaction
         )
 
+    @command("help")
     async def _show_help(self):
         """Show the help text"""
 
-        text = ""
-        text += "Hello, I am IOI 2025 bot. I understand several commands:  \n\n"
-        text += "- `info`: shows various team information\n"
-        text += "- `accounts`: shows various accounts for your team\n"
-        text += "- `vote`: casts vote for your team\n"
-
-        await send_text_to_room(self.client, self.room.room_id, text)
+        await send_text_to_room(self.client, self.room.room_id, HELP_TEXT)
 
+    @command("info")
     async def _show_info(self):
         """Show team info"""
         if not self.args:
-            text = (
-                "Usage:  \n\n"
-                "`info <3-letter-country-code>|ic|sc|tc`: shows team/IC/SC/TC members  \n\n"
-                "Examples:  \n\n"
-                "- `info IDN`  \n"
-                "- `info ic`  \n"
-            )
+            text = INFO_USAGE
             await send_text_to_room(self.client, self.room.room_id, text)
             return
 
@@ -266,11 +314,12 @@ class Command:
                 if idx > 0:
                     response += "  \n  \n"
                 response += f"{role}:  \n"
-                for index, member in leaders.iterrows():
-                    if member['Role'] == role and member['Chair'] == 1:
+                members = self.store.roster.members.get(role, ())
+                for member in members:
+                    if member['Chair'] == 1:
                         response += f"  \n- {make_pill(member['UserID'], self.config.homeserver_url)} (Chair) | {member['Name']}"
-                for index, member in leaders.iterrows():
-                    if member['Role'] == role and member['Chair'] != 1:
+                for member in members:
+                    if member['Chair'] != 1:
                         response += f"  \n- {make_pill(member['UserID'], self.config.homeserver_url)} | {member['Name']}"
 
             await send_text_to_room(self.client, self.room.room_id, response)
@@ -332,7 +381,7 @@ class Command:
 
         text += '\n'
 
-        poll_choices.sort(key=lambda x: x[0]) # sort by id
+        poll_choices = sorted(poll_choices, key=lambda x: x[0]) # sort by id
         if user_choices is not None:
             for i, (poll_choice_id, choice, marker) in enumerate(poll_choices):
                 text += f'{ "**" if poll_choice_id in user_choices else ""}{i + 1}.&emsp;{marker}&emsp;{choice}{ "**" if poll_choice_id in user_choices else ""}  \n'
@@ -343,35 +392,8 @@ class Command:
         return text
 
 
-    @assume(lambda self: self.args, (
-                "Usage:  \n\n"
-                '- `poll new [--options ...] "<question>" "<mark1>/<choice 1>" "<mark 2>/<choice 2>" "<mark3>/<choice 3>" ... `: create new poll  \n'
-                '- `poll update <poll-id> [--options ...] "<question>" "<mark 1>/<choice 1>" "<mark 2>/<choice 2>" "<mark 3>/<choice 3>" ...`: update existing poll  \n'
-                '- `poll update <poll-id> [--options ...] "[question]"`: update existing poll but leave the choices  \n'
-                '- `poll list`: show list of created polls  \n'
-                '- `poll clear-display`: clears the displayed poll from the web interface  \n'
-                '- `poll activate <poll-id>`: activate a poll  \n'
-                '- `poll close`: deactivate all polls  \n\n'
-
-                'Ooptions for `new` and `update`:  \n'
-                '    - `-a, --anonymous`: make the poll anonymous  \n'
-                '    - `-m, --multiple-choice`: allow multiple choices  \n'
-                '    - `-d, --display`: set to show  \n'
-                '    - `-s, --start`: set to active if no other pool is open  \n\n'
-
-                'Note:  if an argument consists of multiple words you can wrap it in double quotes, otherwise you don\'t have to.  \n\n'
-
-                "Examples:  \n"
-                '- `poll new "What is your favorite color?" 🟥/Red 🟧/Orange 🟨/Yellow 🟩/Green 🟦/Blue`: creates a poll  \n'
-                '- `poll new -ds "Question?" "✅/Vote for motion" "❌/Vote against motion" "➖/Abstain"`: creates, displays and starts a poll   \n'
-                '- `poll new --anonymous "What is your favorite number?" "1️⃣/One" "2️⃣/Two" "3️⃣/Three" "4️⃣/Four"`: creates an anonymous poll   \n'
-
-                '- `poll new  --multiple-choice --anonymous "What is your favorite letter?" "A" "B" "🅾️/O"`: creates an anonym, multiple choice poll   \n'
-                '- `poll new "Is this a question?" yes no abstain"`: creates a poll with the default markers  \n'
-                '- `poll update 1 -ma "What is 1+1?" one two three`: changes the existing poll 1 to be anonym and multiple choice, also rewrites the question and answers  \n'
-                '- `poll update 1 -d`: sets poll 1 to be displayed  \n'
-                '- `poll activate 10`: opens poll 10 for voting  \n'
-    ))
+    @command("poll", allowed=User.is_tc, denied=ONLY_HTC)
+    @assume(lambda self: self.args, POLL_USAGE)
     async def _manage_poll(self):
         def _get_options(args):
             ANONYM  = int(0b0001)
@@ -430,38 +452,23 @@ class Command:
             if await self._validate(all(markers.count(marker) == 1 for marker in markers), f"Command format is invalid, there are duplicate markers. Send `poll` to see all commands."): return;
             if await self._validate(all([choices.count(choice) == 1 for choice in choices]), f"Command format is invalid, there are duplicate choices. Send `poll` to see all commands."): return;
 
-            status = 0
-            if start:
-                poll_id = await self.store.conn.fetchval('SELECT poll_id FROM polls WHERE status = 1')
-                status = 1 if poll_id is None else 0
-
-            if display:
-                await self.store.conn.execute('UPDATE polls SET display = false')
-
-            poll_id = await self.store.conn.fetchval(
-                '''INSERT INTO polls (question, status, display, anonymous, multiple_choice)
-                VALUES ($1, $2, $3, $4, $5) RETURNING poll_id''',
-                question, status, display, anonymous, multiple_choice
-            )
-
-            await self.store.conn.executemany(
-                '''INSERT INTO poll_choices (poll_id, choice, marker)
-                VALUES ($1, $2, $3)''', zip(repeat(poll_id), choices, markers))
+            poll = await self.store.polls.create(
+                question, choices, markers, anonymous, multiple_choice, display, start)
 
             text = self._get_poll_display(
-                poll_id = poll_id,
-                question = question,
-                status = status,
-                display = display,
-                anonymous = anonymous,
-                multiple_choice = multiple_choice,
-                poll_choices = list(zip(range(len(choices)), choices, markers)),
+                poll_id = poll.poll_id,
+                question = poll.question,
+                status = poll.status,
+                display = poll.display,
+                anonymous = poll.anonymous,
+                multiple_choice = poll.multiple_choice,
+                poll_choices = poll.choices,
                 user_choices = None,
             )
 
-            if start == 1 and status == 0:
+            if start and poll.status == 0:
                 text += '\n\n'
-                text += f'Poll {poll_id} is **inactive**, beacause another poll is still active.  \n'
+                text += f'Poll {poll.poll_id} is **inactive**, beacause another poll is still active.  \n'
 
             if err:
                 text += '\n\n'
@@ -470,11 +477,6 @@ class Command:
             await send_text_to_room(self.client, self.room.room_id, text)
 
         async def _update(poll_id, args):
-            row = await self.store.conn.fetchrow('SELECT question, status FROM polls WHERE poll_id = $1', poll_id)
-            if row is None:
-                return await self.send_text(f"Poll {poll_id} does not exist.  \n\nSend `poll list` to see all created polls.  \n")
-            (question_db, status) = row
-
             input_poll = ' '.join(args)
 
             try:
@@ -487,35 +489,31 @@ class Command:
               return
 
             if not anonymous and not multiple_choice and not start and len(arguments) == 0 and display == 1: # only the display is changed
-                await self.store.conn.execute('UPDATE polls SET display = (poll_id = $1)', poll_id)
+                try:
+                    await self.store.polls.show(poll_id)
+                except PollError as e:
+                    return await self.send_text(str(e))
                 await send_text_to_room(self.client, self.room.room_id, f'Poll {poll_id} is now displayed.  \n')
                 return
 
-            if await self._validate(status == 0, f"Poll {poll_id} is {['inactive', 'active', 'closed'][status]}, it cannot be updated  \n"): return;
-
             if len(arguments) <= 1: # only update the question
-                if display:
-                    await self.store.conn.execute('UPDATE polls SET display = false', poll_id)
-
-                question = arguments[0] if len(arguments) == 1 else question_db
+                question = arguments[0] if len(arguments) == 1 else None
 
-                await self.store.conn.execute(
-                    'UPDATE polls SET question = $1, display = $2, anonymous = $3, multiple_choice = $4 WHERE poll_id = $5',
-                    question, anonymous, display, multiple_choice, poll_id)
-
-                # get poll choices
-                poll_choices = await self.store.conn.fetch(
-                        'SELECT poll_choice_id, choice, marker FROM poll_choices WHERE poll_id = $1', poll_id)
-                if await self._validate(poll_choices, f"Internal server error while updating a poll.  \n"): return;
+                try:
+                    poll = await self.store.polls.update(
+                        poll_id, question, anonymous, multiple_choice, display)
+                except PollError as e:
+                    return await self.send_text(str(e))
+                if await self._validate(poll.choices, f"Internal server error while updating a poll.  \n"): return;
 
                 text = self._get_poll_display(
                     poll_id = poll_id,
-                    question = question,
-                    status = status,
-                    display = display,
-                    anonymous = anonymous,
-                    multiple_choice = multiple_choice,
-                    poll_choices = poll_choices,
+                    question = poll.question,
+                    status = poll.status,
+                    display = poll.display,
+                    anonymous = poll.anonymous,
+                    multiple_choice = poll.multiple_choice,
+                    poll_choices = poll.choices,
                     user_choices = None,
                 )
 
@@ -552,27 +550,20 @@ class Command:
             if await self._validate(all(markers.count(marker) == 1 for marker in markers), f"Command format is invalid, there are duplicate markers. Send `poll` to see all commands."): return;
             if await self._validate(all([choices.count(choice) == 1 for choice in choices]), f"Command format is invalid, there are duplicate choices. Send `poll` to see all commands."): return;
 
-
-            if display:
-                await self.store.conn.execute('UPDATE polls SET display = 0')
-
-            await self.store.conn.execute(
-                'UPDATE polls SET question = $1, display = $2, anonymous = $3, multiple_choice = $4 WHERE poll_id = $5',
-                question, anonymous, display, multiple_choice, poll_id)
-
-            await self.store.conn.execute('DELETE FROM poll_choices WHERE poll_id = $1', poll_id)
-            await self.store.conn.executemany(
-                '''INSERT INTO poll_choices (poll_id, choice, marker)
-                VALUES ($1, $2, $3)''', zip(repeat(poll_id), choices, markers))
+            try:
+                poll = await self.store.polls.update(
+                    poll_id, question, anonymous, multiple_choice, display, choices, markers)
+            except PollError as e:
+                return await self.send_text(str(e))
 
             text = self._get_poll_display(
                 poll_id = poll_id,
-                question = question,
-                status = status,
-                display = display,
-                anonymous = anonymous,
-                multiple_choice = multiple_choice,
-                poll_choices = list(zip(range(len(choices)), choices, markers)),
+                question = poll.question,
+                status = poll.status,
+                display = poll.display,
+                anonymous = poll.anonymous,
+                multiple_choice = poll.multiple_choice,
+                poll_choices = poll.choices,
                 user_choices = None,
             )
 
@@ -586,125 +577,78 @@ class Command:
 
             await send_text_to_room(self.client, self.room.room_id, text)
 
-        async def _list():
-            poll_list = await self.store.conn.fetch(
-                    'SELECT poll_id, question, status, display, anonymous, multiple_choice FROM polls')
+        async def _list(args):
+            status = None
+            # ID of the last poll before the page
+            after = 0
+
+            options = iter(args)
+            for option in options:
+                value = next(options, None)
+                if option == '--status':
+                    if await self._validate(value in STATUSES, f"Status must be one of {', '.join(STATUSES)}."): return;
+                    status = STATUSES.index(value)
+                elif option in ('--page', '--since'):
+                    if await self._validate(value is not None and len(value) < 10 and value.isdigit(), "Poll ID must be an integer."): return;
+                    after = max(after, int(value) if option == '--page' else int(value) - 1)
+                else:
+                    return await self.send_text(f"Unknown option {option}. Send `poll` to see all commands.")
 
-            if await self._validate(poll_list, "No polls have been created."): return;
+            polls, more = await self.store.polls.page(status, after, POLL_LIST_PAGE_SIZE)
 
-            poll_choices_ungrouped = await self.store.conn.fetch(
-                'SELECT poll_id, choice, marker FROM poll_choices')
+            if not polls:
+                if status is None and after == 0:
+                    return await self.send_text("No polls have been created.")
+                return await self.send_text("No polls found.")
 
-            text = '## Created polls'
-            poll_choices = dict()
-            for poll_id, choice, marker in poll_choices_ungrouped:
-                if poll_id not in poll_choices:
-                    poll_choices[poll_id] = []
-                poll_choices[poll_id].append(f"{marker} / {choice}")
+            blocks = ['## Created polls']
+            for poll in polls:
+                text = f'### [{poll.poll_id}] {poll.question}  \n'
+                text += f'anonymous: {"Yes" if poll.anonymous else "No"}  \n'
+                text += f'multiple choice: {"Yes" if poll.multiple_choice else "No"}  \n'
+                text += f'status: {STATUSES[poll.status]}  \n'
+                text += f"{'Results are shown' if poll.display else 'Results are hidden'}  \n\n"
 
-            for poll_id, question, status, display, anonymous, multiple_choice  in poll_list:
-                text += '\n\n'
-                text += f'### [{poll_id}] {question}  \n'
-                text += f'anonymous: {"Yes" if anonymous else "No"}  \n'
-                text += f'multiple choice: {"Yes" if multiple_choice else "No"}  \n'
-                text += f'status: {["inactive", "active", "closed"][status]}  \n'
-                text += f"{'Results are shown' if display else 'Results are hidden'}  \n\n"
+                for _, choice, marker in poll.choices:
+                    text += f'- {marker} / {choice}  \n'
+                blocks.append(text)
 
-                for choice in poll_choices[poll_id]:
-                    text += f'- {choice}  \n'
+            if more:
+                filters = f" --status {STATUSES[status]}" if status is not None else ""
+                blocks.append(f"Send `poll list{filters} --page {polls[-1].poll_id}` to see the next polls.")
 
-            await send_text_to_room(self.client, self.room.room_id, text)
+            # one message for all polls could exceed the event size limit
+            for message in split_message(blocks):
+                await send_text_to_room(self.client, self.room.room_id, message)
 
         async def _activate(poll_id = None):
             if poll_id is None:
-                poll_details = await self.store.conn.fetchrow(
-                    'SELECT poll_id, question, status, display, anonymous, multiple_choice FROM polls WHERE status = 1')
-                if poll_details is None:
-                    return await self.send_text("There is no active poll.")
-
-                poll_id, question, status, display, anonymous, multiple_choice = poll_details
-                poll_choices = await self.store.conn.fetch(
-                    'SELECT poll_choice_id, choice, marker FROM poll_choices WHERE poll_id = $1', poll_id)
-                if await self._validate(poll_choices, "Internal server error: There are no choices for this poll!"): return;
-
-                text = self._get_poll_display(
-                    poll_id = poll_id,
-                    question = question,
-                    status = status,
-                    display = display,
-                    anonymous = anonymous,
-                    multiple_choice = multiple_choice,
-                    poll_choices = poll_choices,
-                    user_choices = None,
-                )
-
-                await send_text_to_room(self.client, self.room.room_id, text)
-                return
-
-            status = await self.store.conn.fetchval(
-                'SELECT status FROM polls WHERE poll_id = $1', poll_id)
-            if status is None:
-                return await self.send_text(f"Poll {poll_id} does not exist.  \n\nSend `poll list` to see all created polls.  \n")
-            if await self._validate(status == 0, f"Poll {poll_id} is {['inactive', 'active', 'closed'][status]}, it cannot be activated  \n"): return;
-
-            active_id = await self.store.conn.fetchval(
-                'SELECT poll_id FROM polls WHERE status = 1')
-            if active_id is not None:
-                return await self.send_text(f"Poll {active_id} is already active. Only one poll can be active at any time.  \n")
-
-            await self.store.conn.execute('UPDATE polls SET status = 1 WHERE poll_id = $1', poll_id)
-            poll_details = await self.store.conn.fetchrow(
-                'SELECT question, status, display, anonymous, multiple_choice FROM polls WHERE poll_id = $1', poll_id)
-            if poll_details is None:
-                return await self.send_text(f"Poll {poll_id} does not exist.  \n\nSend `poll list` to see all created polls.  \n")
-
-            question, status, display, anonymous, multiple_choice = poll_details
-
-            poll_choices = await self.store.conn.fetch(
-                'SELECT poll_choice_id, choice, marker FROM poll_choices WHERE poll_id = $1', poll_id)
+                poll = await self.store.polls.active()
+                if poll is None:
+                    return await self.send_text(NO_ACTIVE_POLL)
+                if await self._validate(poll.choices, "Internal server error: There are no choices for this poll!"): return;
+            else:
+                try:
+                    poll = await self.store.polls.activate(poll_id)
+                except PollError as e:
+                    return await self.send_text(str(e))
 
             text = self._get_poll_display(
-                poll_id = poll_id,
-                question = question,
-                status = status,
-                display = display,
-                anonymous = anonymous,
-                multiple_choice = multiple_choice,
-                poll_choices = poll_choices,
+                poll_id = poll.poll_id,
+                question = poll.question,
+                status = poll.status,
+                display = poll.display,
+                anonymous = poll.anonymous,
+                multiple_choice = poll.multiple_choice,
+                poll_choices = poll.choices,
                 user_choices = None,
             )
 
             await send_text_to_room(self.client, self.room.room_id, text)
 
         async def _close():
-            active = await self.store.conn.fetchrow(
-                'SELECT poll_id, anonymous FROM polls WHERE status = 1')
-            if active is None:
-                return await self.send_text("There is no active poll.")
-            poll_id, anonymous = active
-
-            if anonymous:
-                poll_choices = await self.store.conn.fetch(
-                    'SELECT poll_choice_id FROM poll_choices WHERE poll_id = $1', poll_id)
-
-                results = dict()
-                for (poll_choice_id,) in poll_choices:
-                    results[poll_choice_id] = 0
-
-                votes = await self.store.conn.fetch(
-                    'SELECT poll_choice_id FROM poll_anonym_active_votes')
-                for (vote,) in votes:
-                    results[vote] += 1
-
-                await self.store.conn.executemany(
-                    'INSERT INTO poll_anonym_votes (poll_choice_id, poll_id, count) VALUES ($1, $2, $3)',
-                    [(poll_choice_id, poll_id, count) for poll_choice_id, count in results.items()])
-
-                await self.store.conn.execute('UPDATE polls SET status = 2 WHERE poll_id = $1', poll_id)
-                await self.store.conn.execute('DELETE FROM poll_anonym_active_votes')
-
-            else: # not anonymous
-                await self.store.conn.execute('UPDATE polls SET status = 2 WHERE poll_id = $1', poll_id)
+            if await self.store.polls.close() is None:
+                return await self.send_text(NO_ACTIVE_POLL)
 
             await send_text_to_room(
                 self.client, self.room.room_id,
@@ -712,6 +656,28 @@ class Command:
             )
 
 
+        async def _export(poll_id):
+            if poll_id is not None:
+                anonymous = await self.store.conn.fetchval(
+                    'SELECT anonymous FROM polls WHERE poll_id = $1', poll_id)
+                if await self._validate(anonymous is not None, f"Poll {poll_id} does not exist."): return;
+                if await self._validate(not anonymous, "Votes of anonymous polls cannot be exported."): return;
+
+            filename = f"poll-{poll_id or 'all'}-votes.csv"
+            # spool to disk, the upload needs the size up front
+            with tempfile.TemporaryFile() as file:
+                async def write(chunk):
+                    file.write(chunk)
+
+                count = await self.store.export_votes(write, poll_id)
+                if await self._validate(count > 0, "There are no votes to export."): return;
+
+                filesize = file.tell()
+                file.seek(0)
+                if not await send_file_to_room(
+                        self.client, self.room, file, filename, "text/csv", filesize):
+                    await send_text_to_room(self.client, self.room.room_id, "Uploading the export failed.")
+
         if self.args[0].lower() == 'new':
             input_poll = ' '.join(self.args[1:])
             try:
@@ -733,8 +699,17 @@ class Command:
             await _update(poll_id, args)
 
         elif self.args[0].lower() == 'list':
-            if await self._validate(len(self.args) == 1, "Command format is invalid. Send `poll` to see all commands."): return;
-            await _list()
+            await _list(self.args[1:])
+
+        elif self.args[0].lower() == 'export':
+            if await self._validate(len(self.args) == 2, "Command format is invalid. Send `poll` to see all commands."): return;
+            poll_id = self.args[1]
+            if poll_id.lower() == 'all':
+                poll_id = None
+            else:
+                if await self._validate(len(poll_id) < 10 and poll_id.isdigit(), "Poll ID must be an integer."): return;
+                poll_id = int(poll_id)
+            await _export(poll_id)
 
         elif self.args[0].lower() == 'activate':
             if await self._validate(len(self.args) <= 2, "Command format is invalid. Send `poll` to see all commands."): return;
@@ -749,34 +724,57 @@ class Command:
             await _close()
 
         elif self.args[0] == 'clear-display':
-            await self.store.conn.execute('UPDATE polls SET display = false')
+            await self.store.polls.clear_display()
             await send_text_to_room(self.client, self.room.room_id, "Display cleared.")
 
         else:
             await send_text_to_room(self.client, self.room.room_id, "Unknown command. Send `poll` to see all available commands.  \n")
 
+    @command("vote", allowed=User.is_leader, denied=ONLY_LEADERS)
     async def _vote(self):
-        poll_details = await self.store.conn.fetchrow(
-            'SELECT poll_id, question, anonymous, multiple_choice FROM polls WHERE status = 1')
-        if poll_details is None:
-            return await self.send_text("There is no active poll.")
-        poll_id, question, anonymous, multiple_choice = poll_details
-
-        poll_choices = await self.store.conn.fetch(
-            'SELECT poll_choice_id, choice, marker FROM poll_choices WHERE poll_id = $1', poll_id)
-        if await self._validate(poll_choices, "Internal server error: There are no choices for this poll!"): return;
+        if self.user.is_tc():
+          if len(self.args) == 0:
+            await send_text_to_room(
+                self.client, self.room.room_id,
+                "Usage: `vote <3-letter-country-code> [choices]`"
+            )
+            return
+          if await self._validate(len(self.args) > 0, "Usage: `vote [choices]`"): return;
+          team_code = self.args[0].upper()
+          # if team code to upper does not exists
+          if await self._validate(team_code in self.store.roster.teams, f"Team {team_code} not found."): return;
 
-        poll_choices.sort(key=lambda x: x[0])
+          self.args = self.args[1:]
+        else:
+          team_code = self.user.team
+
+        team = self.store.roster.teams.get(team_code)
+        if team is not None and team['Voting'] == 0:
+            await send_text_to_room(
+                self.client, self.room.room_id,
+                "Sorry, you are not allowed to vote."
+            )
+            return
+
+        self.user.team = team_code
+
+        # the definition is cached, so only recording the vote touches the database
+        poll = await self.store.polls.active()
+        if poll is None:
+            return await self.send_text(NO_ACTIVE_POLL)
+        poll_id, question = poll.poll_id, poll.question
+        anonymous, multiple_choice = poll.anonymous, poll.multiple_choice
+
+        poll_choices = poll.choices
+        if await self._validate(poll_choices, "Internal server error: There are no choices for this poll!"): return;
 
         if not self.args:
             if anonymous:
                 choice = await self.store.conn.fetch(
-                    'SELECT poll_choice_id FROM poll_anonym_active_votes WHERE team_code = $1',
-                    self.user.team)
+                    queries.TEAM_ANONYM_VOTE, self.user.team)
             else: # not anonymous
                 choice = await self.store.conn.fetch(
-                    'SELECT poll_choice_id FROM poll_votes WHERE poll_id = $1 AND team_code = $2',
-                    poll_id, self.user.team)
+                    queries.TEAM_VOTE, poll_id, self.user.team)
 
             choices = [c for (c,) in choice]
 
@@ -807,9 +805,10 @@ class Command:
         if len(self.args) == 1:
             if self.args[0].lower() == 'delete':
                 if anonymous:
-                    await self.store.conn.execute('DELETE FROM poll_anonym_active_votes WHERE team_code = $1', self.user.team)
+                    await self.store.conn.execute(queries.DELETE_TEAM_ANONYM_VOTE, self.user.team)
                 else:
-                    await self.store.conn.execute('DELETE FROM poll_votes WHERE poll_id = $1 AND team_code = $2', poll_id, self.user.team)
+                    await self.store.conn.execute(queries.DELETE_TEAM_VOTE, poll_id, self.user.team)
+                self.store.poll_changed()
 
                 await send_text_to_room(self.client, self.room.room_id, "Your vote has been deleted.")
                 return
@@ -827,22 +826,23 @@ class Command:
             choices = [int(self.args[0])]
             if await self._validate(choices[0] >= 1 and choices[0] <= len(poll_choices), f"Invalid vote: Your vote must be between 1 and {len(poll_choices)}."): return;
 
+        # the previous vote of the team is replaced atomically by the database
+        user_choices = [poll.choice_id(choice) for choice in choices]
         if anonymous:
-            await self.store.conn.execute('DELETE FROM poll_anonym_active_votes WHERE team_code = $1', self.user.team)
-
-            user_choices = [poll_choices[choice - 1][0] for choice in choices]
-            await self.store.conn.executemany(
-                '''INSERT INTO poll_anonym_active_votes (poll_choice_id, poll_id, team_code)
-                VALUES ($1, $2, $3)''', zip(user_choices, repeat(poll_id), repeat(self.user.team)))
-
+            recorded = await self.store.conn.fetchval(
+                queries.RECORD_ANONYM_VOTE,
+                poll_id, self.user.team, user_choices)
         else: # not anonymous
-            await self.store.conn.execute('DELETE FROM poll_votes WHERE poll_id = $1 AND team_code = $2', poll_id, self.user.team)
+            recorded = await self.store.conn.fetchval(
+                queries.RECORD_VOTE,
+                poll_id, self.user.team, self.user.username, user_choices)
+
+        if not recorded:
+            # the poll was closed behind the cache's back
+            self.store.polls.changed()
+            return await self.send_text(NO_ACTIVE_POLL)
 
-            user_choices = [poll_choices[choice - 1][0] for choice in choices]
-            await self.store.conn.executemany(
-                '''INSERT INTO poll_votes (poll_choice_id, poll_id, team_code, voted_by)
-                VALUES ($1, $2, $3, $4)''',
-                zip(user_choices, repeat(poll_id), repeat(self.user.team), repeat(self.user.username)))
+        self.store.poll_changed()
 
         text = self._get_poll_display(
             poll_id = None,
@@ -858,18 +858,22 @@ class Command:
 
         await send_text_to_room(self.client, self.room.room_id, text)
 
+    @command("refresh", allowed=User.is_tc, denied=ONLY_HTC)
     async def _refresh(self):
-        self.store.reload_csv()
+        try:
+            await self.store.reload_csv()
+        except DatasourceError as e:
+            await send_text_to_room(
+                self.client, self.room.room_id,
+                f"Refresh failed, the previous data is still in use.  \n\n{e}"
+            )
+            return
         await send_text_to_room(self.client, self.room.room_id, "Successfully refreshed!")
 
+    @command("accounts", allowed=User.is_leader, denied=ONLY_LEADERS)
     async def _show_accounts(self):
         if not self.args:
-            text = (
-                "Usage:  \n\n"
-                "- `accounts early-practice`: Show accounts for the early practice contest  \n"
-                "- `accounts contest`: Show online contestant accounts for the actual practice/contest days  \n"
-                "- `accounts translation`: Show team account for translation system  \n"
-            )
+            text = ACCOUNTS_USAGE
             await send_text_to_room(self.client, self.room.room_id, text)
             return
 
@@ -948,15 +952,14 @@ class Command:
                 "Command format is invalid. Send `accounts` to see all commands."
             )
 
+    @command(
+        "objection",
+        allowed=lambda user: user.is_leader() or user.is_sc(),
+        denied=ONLY_OBJECTION_ROLES,
+    )
     async def _objection(self):
         if not self.args:
-            text = (
-                "Usage:  \n\n"
-                "- `!c objection <Optional: Major/Minor> <content>`: Send objection to the SC.  \n\n"
-                "Examples:  \n"
-                "- `!c objection Major We had a very similar problem in our practice contest!`: Send Major objection to the SC.  \n"
-                "- `!c objection It is not specified for the intervals whether they are open or closed`: Send (default) Minor objection to the SC.  \n"
-            )
+            text = OBJECTION_USAGE
             await send_text_to_room(self.client, self.room.room_id, text)
             return
 
@@ -975,15 +978,13 @@ class Command:
             content = ' '.join(self.args[0:])
 
 
-        objection_rooms = self.store.objection_rooms
-        sc_room_id = objection_rooms.loc[objection_rooms['Objection Room ID'] == self.room.room_id, ['SC Room ID']]
-        if sc_room_id.empty:
+        sc_room_id = self.store.roster.sc_rooms.get(self.room.room_id)
+        if sc_room_id is None:
             await send_text_to_room(
                 self.client, self.room.room_id,
                 "This room is not an objection room. Please contact HTC for details."
             )
             return
-        sc_room_id = sc_room_id.values[0][0]
 
         original_post = f"https://matrix.to/#/{self.room.room_id}/{self.event.event_id}?via={self.config.homeserver_url}"
 
@@ -994,7 +995,15 @@ class Command:
             f"Original: {original_post}"
 
         )
-        sc_message_response = await send_text_to_room(self.client, sc_room_id, sc_message)
+        # The SC message starts the thread further additions are forwarded to
+        sc_message_response = await send_text_to_room(
+            self.client, sc_room_id, sc_message, wait=True)
+        if not isinstance(sc_message_response, RoomSendResponse):
+            await send_text_to_room(
+                self.client, self.room.room_id,
+                "Your objection could not be sent to the SC. Please try again later."
+            )
+            return
 
         objection_room_text = (
             "Your objection has been sent to the SC.  \n\n"
@@ -1002,9 +1011,8 @@ class Command:
         )
         obj_thread_id = self.event.event_id
 
-        await self.store.conn.execute(
-            '''INSERT INTO listening_threads (obj_room_id, sc_room_id, obj_thread_id, sc_thread_id)
-            VALUES ($1, $2, $3, $4)''', self.room.room_id, sc_room_id, obj_thread_id, sc_message_response.event_id)
+        await self.store.add_objection_thread(
+            self.room.room_id, sc_room_id, obj_thread_id, sc_message_response.event_id)
 
         await send_text_to_thread(
             self.client, self.room.room_id,
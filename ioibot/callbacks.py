@@ -1,4 +1,6 @@
 import logging
+import time
+from typing import Hashable
 
 from nio import (
     AsyncClient,
@@ -8,6 +10,7 @@ from nio import (
     MegolmEvent,
     RoomGetEventError,
     RoomMessageText,
+    SyncResponse,
     UnknownEvent,
 )
 
@@ -15,10 +18,19 @@ from ioibot.bot_commands import Command
 from ioibot.chat_functions import make_pill, react_to_event, send_text_to_room
 from ioibot.config import Config
 from ioibot.message_responses import Message
+from ioibot.metrics import Counter, Histogram
 from ioibot.storage import Storage
 
 logger = logging.getLogger(__name__)
 
+events_processed = Counter(
+    "ioibot_events_processed_total", "Events handled by the callbacks", ["type"])
+sync_duration = Histogram(
+    "ioibot_sync_duration_seconds",
+    "Time between two consecutive sync responses",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 20.0, 30.0, 35.0, 45.0, 60.0, 120.0),
+)
+
 
 class Callbacks:
     def __init__(self, client: AsyncClient, store: Storage, config: Config):
@@ -34,6 +46,35 @@ class Callbacks:
         self.store = store
         self.config = config
         self.command_prefix = config.command_prefix
+        self._last_sync = None
+
+    async def sync(self, response: SyncResponse) -> None:
+        """Callback for every sync response, records how long a sync loop iteration took
+
+        Args:
+            response: The sync response.
+        """
+        now = time.monotonic()
+        if self._last_sync is not None:
+            sync_duration.observe(now - self._last_sync)
+        self._last_sync = now
+
+    def message_key(self, room: MatrixRoom, event: RoomMessageText) -> Hashable:
+        """The key messages are ordered by when dispatched to the workers.
+
+        Votes are ordered per sender, whichever room they are cast in, so a later
+        vote always replaces an earlier one. Everything else is ordered per room.
+        """
+        msg = event.body
+        if msg.startswith(self.command_prefix):
+            msg = msg[len(self.command_prefix) :]
+        elif room.member_count > 2:
+            return room.room_id
+
+        words = msg.split(maxsplit=1)
+        if words and words[0].lower() == "vote":
+            return event.sender
+        return room.room_id
 
     async def message(self, room: MatrixRoom, event: RoomMessageText) -> None:
         """Callback for when a message event is received
@@ -43,6 +84,8 @@ class Callbacks:
 
             event: The event defining the message.
         """
+        events_processed.labels("m.room.message").inc()
+
         # Extract the message text
         msg = event.body
 
@@ -63,6 +106,10 @@ class Callbacks:
         # room.member_count > 2 ... we assume a public room
         # room.member_count <= 2 ... we assume a DM
         if not has_command_prefix and room.member_count > 2:
+            # Only objection rooms listen to general messages
+            if room.room_id not in self.store.roster.sc_rooms:
+                return
+
             # General message listener
             message = Message(self.client, self.store, self.config, msg, room, event)
             await message.process()
@@ -85,6 +132,7 @@ class Callbacks:
 
             event: The invite event.
         """
+        events_processed.labels("invite").inc()
         logger.debug(f"Got invite to {room.room_id} from {event.sender}.")
 
         # Attempt to join 3 times before giving up
@@ -167,6 +215,8 @@ class Callbacks:
 
             event: The encrypted event that we were unable to decrypt.
         """
+        events_processed.labels("m.room.encrypted").inc()
+
         # TODO(niklaci): Find a way to avoid decryption errors for past messages when restarting the bot.
         # The users will get reactions from the bot for even messages of last year, and sometimes
         # it is topped by some "Unable to decrypt message" messages.
@@ -204,6 +254,8 @@ class Callbacks:
 
             event: The event itself.
         """
+        events_processed.labels(event.type).inc()
+
         if event.type == "m.reaction":
             # Get the ID of the event this was a reaction to
             relation_dict = event.source.get("content", {}).get("m.relates_to", {})
@@ -1,5 +1,6 @@
 import logging
-from typing import Optional, Union
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterable, List, Optional, Union
 
 from markdown import markdown
 
@@ -10,11 +11,110 @@ from nio import (
     MegolmEvent,
     Response,
     RoomSendResponse,
-    SendRetryError,
+    UploadResponse,
 )
 
+from ioibot.metrics import Counter
+from ioibot.outbound import get_scheduler
+
 logger = logging.getLogger(__name__)
 
+# number of rendered messages kept by render_markdown
+MARKDOWN_CACHE_SIZE = 1024
+# longer messages are mostly one-off listings, don't let them push others out
+MARKDOWN_CACHE_MAX_LENGTH = 4096
+# bytes of body per message of a split text, the rendered HTML is sent along with
+# it and both have to fit the homeserver's 64KiB event size limit
+MAX_MESSAGE_BYTES = 8192
+
+markdown_renders = Counter(
+    "ioibot_markdown_renders_total", "Markdown conversions by cache result", ["result"])
+
+# message -> HTML of texts registered with register_templates, never evicted
+_rendered_templates: Dict[str, str] = {}
+# message -> HTML of recently sent messages, least recently used first
+_rendered_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def register_templates(*messages: str) -> None:
+    """Render static message texts once, so sending them never runs markdown again"""
+    for message in messages:
+        _rendered_templates[message] = markdown(message)
+
+
+def render_markdown(message: str) -> str:
+    """Convert a message to HTML, reusing the result for messages sent before"""
+    html = _rendered_templates.get(message)
+    if html is None:
+        html = _rendered_cache.get(message)
+        if html is None:
+            markdown_renders.labels("miss").inc()
+            html = markdown(message)
+            if len(message) <= MARKDOWN_CACHE_MAX_LENGTH:
+                _rendered_cache[message] = html
+                if len(_rendered_cache) > MARKDOWN_CACHE_SIZE:
+                    _rendered_cache.popitem(last=False)
+            return html
+        _rendered_cache.move_to_end(message)
+
+    markdown_renders.labels("hit").inc()
+    return html
+
+
+async def _queue_send(
+    client: AsyncClient,
+    room_id: str,
+    message_type: str,
+    content: dict,
+    wait: bool,
+    coalesce: bool = False,
+) -> Optional[Union[RoomSendResponse, ErrorResponse]]:
+    """Hand an event to the client's outbound scheduler, optionally waiting for it"""
+    # A caller waiting for the response needs the ID of an event of its own
+    coalesce = coalesce and not wait
+    response = get_scheduler(client).send(room_id, message_type, content, coalesce)
+    if wait:
+        return await response
+    return None
+
+
+def split_message(blocks: Iterable[str], limit: int = MAX_MESSAGE_BYTES) -> List[str]:
+    """Join Markdown blocks into as few messages as possible, each at most limit bytes.
+
+    Blocks are separated by a blank line and kept whole, only a block longer than
+    the limit on its own is split between its lines.
+    """
+    messages = []
+    current = ""
+    for block in blocks:
+        if len(block.encode()) > limit:
+            pieces = block.split("\n")
+        else:
+            pieces = [block]
+
+        separator = "\n\n"
+        for piece in pieces:
+            # a single line over the limit is cut, there is no better place to split it
+            while len(piece.encode()) > limit:
+                cut = piece.encode()[:limit].decode(errors="ignore")
+                if current:
+                    messages.append(current)
+                messages.append(cut)
+                current = ""
+                piece = piece[len(cut):]
+
+            joined = current + separator + piece if current else piece
+            if len(joined.encode()) > limit:
+                messages.append(current)
+                joined = piece
+            current = joined
+            separator = "\n"
+
+    if current:
+        messages.append(current)
+    return messages
+
+
 async def send_text_to_thread(
     client: AsyncClient,
     room_id: str,
@@ -22,7 +122,8 @@ async def send_text_to_thread(
     reply_to_event_id: str = None,
     notice: bool = True,
     markdown_convert: bool = True,
-) -> Union[RoomSendResponse, ErrorResponse]:
+    wait: bool = False,
+) -> Optional[Union[RoomSendResponse, ErrorResponse]]:
     """Send text to a matrix room.
 
     Args:
@@ -41,8 +142,12 @@ async def send_text_to_thread(
         reply_to_event_id: Whether this message is a reply to another event. The event
             ID this is message is a reply to.
 
+        wait: Whether to wait until the message has been sent. Otherwise the message
+            is only queued and None is returned.
+
     Returns:
-        A RoomSendResponse if the request was successful, else an ErrorResponse.
+        A RoomSendResponse if the request was successful, else an ErrorResponse, or
+        None if the message could not be sent or was not waited for.
     """
     # Determine whether to ping room members or not
     msgtype = "m.notice" if notice else "m.text"
@@ -60,18 +165,9 @@ async def send_text_to_thread(
     }
 
     if markdown_convert:
-        content["formatted_body"] = markdown(message)
-
-    try:
-        return await client.room_send(
-            room_id,
-            "m.room.message",
-            content,
-            ignore_unverified_devices=True,
-        )
-    except SendRetryError:
-        logger.exception(f"Unable to send message response to {room_id}"
-)
+        content["formatted_body"] = render_markdown(message)
+
+    return await _queue_send(client, room_id, "m.room.message", content, wait)
 
 
 async def send_text_to_room(
@@ -81,7 +177,8 @@ async def send_text_to_room(
     notice: bool = True,
     markdown_convert: bool = True,
     reply_to_event_id: Optional[str] = None,
-) -> Union[RoomSendResponse, ErrorResponse]:
+    wait: bool = False,
+) -> Optional[Union[RoomSendResponse, ErrorResponse]]:
     """Send text to a matrix room.
 
     Args:
@@ -100,8 +197,12 @@ async def send_text_to_room(
         reply_to_event_id: Whether this message is a reply to another event. The event
             ID this is message is a reply to.
 
+        wait: Whether to wait until the message has been sent. Otherwise the message
+            is only queued and None is returned.
+
     Returns:
-        A RoomSendResponse if the request was successful, else an ErrorResponse.
+        A RoomSendResponse if the request was successful, else an ErrorResponse, or
+        None if the message could not be sent or was not waited for.
     """
     # Determine whether to ping room members or not
     msgtype = "m.notice" if notice else "m.text"
@@ -113,20 +214,66 @@ async def send_text_to_room(
     }
 
     if markdown_convert:
-        content["formatted_body"] = markdown(message)
+        content["formatted_body"] = render_markdown(message)
 
     if reply_to_event_id:
         content["m.relates_to"] = {"m.in_reply_to": {"event_id": reply_to_event_id}}
 
-    try:
-        return await client.room_send(
-            room_id,
-            "m.room.message",
-            content,
-            ignore_unverified_devices=True,
-        )
-    except SendRetryError:
-        logger.exception(f"Unable to send message response to {room_id}")
+    # Plain notices may be merged with neighbouring ones by the scheduler
+    coalesce = notice and not reply_to_event_id
+    return await _queue_send(client, room_id, "m.room.message", content, wait, coalesce)
+
+
+async def send_file_to_room(
+    client: AsyncClient,
+    room: MatrixRoom,
+    file: BinaryIO,
+    filename: str,
+    content_type: str,
+    filesize: int,
+) -> bool:
+    """Upload a file and post it to a matrix room.
+
+    Args:
+        client: The client to communicate to matrix with.
+
+        room: The room to post the file to. The file is encrypted if the room is.
+
+        file: The file to upload, opened in binary mode and positioned at the start.
+
+        filename: The name the file is shown with.
+
+        content_type: The MIME type of the file.
+
+        filesize: The size of the file in bytes.
+
+    Returns:
+        True if the file was uploaded and the message queued, False if the upload failed.
+    """
+    response, decryption_keys = await client.upload(
+        file,
+        content_type=content_type,
+        filename=filename,
+        encrypt=room.encrypted,
+        filesize=filesize,
+    )
+    if not isinstance(response, UploadResponse):
+        logger.error(f"Unable to upload {filename} to {room.room_id}: {response}")
+        return False
+
+    content = {
+        "msgtype": "m.file",
+        "body": filename,
+        "filename": filename,
+        "info": {"mimetype": content_type, "size": filesize},
+    }
+    if decryption_keys:
+        content["file"] = {"url": response.content_uri, **decryption_keys}
+    else:
+        content["url"] = response.content_uri
+
+    await _queue_send(client, room.room_id, "m.room.message", content, wait=False)
+    return True
 
 
 def make_pill(user_id: str, homeserver_url: str, displayname: str = None) -> str:
@@ -148,12 +295,14 @@ def make_pill(user_id: str, homeserver_url: str, displayname: str = None) -> str
 
     return f'<a href="https://matrix.to/#/@{user_id}:{homeserver_url[8:]}">{displayname}</a>'
 
+
 async def react_to_event(
     client: AsyncClient,
     room_id: str,
     event_id: str,
     reaction_text: str,
-) -> Union[Response, ErrorResponse]:
+    wait: bool = False,
+) -> Optional[Union[Response, ErrorResponse]]:
     """Reacts to a given event in a room with the given reaction text
 
     Args:
@@ -165,11 +314,11 @@ async def react_to_event(
 
         reaction_text: The string to react with. Can also be (one or more) emoji characters.
 
-    Returns:
-        A nio.Response or nio.ErrorResponse if an error occurred.
+        wait: Whether to wait until the reaction has been sent.
 
-    Raises:
-        SendRetryError: If the reaction was unable to be sent.
+    Returns:
+        A nio.Response or nio.ErrorResponse if an error occurred, or None if the
+        reaction could not be sent or was not waited for.
     """
     content = {
         "m.relates_to": {
@@ -179,12 +328,7 @@ async def react_to_event(
         }
     }
 
-    return await client.room_send(
-        room_id,
-        "m.reaction",
-        content,
-        ignore_unverified_devices=True,
-    )
+    return await _queue_send(client, room_id, "m.reaction", content, wait)
 
 
 async def decryption_failure(self, room: MatrixRoom, event: MegolmEvent) -> None:
@@ -72,6 +72,50 @@ class Config:
 
         # Database setup
         self.db_url = self._get_cfg(["storage", "database"], required=True)
+        self.db_pool_min_size = self._get_cfg(["storage", "pool", "min_size"], default=10)
+        self.db_pool_max_size = self._get_cfg(["storage", "pool", "max_size"], default=10)
+        self.db_pool_max_inactive_lifetime = self._get_cfg(
+            ["storage", "pool", "max_inactive_lifetime"], default=300.0
+        )
+        self.db_command_timeout = self._get_cfg(
+            ["storage", "pool", "command_timeout"], required=False
+        )
+
+        # Outgoing message pacing
+        self.outbound_max_concurrency = self._get_cfg(
+            ["outbound", "max_concurrency"], default=8
+        )
+        self.outbound_room_rate = self._get_cfg(["outbound", "room_rate"], default=2)
+        self.outbound_room_burst = self._get_cfg(["outbound", "room_burst"], default=10)
+        self.outbound_coalesce_notices = self._get_cfg(
+            ["outbound", "coalesce_notices"], default=False, required=False
+        )
+
+        # Event processing
+        self.event_workers = self._get_cfg(["events", "workers"], default=8)
+        self.event_max_pending = self._get_cfg(["events", "max_pending"], default=1000)
+
+        # Sync setup
+        self.sync_timeline_types = self._get_cfg(
+            ["sync", "timeline_types"],
+            default=[
+                "m.room.message",
+                "m.room.encrypted",
+                "m.reaction",
+                "m.room.member",
+                "m.room.encryption",
+            ],
+        )
+        self.sync_lazy_load_members = self._get_cfg(
+            ["sync", "lazy_load_members"], default=True
+        )
+        self.sync_backlog_horizon = self._get_cfg(
+            ["sync", "backlog_horizon"], default=600
+        )
+
+        # Web API
+        # Without a token the vote export is not served at all
+        self.webapp_export_token = self._get_cfg(["webapp", "export_token"], required=False)
 
         # Matrix bot account setup
         self.user_id = self._get_cfg(["matrix", "user_id"], required=True)
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Set, Tuple
+
+from nio import Event, MatrixRoom
+
+from ioibot.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+dispatcher_queued = Gauge(
+    "ioibot_dispatcher_queued_events", "Events waiting for a dispatcher worker")
+dispatcher_busy = Gauge(
+    "ioibot_dispatcher_busy_workers", "Dispatcher workers currently handling an event")
+dispatcher_workers = Gauge(
+    "ioibot_dispatcher_workers", "Number of dispatcher workers")
+
+# (sequence number, callback, args)
+Job = Tuple[int, Callable[..., Awaitable[Any]], Tuple[Any, ...]]
+
+
+def room_key(room: MatrixRoom, event: Event) -> Hashable:
+    """Order the events of each room"""
+    return room.room_id
+
+
+class EventDispatcher:
+    """Hands event callbacks to a fixed pool of workers instead of running them inline.
+
+    Callbacks are grouped by a key, by default the room of the event. Callbacks
+    with the same key run one after another in the order they were dispatched,
+    callbacks with different keys run in parallel.
+
+    Args:
+        workers: The number of callbacks that may run at the same time.
+
+        max_pending: How many callbacks may be queued or running before dispatch
+            blocks, which holds up the sync loop until the workers catch up.
+    """
+
+    def __init__(self, workers: int = 8, max_pending: int = 1000):
+        self.workers = workers
+        self._capacity = asyncio.Semaphore(max_pending)
+        # key -> callbacks not started yet, present while a callback of the key is queued
+        # or running
+        self._pending: Dict[Hashable, Deque[Job]] = {}
+        # keys with a callback ready to run and no callback of theirs running
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._queued = 0
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # sequence number of the last callback dispatched
+        self._dispatched = 0
+        # sequence numbers of the callbacks not finished yet in dispatch order, and
+        # of those that finished before an earlier one did
+        self._unfinished: Deque[int] = deque()
+        self._finished_early: Set[int] = set()
+        # set and replaced whenever handled moves on
+        self._progress = asyncio.Event()
+
+    def start(self):
+        """Start the workers, must be called from within the event loop"""
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        dispatcher_workers.set(self.workers)
+        dispatcher_queued.set_function(lambda: self._queued)
+        dispatcher_busy.set_function(lambda: self._busy)
+
+    async def stop(self):
+        """Cancel the workers, dropping the callbacks still queued"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def dispatch(self, key: Hashable, callback: Callable[..., Awaitable[Any]], *args):
+        """Queue callback(*args) to run after the callbacks dispatched before with the same key"""
+        await self._capacity.acquire()
+        self._queued += 1
+
+        self._dispatched += 1
+        self._unfinished.append(self._dispatched)
+
+        self._idle.clear()
+        job = (self._dispatched, callback, args)
+        queue = self._pending.get(key)
+        if queue is None:
+            self._pending[key] = deque([job])
+            self._ready.put_nowait(key)
+        else:
+            queue.append(job)
+
+    def wrap(
+        self,
+        callback: Callable[[MatrixRoom, Event], Awaitable[None]],
+        key: Callable[[MatrixRoom, Event], Hashable] = room_key,
+    ) -> Callable[[MatrixRoom, Event], Awaitable[None]]:
+        """Turn an event callback into one that dispatches it, for add_event_callback"""
+
+        async def dispatch_event(room: MatrixRoom, event: Event) -> None:
+            await self.dispatch(key(room, event), callback, room, event)
+
+        return dispatch_event
+
+    async def join(self):
+        """Wait until every dispatched callback has finished"""
+        await self._idle.wait()
+
+    @property
+    def dispatched(self) -> int:
+        """The sequence number of the last callback dispatched, for wait_handled"""
+        return self._dispatched
+
+    @property
+    def handled(self) -> int:
+        """The sequence number up to which every dispatched callback has finished"""
+        if self._unfinished:
+            return self._unfinished[0] - 1
+        return self._dispatched
+
+    async def wait_handled(self, sequence: int):
+        """Wait until the callbacks dispatched up to the given sequence number have finished.
+
+        Unlike join, callbacks dispatched after them may still be queued or running.
+        """
+        while self.handled < sequence:
+            await self._progress.wait()
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            sequence, callback, args = queue.popleft()
+            self._queued -= 1
+            self._busy += 1
+            try:
+                await callback(*args)
+            except Exception:
+                logger.exception(f"Error while handling an event for {key}")
+            finally:
+                self._busy -= 1
+                self._capacity.release()
+                self._finish(sequence)
+
+            # Give the other keys a turn before running the next callback of this one
+            if queue:
+                self._ready.put_nowait(key)
+            else:
+                del self._pending[key]
+                if not self._pending:
+                    self._idle.set()
+
+    def _finish(self, sequence: int):
+        if sequence != self._unfinished[0]:
+            self._finished_early.add(sequence)
+            return
+
+        self._unfinished.popleft()
+        while self._unfinished and self._unfinished[0] in self._finished_early:
+            self._finished_early.remove(self._unfinished.popleft())
+        self._progress.set()
+        self._progress = asyncio.Event()
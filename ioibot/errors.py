@@ -10,3 +10,25 @@ class ConfigError(RuntimeError):
 
     def __init__(self, msg: str):
         super(ConfigError, self).__init__("%s" % (msg,))
+
+
+class DatasourceError(RuntimeError):
+    """An error encountered while loading one of the CSV datasources.
+
+    Args:
+        msg: The message displayed to the user on error.
+    """
+
+    def __init__(self, msg: str):
+        super(DatasourceError, self).__init__("%s" % (msg,))
+
+
+class PollError(RuntimeError):
+    """A poll operation that cannot be carried out in the current state of the polls.
+
+    Args:
+        msg: The message displayed to the user on error.
+    """
+
+    def __init__(self, msg: str):
+        super(PollError, self).__init__("%s" % (msg,))
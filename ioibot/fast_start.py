@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+
+from nio import Event, MatrixRoom, SyncResponse
+
+from ioibot.dispatcher import EventDispatcher
+from ioibot.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# file in storage.store_path holding the last processed sync token
+CHECKPOINT_FILENAME = 'sync_checkpoint.json'
+
+backlog_skipped = Counter(
+    "ioibot_backlog_events_skipped_total", "Stale events skipped after a restart")
+
+
+class FastStart:
+    """Skips the backlog synced right after a restart.
+
+    The first sync after a restart replays timeline events the bot may have
+    handled before, or that are too old to still be worth answering. Events of
+    that sync are dropped if they are older than the horizon or not newer than
+    the last event processed before the restart. Later syncs are not filtered.
+
+    The checkpoint is only moved past the events of a sync once their callbacks
+    have finished, so a crash never skips commands that were still running. It
+    moves to the latest sync whose events, and those of the syncs before it,
+    have all been handled, regardless of the events dispatched since.
+
+    Args:
+        store_path: The directory the checkpoint is saved in.
+
+        horizon: How many seconds old an event may be and still be handled after a
+            restart. 0 disables skipping.
+
+        dispatcher: The dispatcher running the event callbacks. Without one events
+            count as handled once their callback returned.
+    """
+
+    def __init__(
+        self,
+        store_path: str,
+        horizon: float,
+        dispatcher: Optional[EventDispatcher] = None,
+    ):
+        self.path = os.path.join(store_path, CHECKPOINT_FILENAME)
+        self.horizon = horizon
+        self.dispatcher = dispatcher
+        # server timestamp (ms) of the newest event dispatched
+        self.last_event_ts = 0
+        # next_batch of the last sync whose events were all handled
+        self.sync_token: Optional[str] = None
+        # last_event_ts of the checkpoint the previous run left behind
+        self._checkpoint_ts = 0
+        self._catching_up = True
+        self._cutoff = 0
+        # (sync_token, last_event_ts, dispatched) of the syncs not saved yet, oldest
+        # first, dispatched being the sequence number of their last event
+        self._pending: Deque[Tuple[str, int, int]] = deque()
+        self._writer: Optional[asyncio.Task] = None
+
+    def load(self):
+        """Read the checkpoint of the previous run, if any"""
+        try:
+            with open(self.path) as f:
+                checkpoint = json.load(f)
+            self.sync_token = checkpoint['sync_token']
+            self.last_event_ts = checkpoint['last_event_ts']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError):
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}", exc_info=True)
+
+        self._checkpoint_ts = self.last_event_ts
+        self._cutoff = int((time.time() - self.horizon) * 1000)
+
+    def is_stale(self, event: Event) -> bool:
+        """Whether an event is backlog that should not be handled"""
+        timestamp = getattr(event, 'server_timestamp', None)
+        if timestamp is None:
+            return False
+
+        # events of different rooms arrive out of order, so compare with the
+        # checkpoint only, not with the events handled since the restart
+        if (self._catching_up and self.horizon
+                and (timestamp < self._cutoff or timestamp <= self._checkpoint_ts)):
+            return True
+
+        self.last_event_ts = max(self.last_event_ts, timestamp)
+        return False
+
+    def wrap(
+        self, callback: Callable[[MatrixRoom, Event], Awaitable[None]]
+    ) -> Callable[[MatrixRoom, Event], Awaitable[None]]:
+        """Turn an event callback into one that ignores the backlog"""
+
+        async def skip_backlog(room: MatrixRoom, event: Event) -> None:
+            if self.is_stale(event):
+                backlog_skipped.inc()
+                return
+            await callback(room, event)
+
+        return skip_backlog
+
+    async def sync(self, response: SyncResponse) -> None:
+        """Callback for every sync response, called after the event callbacks ran"""
+        if self._catching_up:
+            self._catching_up = False
+            skipped = int(backlog_skipped.labels().value)
+            logger.info(f"Caught up with the homeserver, {skipped} stale events skipped")
+
+        dispatched = self.dispatcher.dispatched if self.dispatcher else 0
+        if self._pending and self._pending[-1][2] == dispatched:
+            # no events since the previous sync, both are handled at the same time
+            self._pending.pop()
+        self._pending.append((response.next_batch, self.last_event_ts, dispatched))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._save())
+
+    async def flush(self):
+        """Wait until the checkpoint of the latest sync has been written"""
+        if self._writer is not None:
+            await self._writer
+
+    async def _save(self):
+        while self._pending:
+            if self.dispatcher is not None:
+                await self.dispatcher.wait_handled(self._pending[0][2])
+                handled = self.dispatcher.handled
+            else:
+                handled = 0
+
+            # later syncs may have been handled by now as well, write the latest
+            while self._pending and self._pending[0][2] <= handled:
+                checkpoint = self._pending.popleft()
+            sync_token, last_event_ts, _ = checkpoint
+
+            try:
+                await asyncio.to_thread(self._write, sync_token, last_event_ts)
+            except OSError:
+                logger.exception(f"Unable to write checkpoint {self.path}")
+            self.sync_token = sync_token
+
+    def _write(self, sync_token: str, last_event_ts: int):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'sync_token': sync_token, 'last_event_ts': last_event_ts}, f)
+        os.replace(tmp_path, self.path)
@@ -1,7 +1,12 @@
+import asyncio
+import hmac
+import json
 import logging
+import uuid
 
 from aiohttp import web
 
+from ioibot import metrics
 from ioibot.storage import Storage
 
 logger = logging.getLogger(__name__)
@@ -10,50 +15,43 @@ logger.setLevel(logging.DEBUG)
 routes = web.RouteTableDef()
 store_key = web.AppKey("store", Storage)
 static_root = 'webpage' # TODO make this configurable
+# seconds between comments sent to keep idle result streams open
+keepalive_interval = 15
 
-# return currently active poll result
-@routes.get("/api/polls")
-async def polls_active(req: web.Request):
-    store = req.app[store_key]
-    conn = store.conn
-    teams = store.teams
+polls_latency = metrics.Histogram(
+    "ioibot_api_polls_latency_seconds", "Time taken to answer /api/polls")
 
-    poll_details = await conn.fetchrow(
-        "SELECT poll_id, question, status, anonymous, multiple_choice FROM polls WHERE display")
-    if poll_details is None:
-        return web.json_response({})
+async def get_poll_result(store: Storage):
+    """Build the result of the displayed poll.
 
-    votes = []
-    [poll_id, question, status, anonymous, multiple_choice] = poll_details
+    Returns:
+        The result as a JSON-serializable dict, an empty dict if no poll is
+        displayed, or None if the displayed poll has no choices.
+    """
+    team_names = store.roster.team_names
 
-    poll_choices = await conn.fetch(
-        "SELECT poll_choice_id, choice, marker FROM poll_choices WHERE poll_id = $1", poll_id)
+    poll = await store.polls.displayed()
+    if poll is None:
+        return {}
+
+    question, status = poll.question, poll.status
+    anonymous, multiple_choice = poll.anonymous, poll.multiple_choice
+
+    poll_choices = poll.choices
     if not poll_choices:
-        return web.HTTPInternalServerError()
+        return None
 
     choices = [{'choice_id': choice_id, 'choice': choice, 'marker': marker} for (choice_id, choice, marker) in poll_choices]
 
+    vote_items = await store.polls.votes(poll)
     if anonymous:
-        if status == 1:
-            results = dict()
-            for (poll_choice_id, _, _) in poll_choices:
-                results[poll_choice_id] = 0
-
-            anonym_votes = await conn.fetch("SELECT poll_choice_id FROM poll_anonym_active_votes")
-            for (vote,) in anonym_votes:
-                results[vote] += 1
-            vote_items = results.items()
-        elif status == 2:
-            vote_items = await conn.fetch("SELECT poll_choice_id, count FROM poll_anonym_votes WHERE poll_id = $1", poll_id)
-        else:
-            vote_items = []
         votes = [{'count': count, 'choice_id': choice} for (choice, count) in vote_items]
     else: # not anonymous
-        vote_items = await conn.fetch("SELECT poll_choice_id, team_code, voted_by, voted_at FROM poll_votes WHERE poll_id = $1", poll_id)
-        votes = [{'team_code': f"({team_code}) {teams.loc[teams['Code'] == team_code, ['Name']].values[0][0]}", 'voted_by': voted_by, 'voted_at': voted_at.isoformat(), 'choice_id': choice} for (choice, team_code, voted_by, voted_at) in vote_items]
-        missing_teams = teams.loc[~teams['Code'].isin([team_code for (_, team_code, _, _) in vote_items]), ['Code', 'Name']]
-        for _, row in missing_teams.iterrows():
-            votes.append({'team_code': f"({row['Code']}) {row['Name']}", 'voted_by': None, 'voted_at': None, 'choice_id': None})
+        votes = [{'team_code': f"({team_code}) {team_names[team_code]}", 'voted_by': voted_by, 'voted_at': voted_at.isoformat(), 'choice_id': choice} for (choice, team_code, voted_by, voted_at) in vote_items]
+        voted_teams = {team_code for (_, team_code, _, _) in vote_items}
+        for team_code, name in team_names.items():
+            if team_code not in voted_teams:
+                votes.append({'team_code': f"({team_code}) {name}", 'voted_by': None, 'voted_at': None, 'choice_id': None})
 
     response = {
         'question': question,
@@ -64,7 +62,131 @@ async def polls_active(req: web.Request):
         'votes': votes,
     }
 
-    return web.json_response(response)
+    return response
+
+class PollResultCache:
+    """The serialized result of the displayed poll, rebuilt only when
+    Storage.poll_version has moved on since it was last built."""
+
+    def __init__(self, store: Storage):
+        self.store = store
+        self.version = None
+        self.body = None
+        self._lock = asyncio.Lock()
+        # versions restart from 0 with the process, so tag them with the process
+        self._instance = uuid.uuid4().hex[:8]
+
+    async def get(self):
+        """Get the current result.
+
+        Returns:
+            A (etag, body) tuple, body is the encoded JSON result or None if the
+            displayed poll has no choices.
+        """
+        if self.version != self.store.poll_version:
+            async with self._lock:
+                # another request may have rebuilt it while we were waiting
+                version = self.store.poll_version
+                if self.version != version:
+                    result = await get_poll_result(self.store)
+                    self.body = None if result is None else json.dumps(result).encode()
+                    self.version = version
+
+        return f"{self._instance}-{self.version}", self.body
+
+result_cache_key = web.AppKey("result_cache", PollResultCache)
+
+# return currently active poll result
+@routes.get("/api/polls")
+async def polls_active(req: web.Request):
+    with polls_latency.time():
+        return await _polls_active(req)
+
+async def _polls_active(req: web.Request):
+    etag, body = await req.app[result_cache_key].get()
+    if body is None:
+        raise web.HTTPInternalServerError()
+
+    if any(tag.value == etag for tag in req.if_none_match or ()):
+        raise web.HTTPNotModified(headers={'ETag': f'"{etag}"'})
+
+    response = web.Response(body=body, content_type='application/json')
+    response.etag = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# push the poll result as server-sent events whenever it changes
+@routes.get("/api/polls/stream")
+async def polls_stream(req: web.Request):
+    store = req.app[store_key]
+    cache = req.app[result_cache_key]
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # don't let nginx hold back events
+    })
+    await response.prepare(req)
+
+    # version of the last result pushed, the cache may already be ahead of the
+    # change that woke us up, then there is nothing new to push next time
+    pushed = None
+    try:
+        while True:
+            _, body = await cache.get()
+            if cache.version != pushed:
+                pushed = cache.version
+                if body is not None:
+                    await response.write(b"data: " + body + b"\n\n")
+
+            try:
+                await store.wait_poll_change(pushed, keepalive_interval)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+    except ConnectionResetError:
+        logger.debug("Poll result stream closed by the client")
+
+    return response
+
+# download the votes of non-anonymous polls as CSV, ?poll=<id> or all by default.
+# Unlike the result of the displayed poll these are not public, so the export
+# is only served with the configured token.
+@routes.get("/api/polls/export")
+async def polls_export(req: web.Request):
+    store = req.app[store_key]
+
+    token = store.config.webapp_export_token
+    if not token:
+        raise web.HTTPNotFound()
+    scheme, _, credentials = req.headers.get('Authorization', '').partition(' ')
+    if not (scheme.lower() == 'bearer'
+            and hmac.compare_digest(credentials.encode(), str(token).encode())):
+        raise web.HTTPUnauthorized(headers={'WWW-Authenticate': 'Bearer'})
+
+    poll = req.query.get('poll', 'all')
+    if poll == 'all':
+        poll_id = None
+    elif poll.isdigit() and len(poll) < 10:
+        poll_id = int(poll)
+    else:
+        raise web.HTTPBadRequest(text="poll must be a poll ID or 'all'")
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/csv; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="poll-{poll}-votes.csv"',
+    })
+    await response.prepare(req)
+    # rows are written as the database produces them
+    await store.export_votes(response.write, poll_id)
+    await response.write_eof()
+    return response
+
+@routes.get("/metrics")
+async def get_metrics(req: web.Request):
+    return web.Response(
+        text=metrics.render(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+    )
 
 # for development, should be handled by nginx
 @routes.get('/')
@@ -72,10 +194,15 @@ async def get_index(req: web.Request):
     return web.FileResponse(f'{static_root}/index.html')
 routes.static('/', static_root)
 
-async def run_webapp(store: Storage):
+def make_app(store: Storage) -> web.Application:
     app = web.Application()
     app[store_key] = store
+    app[result_cache_key] = PollResultCache(store)
     app.add_routes(routes)
+    return app
+
+async def run_webapp(store: Storage):
+    app = make_app(store)
 
     runner = web.AppRunner(app)
     await runner.setup()
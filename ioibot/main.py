@@ -3,6 +3,7 @@
 import asyncio
 import logging
 import sys
+from contextlib import suppress
 from time import sleep
 
 from aiohttp import ClientConnectionError, ServerDisconnectedError
@@ -14,12 +15,19 @@ from nio import (
     LoginError,
     MegolmEvent,
     RoomMessageText,
+    SyncError,
+    SyncResponse,
     UnknownEvent,
+    UploadFilterResponse,
 )
 
 from ioibot.callbacks import Callbacks
 from ioibot.config import Config
+from ioibot.dispatcher import EventDispatcher
+from ioibot.fast_start import FastStart
 from ioibot.http_server import run_webapp
+from ioibot.metrics import monitor_event_loop
+from ioibot.outbound import OutboundScheduler, set_scheduler
 from ioibot.storage import Storage
 
 logger = logging.getLogger(__name__)
@@ -37,8 +45,9 @@ async def async_main():
     # Read the parsed config file and create a Config object
     config = Config(config_path)
 
-    # Configure the database
+    # Configure the database and load the datasources
     store = Storage(config)
+    await store.load()
 
     # Configuration options for the AsyncClient
     client_config = AsyncClientConfig(
@@ -61,21 +70,73 @@ async def async_main():
         client.access_token = config.user_token
         client.user_id = config.user_id
 
-    # Set up event callbacks
+    fast_start = setup_client(client, store, config)
+
+    # Keep track of how responsive the event loop is for the metrics
+    monitor = asyncio.create_task(monitor_event_loop())
+
+    try:
+        async with store.db_connect():
+            await store.load_objection_threads()
+            await asyncio.gather(
+                    loop(config, client, fast_start),
+                    run_webapp(store))
+    finally:
+        monitor.cancel()
+        # raises whatever ended the monitor early, other than the cancellation
+        with suppress(asyncio.CancelledError):
+            await monitor
+
+def setup_client(client: AsyncClient, store: Storage, config: Config) -> FastStart:
+    """Set up sending messages and handling events for a client.
+
+    Must be called from within the event loop.
+
+    Returns:
+        The FastStart skipping the backlog, which knows the sync token the sync
+        loop continues from.
+    """
+    # Send outgoing messages in the background, paced per room
+    set_scheduler(client, OutboundScheduler(
+        client,
+        max_concurrency=config.outbound_max_concurrency,
+        room_rate=config.outbound_room_rate,
+        room_burst=config.outbound_room_burst,
+        coalesce_notices=config.outbound_coalesce_notices,
+    ))
+
+    # Set up event callbacks. They run on a pool of workers so that a slow
+    # command doesn't hold up the events of other rooms.
+    dispatcher = EventDispatcher(
+        workers=config.event_workers, max_pending=config.event_max_pending
+    )
+    dispatcher.start()
+
+    # Don't handle the backlog of old events synced after a restart
+    fast_start = FastStart(
+        config.store_path, config.sync_backlog_horizon, dispatcher=dispatcher)
+    fast_start.load()
+
     callbacks = Callbacks(client, store, config)
-    client.add_event_callback(callbacks.message, (RoomMessageText,))
     client.add_event_callback(
-        callbacks.invite_event_filtered_callback, (InviteMemberEvent,)
+        fast_start.wrap(dispatcher.wrap(callbacks.message, key=callbacks.message_key)),
+        (RoomMessageText,),
     )
-    client.add_event_callback(callbacks.decryption_failure, (MegolmEvent,))
-    client.add_event_callback(callbacks.unknown, (UnknownEvent,))
+    client.add_event_callback(
+        dispatcher.wrap(callbacks.invite_event_filtered_callback), (InviteMemberEvent,)
+    )
+    client.add_event_callback(
+        fast_start.wrap(dispatcher.wrap(callbacks.decryption_failure)), (MegolmEvent,)
+    )
+    client.add_event_callback(
+        fast_start.wrap(dispatcher.wrap(callbacks.unknown)), (UnknownEvent,)
+    )
+    client.add_response_callback(callbacks.sync, (SyncResponse,))
+    client.add_response_callback(fast_start.sync, (SyncResponse,))
 
-    async with store.db_connect():
-        await asyncio.gather(
-                loop(config, client),
-                run_webapp(store))
+    return fast_start
 
-async def loop(config, client):
+async def loop(config, client, fast_start):
     # Keep trying to reconnect on failure (with some time in-between)
     while True:
         try:
@@ -112,7 +173,36 @@ async def loop(config, client):
                 # Login succeeded!
 
             logger.info(f"Logged in as {config.user_id}")
-            await client.sync_forever(timeout=30000, full_state=True)
+
+            sync_filter = await upload_sync_filter(client, config)
+
+            # After a reconnect nio continues from its last sync by itself. After a
+            # restart continue from the stored token, or from our own checkpoint
+            # if the store had none.
+            since = None
+            if not client.next_batch:
+                since = client.loaded_sync_token or fast_start.sync_token
+
+            # Room state is not kept in the store, so the first sync after a
+            # restart asks for the full state, which is why it is made here on
+            # its own. Later syncs only need what changed.
+            if since:
+                response = await client.sync(
+                    timeout=0,
+                    sync_filter=sync_filter,
+                    since=since,
+                    full_state=not client.rooms,
+                )
+                if isinstance(response, SyncError):
+                    # The token may have expired, start over with an initial sync.
+                    # FastStart keeps skipping the backlog until a sync succeeds.
+                    logger.warning(
+                        f"Unable to continue from sync token {since}, starting over: {response}")
+                    client.loaded_sync_token = None
+                else:
+                    await client.run_response_callbacks([response])
+
+            await client.sync_forever(timeout=30000, sync_filter=sync_filter)
 
         except (ClientConnectionError, ServerDisconnectedError):
             logger.warning("Unable to connect to homeserver, retrying in 15s...")
@@ -123,5 +213,32 @@ async def loop(config, client):
             # Make sure to close the client connection on disconnect
             await client.close()
 
+async def upload_sync_filter(client, config):
+    """Upload the filter restricting syncs to what the bot handles.
+
+    Returns:
+        The filter ID, or the filter itself if it could not be uploaded.
+    """
+    sync_filter = {
+        "presence": {"not_types": ["*"]},
+        "room": {
+            # typing notifications and read receipts
+            "ephemeral": {"not_types": ["*"]},
+            "account_data": {"not_types": ["*"]},
+            "state": {"lazy_load_members": config.sync_lazy_load_members},
+            "timeline": {
+                "types": config.sync_timeline_types,
+                "lazy_load_members": config.sync_lazy_load_members,
+            },
+        },
+    }
+
+    response = await client.upload_filter(**sync_filter)
+    if isinstance(response, UploadFilterResponse):
+        return response.filter_id
+
+    logger.warning(f"Unable to upload the sync filter, sending it inline: {response}")
+    return sync_filter
+
 def main():
     asyncio.run(async_main())
@@ -45,10 +45,8 @@ class Message:
 
     async def process(self) -> None:
         """Process and possibly respond to the message"""
-        objection_rooms = self.store.objection_rooms
-        sc_room_id = objection_rooms.loc[objection_rooms['Objection Room ID'] == self.room.room_id, 'SC Room ID']
-        if sc_room_id.empty: return;
-        sc_room_id = sc_room_id.values[0]
+        sc_room_id = self.store.roster.sc_rooms.get(self.room.room_id)
+        if sc_room_id is None: return;
 
         # if self.event.source:dict has property content.m.relates_to then grab the object otherwise return
         if 'content' not in self.event.source or 'm.relates_to' not in self.event.source['content']: return;
@@ -60,22 +58,17 @@ class Message:
 
         obj_thread_id = self.event.source['content']['m.relates_to']['event_id']
 
-        db_response = await self.store.conn.fetch('''
-            SELECT
-                sc_thread_id
-            FROM
-                listening_threads
-            WHERE obj_room_id = $1
-                AND sc_room_id = $2
-                AND obj_thread_id = $3
-        ''', self.room.room_id, sc_room_id, obj_thread_id)
-
-
-        if len(db_response) == 0 or type(await self.client.room_get_event(sc_room_id, db_response[0][0])) is RoomGetEventError:
-            # await react_to_event(self.client, self.room.room_id, self.event.event_id, "❌ failed")
+        sc_thread = self.store.objection_thread(self.room.room_id, sc_room_id, obj_thread_id)
+        if sc_thread is None:
             return
 
-        sc_thread = db_response[0][0];
+        # Only look the SC thread up once, it is not going anywhere after that
+        if (sc_room_id, sc_thread) not in self.store.valid_sc_threads:
+            if type(await self.client.room_get_event(sc_room_id, sc_thread)) is RoomGetEventError:
+                # await react_to_event(self.client, self.room.room_id, self.event.event_id, "❌ failed")
+                return
+            self.store.valid_sc_threads.add((sc_room_id, sc_thread))
+
         objection_comment = (
             '##### Comment  \n\n'
             f'{self.message_content}  \n\n'
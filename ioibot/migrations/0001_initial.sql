@@ -0,0 +1,82 @@
+CREATE TABLE IF NOT EXISTS polls (
+	poll_id serial PRIMARY KEY,
+	question varchar NOT NULL,
+	status integer NOT NULL CHECK(status IN (0, 1, 2)), -- 0: inactive, 1: active, 2: closed
+	display bool NOT NULL,
+	anonymous bool NOT NULL,
+	multiple_choice bool NOT NULL);
+
+CREATE TABLE IF NOT EXISTS poll_choices (
+	poll_choice_id serial PRIMARY KEY,
+	poll_id integer NOT NULL,
+	choice varchar NOT NULL,
+	marker varchar NOT NULL,
+	UNIQUE(poll_id, choice));
+
+CREATE TABLE IF NOT EXISTS poll_anonym_active_votes (
+	poll_choice_id integer NOT NULL,
+	poll_id integer NOT NULL,
+	team_code varchar NOT NULL,
+	UNIQUE(poll_choice_id, team_code));
+
+-- live tallies of the active anonymous poll
+CREATE INDEX IF NOT EXISTS poll_anonym_active_votes_poll_id_idx
+	ON poll_anonym_active_votes (poll_id, poll_choice_id);
+
+CREATE TABLE IF NOT EXISTS poll_anonym_votes (
+	poll_choice_id integer NOT NULL,
+	poll_id integer NOT NULL,
+	count integer NOT NULL);
+
+CREATE TABLE IF NOT EXISTS poll_votes (
+	poll_choice_id integer NOT NULL,
+	poll_id integer NOT NULL,
+	team_code varchar NOT NULL,
+	voted_by varchar NOT NULL,
+	voted_at timestamp NOT NULL DEFAULT current_timestamp,
+	UNIQUE(poll_choice_id, team_code));
+
+CREATE TABLE IF NOT EXISTS listening_threads (
+	obj_room_id varchar NOT NULL,
+	sc_room_id varchar NOT NULL,
+	obj_thread_id varchar NOT NULL,
+	sc_thread_id varchar NOT NULL,
+	UNIQUE(obj_room_id, sc_room_id, obj_thread_id, sc_thread_id));
+
+-- Replace the votes of a team in one statement. Votes of the same team are
+-- serialized, so two leaders voting at once cannot end up with both votes.
+-- Returns false without recording anything if the poll is no longer active.
+CREATE OR REPLACE FUNCTION record_vote(
+	p_poll_id integer,
+	p_team_code varchar,
+	p_voted_by varchar,
+	p_choice_ids integer[]) RETURNS boolean AS $$
+BEGIN
+	PERFORM pg_advisory_xact_lock(hashtext('vote:' || p_team_code));
+	IF NOT EXISTS (SELECT 1 FROM polls WHERE poll_id = p_poll_id AND status = 1) THEN
+		RETURN false;
+	END IF;
+
+	DELETE FROM poll_votes WHERE poll_id = p_poll_id AND team_code = p_team_code;
+	INSERT INTO poll_votes (poll_choice_id, poll_id, team_code, voted_by)
+		SELECT unnest(p_choice_ids), p_poll_id, p_team_code, p_voted_by;
+	RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_anonym_vote(
+	p_poll_id integer,
+	p_team_code varchar,
+	p_choice_ids integer[]) RETURNS boolean AS $$
+BEGIN
+	PERFORM pg_advisory_xact_lock(hashtext('vote:' || p_team_code));
+	IF NOT EXISTS (SELECT 1 FROM polls WHERE poll_id = p_poll_id AND status = 1) THEN
+		RETURN false;
+	END IF;
+
+	DELETE FROM poll_anonym_active_votes WHERE team_code = p_team_code;
+	INSERT INTO poll_anonym_active_votes (poll_choice_id, poll_id, team_code)
+		SELECT unnest(p_choice_ids), p_poll_id, p_team_code;
+	RETURN true;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,21 @@
+-- At most one poll can be active at any time, which also makes looking up
+-- the active poll an index lookup.
+CREATE UNIQUE INDEX IF NOT EXISTS polls_active_idx ON polls (status) WHERE status = 1;
+
+-- The poll shown on the web page. Not unique, the display is moved from one
+-- poll to another in a single UPDATE.
+CREATE INDEX IF NOT EXISTS polls_display_idx ON polls (poll_id) WHERE display;
+
+-- Replacing the votes of a team in a poll
+CREATE INDEX IF NOT EXISTS poll_votes_poll_id_team_code_idx
+	ON poll_votes (poll_id, team_code);
+
+-- Replacing the vote of a team in the active anonymous poll
+CREATE INDEX IF NOT EXISTS poll_anonym_active_votes_team_code_idx
+	ON poll_anonym_active_votes (team_code);
+
+-- Results of closed anonymous polls
+CREATE INDEX IF NOT EXISTS poll_anonym_votes_poll_id_idx ON poll_anonym_votes (poll_id);
+
+-- listening_threads is looked up by (obj_room_id, sc_room_id, obj_thread_id),
+-- a prefix of its unique index, so it needs no index of its own.
@@ -0,0 +1,67 @@
+-- Votes hold a share lock on the poll while they are recorded. Closing the
+-- poll waits for them, and votes arriving later see the poll closed, so no
+-- vote slips in between the poll being closed and its votes being counted.
+CREATE OR REPLACE FUNCTION record_vote(
+	p_poll_id integer,
+	p_team_code varchar,
+	p_voted_by varchar,
+	p_choice_ids integer[]) RETURNS boolean AS $$
+BEGIN
+	PERFORM pg_advisory_xact_lock(hashtext('vote:' || p_team_code));
+	PERFORM 1 FROM polls WHERE poll_id = p_poll_id AND status = 1 FOR SHARE;
+	IF NOT FOUND THEN
+		RETURN false;
+	END IF;
+
+	DELETE FROM poll_votes WHERE poll_id = p_poll_id AND team_code = p_team_code;
+	INSERT INTO poll_votes (poll_choice_id, poll_id, team_code, voted_by)
+		SELECT unnest(p_choice_ids), p_poll_id, p_team_code, p_voted_by;
+	RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_anonym_vote(
+	p_poll_id integer,
+	p_team_code varchar,
+	p_choice_ids integer[]) RETURNS boolean AS $$
+BEGIN
+	PERFORM pg_advisory_xact_lock(hashtext('vote:' || p_team_code));
+	PERFORM 1 FROM polls WHERE poll_id = p_poll_id AND status = 1 FOR SHARE;
+	IF NOT FOUND THEN
+		RETURN false;
+	END IF;
+
+	DELETE FROM poll_anonym_active_votes WHERE team_code = p_team_code;
+	INSERT INTO poll_anonym_active_votes (poll_choice_id, poll_id, team_code)
+		SELECT unnest(p_choice_ids), p_poll_id, p_team_code;
+	RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Close the active poll. The votes of an anonymous poll are counted into
+-- poll_anonym_votes, choices without votes get 0. Every statement runs on a
+-- fresh snapshot, so the count includes the votes the UPDATE waited for.
+-- Returns the ID of the closed poll, NULL if no poll was active.
+CREATE OR REPLACE FUNCTION close_poll() RETURNS integer AS $$
+DECLARE
+	v_poll_id integer;
+	v_anonymous boolean;
+BEGIN
+	UPDATE polls SET status = 2 WHERE status = 1
+		RETURNING poll_id, anonymous INTO v_poll_id, v_anonymous;
+	IF v_poll_id IS NULL THEN
+		RETURN NULL;
+	END IF;
+
+	IF v_anonymous THEN
+		INSERT INTO poll_anonym_votes (poll_choice_id, poll_id, count)
+			SELECT c.poll_choice_id, c.poll_id, count(v.poll_choice_id)
+			FROM poll_choices c
+			LEFT JOIN poll_anonym_active_votes v ON v.poll_choice_id = c.poll_choice_id
+			WHERE c.poll_id = v_poll_id
+			GROUP BY c.poll_choice_id, c.poll_id;
+		DELETE FROM poll_anonym_active_votes;
+	END IF;
+	RETURN v_poll_id;
+END;
+$$ LANGUAGE plpgsql;
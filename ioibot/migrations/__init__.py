@@ -0,0 +1,60 @@
+import logging
+import os
+import re
+from typing import List, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.dirname(__file__)
+
+# migration files are named <version>_<name>.sql and applied in version order
+MIGRATION_FILENAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations() -> List[Tuple[int, str, str]]:
+    """Read the migrations shipped with the bot.
+
+    Returns:
+        (version, name, sql) tuples, sorted by version.
+    """
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILENAME.match(filename)
+        if match is None:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+            migrations.append((int(match[1]), match[2], f.read()))
+    return sorted(migrations)
+
+
+async def migrate(conn: asyncpg.Connection):
+    """Bring the database schema up to date.
+
+    Every migration runs in its own transaction together with recording its
+    version in schema_migrations, so a failing migration leaves the schema at
+    the previous version. An advisory lock keeps two bots starting at the same
+    time from applying the same migration twice.
+    """
+    await conn.execute("SELECT pg_advisory_lock(hashtext('ioibot:migrations'))")
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name varchar NOT NULL,
+                applied_at timestamp NOT NULL DEFAULT current_timestamp)''')
+        applied = {
+            row['version'] for row in await conn.fetch('SELECT version FROM schema_migrations')}
+
+        for version, name, sql in load_migrations():
+            if version in applied:
+                continue
+            logger.info(f"Applying database migration {version} ({name})")
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    'INSERT INTO schema_migrations (version, name) VALUES ($1, $2)',
+                    version, name)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext('ioibot:migrations'))")
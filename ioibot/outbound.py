@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import deque
+from typing import Deque, Dict, List, Optional, Union
+
+from nio import AsyncClient, ErrorResponse, RoomSendResponse
+
+from ioibot.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# merged notices are kept well below the homeserver's 64KiB event size limit
+MAX_COALESCED_LENGTH = 16384
+
+room_send_latency = Histogram(
+    "ioibot_room_send_latency_seconds", "Time taken by room_send", ["type"])
+room_send_errors = Counter(
+    "ioibot_room_send_errors_total", "room_send calls that failed", ["type"])
+room_send_rate_limited = Counter(
+    "ioibot_room_send_rate_limited_total", "room_send calls rejected with a 429")
+outbound_queued = Gauge(
+    "ioibot_outbound_queued_events", "Events waiting to be sent to the homeserver")
+outbound_coalesced = Counter(
+    "ioibot_outbound_coalesced_total", "Notices merged into a preceding notice")
+
+
+async def room_send(
+    client: AsyncClient,
+    room_id: str,
+    message_type: str,
+    content: dict,
+) -> Union[RoomSendResponse, ErrorResponse]:
+    """Send an event to a room right away, recording its latency and errors.
+
+    Raises:
+        SendRetryError: If the event was unable to be sent.
+    """
+    try:
+        with room_send_latency.labels(message_type).time():
+            response = await client.room_send(
+                room_id,
+                message_type,
+                content,
+                ignore_unverified_devices=True,
+            )
+    except Exception:
+        room_send_errors.labels(message_type).inc()
+        raise
+
+    if isinstance(response, ErrorResponse):
+        room_send_errors.labels(message_type).inc()
+    return response
+
+
+class _TokenBucket:
+    """Paces the events sent to one room"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        """Send nothing for the given time, e.g. after the homeserver asked us to back off"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        # allow exactly one event, the retry, once the time is up
+        self.tokens = 1.0
+        self.updated = self.blocked_until
+
+
+class _Outgoing:
+    def __init__(self, message_type: str, content: dict, coalesce: bool):
+        self.message_type = message_type
+        self.content = content
+        self.coalesce = coalesce
+        self.futures: List[asyncio.Future] = [asyncio.get_running_loop().create_future()]
+
+    def merge(self, other: "_Outgoing") -> bool:
+        """Append the text of another notice to this one, if both allow it"""
+        if not (self.coalesce and other.coalesce):
+            return False
+        if self.content.keys() != other.content.keys():
+            return False
+        if self.content["msgtype"] != other.content["msgtype"]:
+            return False
+
+        length = sum(
+            len(self.content.get(key, "")) + len(other.content.get(key, ""))
+            for key in ("body", "formatted_body"))
+        if length > MAX_COALESCED_LENGTH:
+            return False
+
+        self.content = {
+            **self.content,
+            "body": self.content["body"] + "\n\n" + other.content["body"],
+        }
+        if "formatted_body" in self.content:
+            self.content["formatted_body"] += "\n" + other.content["formatted_body"]
+        self.futures.extend(other.futures)
+        return True
+
+
+class _Room:
+    def __init__(self, bucket: _TokenBucket):
+        self.queue: Deque[_Outgoing] = deque()
+        self.bucket = bucket
+        self.worker: Optional[asyncio.Task] = None
+
+
+class OutboundScheduler:
+    """Sends events to the homeserver in the background.
+
+    Every room has its own queue, so events arrive in the order they were
+    queued, while rooms are served independently of each other. Each room is
+    paced by a token bucket which is also paused whenever the homeserver
+    answers with a 429, after which the event is retried.
+
+    Args:
+        client: The client to send the events with.
+
+        max_concurrency: How many events may be in flight at the same time.
+
+        room_rate: The sustained number of events per second sent to one room.
+
+        room_burst: How many events can be sent to an idle room at once.
+
+        coalesce_notices: Whether consecutive notices queued for the same room
+            may be sent as one message.
+
+        max_retries: How many times an event is retried after a 429.
+    """
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        max_concurrency: int = 8,
+        room_rate: float = 2.0,
+        room_burst: int = 10,
+        coalesce_notices: bool = False,
+        max_retries: int = 5,
+    ):
+        self.client = client
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.coalesce_notices = coalesce_notices
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rooms: Dict[str, _Room] = {}
+
+    def send(
+        self,
+        room_id: str,
+        message_type: str,
+        content: dict,
+        coalesce: bool = False,
+    ) -> asyncio.Future:
+        """Queue an event for sending.
+
+        Args:
+            room_id: The ID of the room to send the event to.
+
+            message_type: The event type.
+
+            content: The event content.
+
+            coalesce: Whether the event may be merged with notices queued around
+                it. Only has an effect if coalesce_notices is enabled.
+
+        Returns:
+            A future resolving to the RoomSendResponse or ErrorResponse, or to None
+            if the event could not be sent at all. It does not have to be awaited.
+        """
+        outgoing = _Outgoing(message_type, content, coalesce and self.coalesce_notices)
+
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = _Room(_TokenBucket(self.room_rate, self.room_burst))
+        room.queue.append(outgoing)
+        outbound_queued.inc()
+
+        if room.worker is None:
+            room.worker = asyncio.create_task(self._run(room_id, room))
+        return outgoing.futures[0]
+
+    async def join(self):
+        """Wait until every queued event has been sent"""
+        while self._rooms:
+            await asyncio.gather(
+                *(room.worker for room in list(self._rooms.values())),
+                return_exceptions=True,
+            )
+
+    async def _run(self, room_id: str, room: _Room):
+        outgoing = None
+        try:
+            while room.queue:
+                outgoing = room.queue.popleft()
+                outbound_queued.dec()
+                while room.queue and outgoing.merge(room.queue[0]):
+                    room.queue.popleft()
+                    outbound_queued.dec()
+                    outbound_coalesced.inc()
+
+                response = await self._send(room_id, room, outgoing)
+                for future in outgoing.futures:
+                    if not future.done():
+                        future.set_result(response)
+        finally:
+            # Nothing is left and no await happened since the check, so no event
+            # can have been queued for this room in the meantime. If the worker
+            # was cancelled instead, the events it had not sent are given up and
+            # the next event queued for the room starts a new worker.
+            del self._rooms[room_id]
+            outbound_queued.dec(len(room.queue))
+            for dropped in ([outgoing] if outgoing else []) + list(room.queue):
+                for future in dropped.futures:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def _send(self, room_id: str, room: _Room, outgoing: _Outgoing):
+        for attempt in range(self.max_retries + 1):
+            await room.bucket.acquire()
+            try:
+                async with self._semaphore:
+                    response = await room_send(
+                        self.client, room_id, outgoing.message_type, outgoing.content)
+            except Exception:
+                logger.exception(f"Unable to send {outgoing.message_type} to {room_id}")
+                return None
+
+            if not (isinstance(response, ErrorResponse)
+                    and response.status_code == "M_LIMIT_EXCEEDED"):
+                return response
+
+            room_send_rate_limited.inc()
+            retry_after = (response.retry_after_ms or 5000) / 1000
+            logger.warning(
+                f"Rate limited while sending to {room_id}, retrying in {retry_after}s")
+            room.bucket.block(retry_after)
+
+        logger.error(f"Giving up sending {outgoing.message_type} to {room_id}")
+        return response
+
+
+# client -> the scheduler sending its events
+_schedulers: "weakref.WeakKeyDictionary[AsyncClient, OutboundScheduler]" = (
+    weakref.WeakKeyDictionary())
+
+
+def set_scheduler(client: AsyncClient, scheduler: OutboundScheduler):
+    """Make chat_functions send the client's events through the given scheduler"""
+    _schedulers[client] = scheduler
+
+
+def get_scheduler(client: AsyncClient) -> OutboundScheduler:
+    """Get the scheduler of a client, setting up one with the defaults if needed"""
+    scheduler = _schedulers.get(client)
+    if scheduler is None:
+        scheduler = _schedulers[client] = OutboundScheduler(client)
+    return scheduler
@@ -0,0 +1,435 @@
+from itertools import groupby
+from typing import Any, AsyncContextManager, Callable, List, Optional, Protocol, Sequence, Tuple
+
+import asyncpg
+
+from ioibot import queries
+from ioibot.errors import PollError
+from ioibot.metrics import Counter
+
+poll_cache_lookups = Counter(
+    "ioibot_poll_cache_lookups_total", "Poll definition lookups by cache result", ["result"])
+
+
+class ConnectionPool(Protocol):
+    """The connection pool methods the polls use, as provided by storage.InstrumentedPool"""
+
+    def acquire(self) -> AsyncContextManager[asyncpg.Connection]: ...
+
+    async def execute(self, query: str, *args, **kwargs) -> str: ...
+
+    async def fetch(self, query: str, *args, **kwargs) -> List[asyncpg.Record]: ...
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any: ...
+
+
+class Poll:
+    """The definition of a poll, everything about it but the votes.
+
+    Args:
+        poll_id: The ID of the poll.
+
+        question: The question asked.
+
+        status: 0 if inactive, 1 if active, 2 if closed.
+
+        display: Whether the poll is shown on the web page.
+
+        anonymous: Whether votes are only counted, not attributed to teams.
+
+        multiple_choice: Whether a team may vote for several choices.
+
+        choices: (poll_choice_id, choice, marker) tuples, ordered by ID. Choice
+            number n in a vote is choices[n - 1].
+    """
+
+    __slots__ = (
+        "poll_id", "question", "status", "display", "anonymous", "multiple_choice", "choices")
+
+    def __init__(
+        self,
+        poll_id: int,
+        question: str,
+        status: int,
+        display: bool,
+        anonymous: bool,
+        multiple_choice: bool,
+        choices: Tuple[Tuple[int, str, str], ...],
+    ):
+        self.poll_id = poll_id
+        self.question = question
+        self.status = status
+        self.display = display
+        self.anonymous = anonymous
+        self.multiple_choice = multiple_choice
+        self.choices = choices
+
+    def choice_id(self, number: int) -> int:
+        """Get the poll_choice_id of the choice with the given 1-based number"""
+        return self.choices[number - 1][0]
+
+
+STATUSES = ['inactive', 'active', 'closed']
+
+
+def _poll_from_rows(rows: Sequence[asyncpg.Record], offset: int = 0) -> Poll:
+    """Build a poll from rows holding its columns followed by one choice each"""
+    poll_id, question, status, display, anonymous, multiple_choice = rows[0][offset:offset + 6]
+    choices = tuple(sorted(
+        tuple(row[offset + 6:offset + 9]) for row in rows if row[offset + 6] is not None))
+    return Poll(poll_id, question, status, display, anonymous, multiple_choice, choices)
+
+
+def _does_not_exist(poll_id: int) -> PollError:
+    return PollError(
+        f"Poll {poll_id} does not exist.  \n\nSend `poll list` to see all created polls.  \n")
+
+
+# cache slot whose poll has not been read yet
+_UNKNOWN = object()
+
+
+class PollCache:
+    """The definitions of the active and the displayed poll.
+
+    They are read from the database when first needed and kept until a poll
+    command invalidates them, votes and result requests don't have to read
+    them again.
+    """
+
+    def __init__(self):
+        self._active = _UNKNOWN
+        self._displayed = _UNKNOWN
+        # bumped on invalidation, so a read racing with a poll command is discarded
+        self._generation = 0
+
+    def invalidate(self):
+        """Forget the cached polls, after a poll command may have changed them"""
+        self._active = _UNKNOWN
+        self._displayed = _UNKNOWN
+        self._generation += 1
+
+    async def active(self, pool: ConnectionPool) -> Optional[Poll]:
+        """Get the active poll, or None if no poll is active"""
+        if self._active is _UNKNOWN:
+            poll_cache_lookups.labels("miss").inc()
+            generation = self._generation
+            poll = await self._read(pool, queries.ACTIVE_POLL)
+            if generation == self._generation:
+                self._active = poll
+            return poll
+
+        poll_cache_lookups.labels("hit").inc()
+        return self._active
+
+    async def displayed(self, pool: ConnectionPool) -> Optional[Poll]:
+        """Get the poll shown on the web page, or None if no poll is displayed"""
+        if self._displayed is _UNKNOWN:
+            poll_cache_lookups.labels("miss").inc()
+            generation = self._generation
+            poll = await self._read(pool, queries.DISPLAYED_POLL)
+            if generation == self._generation:
+                self._displayed = poll
+            return poll
+
+        poll_cache_lookups.labels("hit").inc()
+        return self._displayed
+
+    @staticmethod
+    async def _read(pool: ConnectionPool, query: str) -> Optional[Poll]:
+        async with pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                row = await conn.fetchrow(query)
+                if row is None:
+                    return None
+                poll_id = row[0]
+                choices = await conn.fetch(queries.POLL_CHOICES, poll_id)
+
+        return Poll(*row, choices=tuple(sorted(tuple(choice) for choice in choices)))
+
+
+class PollRepository:
+    """The operations of the poll commands.
+
+    Each operation is a single statement, or a single call of a database
+    function, so it takes one round trip and concurrent HTC commands cannot
+    interleave within it. Only replacing the choices of a poll takes a
+    transaction of two statements. The repository owns the poll definition cache and
+    invalidates it whenever an operation changes a poll.
+
+    Args:
+        pool: The database connection pool.
+
+        on_change: Called after every change that may affect poll results.
+    """
+
+    def __init__(self, pool: ConnectionPool, on_change: Callable[[], None]):
+        self.pool = pool
+        self.cache = PollCache()
+        self._on_change = on_change
+
+    def changed(self):
+        """Drop the cached definitions and signal that the poll results may have changed"""
+        self.cache.invalidate()
+        self._on_change()
+
+    async def active(self) -> Optional[Poll]:
+        """Get the definition of the active poll, or None if no poll is active"""
+        return await self.cache.active(self.pool)
+
+    async def displayed(self) -> Optional[Poll]:
+        """Get the definition of the displayed poll, or None if no poll is displayed"""
+        return await self.cache.displayed(self.pool)
+
+    async def create(
+        self,
+        question: str,
+        choices: List[str],
+        markers: List[str],
+        anonymous: bool,
+        multiple_choice: bool,
+        display: bool,
+        start: bool,
+    ) -> Poll:
+        """Create a poll with its choices.
+
+        Args:
+            display: Whether to show the poll on the web page instead of the
+                currently displayed one.
+
+            start: Whether to activate the poll, which only happens if no other
+                poll is active.
+        """
+        try:
+            poll = await self._create(
+                question, choices, markers, anonymous, multiple_choice, display, start)
+        except asyncpg.UniqueViolationError:
+            # polls_active_idx, another poll was activated in the meantime
+            poll = await self._create(
+                question, choices, markers, anonymous, multiple_choice, display, False)
+        self.changed()
+        return poll
+
+    async def _create(self, question, choices, markers, anonymous, multiple_choice, display, start):
+        rows = await self.pool.fetch('''
+            WITH hidden AS (
+                UPDATE polls SET display = false WHERE $6 AND display),
+            poll AS (
+                INSERT INTO polls (question, status, display, anonymous, multiple_choice)
+                SELECT $1, CASE WHEN $7 AND NOT EXISTS (
+                    SELECT 1 FROM polls WHERE status = 1) THEN 1 ELSE 0 END, $6, $4, $5
+                RETURNING poll_id, question, status, display, anonymous, multiple_choice),
+            choices AS (
+                INSERT INTO poll_choices (poll_id, choice, marker)
+                SELECT poll.poll_id, c.choice, c.marker
+                FROM poll, unnest($2::varchar[], $3::varchar[]) WITH ORDINALITY AS c(choice, marker, n)
+                ORDER BY c.n
+                RETURNING poll_choice_id, choice, marker)
+            SELECT poll.*, choices.* FROM poll, choices''',
+            question, choices, markers, anonymous, multiple_choice, display, start)
+        return _poll_from_rows(rows)
+
+    async def update(
+        self,
+        poll_id: int,
+        question: Optional[str],
+        anonymous: bool,
+        multiple_choice: bool,
+        display: bool,
+        choices: Optional[List[str]] = None,
+        markers: Optional[List[str]] = None,
+    ) -> Poll:
+        """Change an inactive poll.
+
+        Args:
+            question: The new question, None to keep the current one.
+
+            display: Whether to show the poll on the web page instead of the
+                currently displayed one.
+
+            choices: The new choices, None to keep the current ones.
+
+            markers: The markers of the new choices.
+
+        Raises:
+            PollError: If the poll does not exist or is not inactive.
+        """
+        replace = choices is not None
+        # The new choices are inserted by a statement of their own, an INSERT
+        # doesn't see the rows deleted by the same statement and would violate
+        # UNIQUE(poll_id, choice)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    WITH target AS (
+                        SELECT poll_id, status FROM polls WHERE poll_id = $1 FOR UPDATE),
+                    hidden AS (
+                        UPDATE polls SET display = false
+                        WHERE $5 AND display AND poll_id <> $1
+                            AND (SELECT status FROM target) = 0),
+                    updated AS (
+                        UPDATE polls p
+                        SET question = coalesce($2, p.question), anonymous = $3,
+                            multiple_choice = $4, display = $5
+                        FROM target WHERE p.poll_id = target.poll_id AND target.status = 0
+                        RETURNING p.poll_id, p.question, p.status, p.display, p.anonymous,
+                            p.multiple_choice),
+                    deleted AS (
+                        DELETE FROM poll_choices
+                        WHERE $6 AND poll_id IN (SELECT poll_id FROM updated))
+                    SELECT target.status, updated.*, c.poll_choice_id, c.choice, c.marker
+                    FROM target
+                    LEFT JOIN updated ON true
+                    LEFT JOIN poll_choices c ON NOT $6 AND c.poll_id = updated.poll_id''',
+                    poll_id, question, anonymous, multiple_choice, display, replace)
+
+                if not rows:
+                    raise _does_not_exist(poll_id)
+                if rows[0][1] is None:
+                    raise PollError(
+                        f"Poll {poll_id} is {STATUSES[rows[0][0]]}, it cannot be updated  \n")
+
+                if replace:
+                    inserted = await conn.fetch('''
+                        INSERT INTO poll_choices (poll_id, choice, marker)
+                        SELECT $1, c.choice, c.marker
+                        FROM unnest($2::varchar[], $3::varchar[]) WITH ORDINALITY AS c(choice, marker, n)
+                        ORDER BY c.n
+                        RETURNING poll_choice_id, choice, marker''', poll_id, choices, markers)
+                    rows = [tuple(rows[0][:7]) + tuple(choice) for choice in inserted]
+
+        self.changed()
+        return _poll_from_rows(rows, offset=1)
+
+    async def show(self, poll_id: int):
+        """Show a poll on the web page instead of the currently displayed one.
+
+        Raises:
+            PollError: If the poll does not exist.
+        """
+        exists = await self.pool.fetchval('''
+            WITH shown AS (
+                UPDATE polls SET display = (poll_id = $1)
+                WHERE (display OR poll_id = $1)
+                    AND EXISTS (SELECT 1 FROM polls WHERE poll_id = $1))
+            SELECT EXISTS (SELECT 1 FROM polls WHERE poll_id = $1)''', poll_id)
+        if not exists:
+            raise _does_not_exist(poll_id)
+        self.changed()
+
+    async def clear_display(self):
+        """Stop showing any poll on the web page"""
+        await self.pool.execute('UPDATE polls SET display = false WHERE display')
+        self.changed()
+
+    async def activate(self, poll_id: int) -> Poll:
+        """Activate an inactive poll.
+
+        Raises:
+            PollError: If the poll does not exist, is not inactive, or another
+                poll is active.
+        """
+        try:
+            rows = await self.pool.fetch('''
+                WITH target AS (
+                    SELECT status FROM polls WHERE poll_id = $1),
+                active AS (
+                    SELECT poll_id FROM polls WHERE status = 1),
+                activated AS (
+                    UPDATE polls SET status = 1
+                    WHERE poll_id = $1 AND status = 0 AND NOT EXISTS (SELECT 1 FROM active)
+                    RETURNING poll_id, question, status, display, anonymous, multiple_choice)
+                SELECT (SELECT status FROM target), (SELECT poll_id FROM active),
+                    activated.*, c.poll_choice_id, c.choice, c.marker
+                FROM (VALUES (1)) AS one
+                LEFT JOIN activated ON true
+                LEFT JOIN poll_choices c ON c.poll_id = activated.poll_id''', poll_id)
+        except asyncpg.UniqueViolationError:
+            # polls_active_idx, another poll was activated in the meantime
+            raise PollError(
+                "Another poll has just been activated. Only one poll can be active at any time.  \n")
+
+        status, active_id = rows[0][:2]
+        if status is None:
+            raise _does_not_exist(poll_id)
+        if rows[0][2] is None:
+            if status != 0:
+                raise PollError(
+                    f"Poll {poll_id} is {STATUSES[status]}, it cannot be activated  \n")
+            raise PollError(
+                f"Poll {active_id} is already active. Only one poll can be active at any time.  \n")
+
+        self.changed()
+        return _poll_from_rows(rows, offset=2)
+
+    async def close(self) -> Optional[int]:
+        """Close the active poll, counting its votes if it is anonymous.
+
+        Returns:
+            The ID of the closed poll, None if no poll was active.
+        """
+        poll_id = await self.pool.fetchval('SELECT close_poll()')
+        if poll_id is not None:
+            self.changed()
+        return poll_id
+
+    async def page(
+        self, status: Optional[int], after: int, page_size: int
+    ) -> Tuple[List[Poll], bool]:
+        """Get a page of polls, in the order they were created.
+
+        Pages are found by poll ID, the next page starts after the last poll of
+        this one. The polls before it are not scanned, and polls created or
+        deleted in the meantime don't shift the pages.
+
+        Args:
+            status: Only list polls with this status, all polls if None.
+
+            after: The ID of the last poll of the previous page, 0 for the first page.
+
+            page_size: The number of polls per page.
+
+        Returns:
+            The polls on the page with their choices, and whether there are
+            polls after them.
+        """
+        rows = await self.pool.fetch('''
+            WITH page AS (
+                SELECT poll_id, question, status, display, anonymous, multiple_choice
+                FROM polls
+                WHERE ($1::integer IS NULL OR status = $1) AND poll_id > $2
+                ORDER BY poll_id LIMIT $3)
+            SELECT EXISTS (
+                    SELECT 1 FROM polls
+                    WHERE ($1::integer IS NULL OR status = $1)
+                        AND poll_id > (SELECT max(poll_id) FROM page)),
+                page.*, c.poll_choice_id, c.choice, c.marker
+            FROM page
+            LEFT JOIN poll_choices c ON c.poll_id = page.poll_id
+            ORDER BY page.poll_id''',
+            status, after, page_size)
+
+        polls = [
+            _poll_from_rows(list(poll_rows), offset=1)
+            for _, poll_rows in groupby(rows, key=lambda row: row[1])
+        ]
+        return polls, bool(rows) and rows[0][0]
+
+    async def votes(self, poll: Poll) -> List[Tuple]:
+        """Get the votes cast in a poll.
+
+        Returns:
+            (poll_choice_id, count) tuples, for every choice, if the poll is
+            anonymous. Otherwise (poll_choice_id, team_code, voted_by, voted_at)
+            tuples, one for every choice voted for by a team.
+        """
+        if not poll.anonymous:
+            return await self.pool.fetch(queries.POLL_VOTES, poll.poll_id)
+
+        if poll.status == 1:
+            counts = dict(await self.pool.fetch(queries.ANONYM_ACTIVE_TALLY, poll.poll_id))
+        elif poll.status == 2:
+            counts = dict(await self.pool.fetch(queries.ANONYM_TALLY, poll.poll_id))
+        else:
+            return []
+        return [(choice_id, counts.get(choice_id, 0)) for choice_id, _, _ in poll.choices]
@@ -0,0 +1,21 @@
+# Queries run for every vote and every poll result. asyncpg caches prepared
+# statements per connection by their exact text (see README), so always use
+# these constants instead of repeating the SQL.
+
+POLL_COLUMNS = 'poll_id, question, status, display, anonymous, multiple_choice'
+ACTIVE_POLL = f'SELECT {POLL_COLUMNS} FROM polls WHERE status = 1'
+DISPLAYED_POLL = f'SELECT {POLL_COLUMNS} FROM polls WHERE display'
+POLL_CHOICES = 'SELECT poll_choice_id, choice, marker FROM poll_choices WHERE poll_id = $1'
+
+TEAM_ANONYM_VOTE = 'SELECT poll_choice_id FROM poll_anonym_active_votes WHERE team_code = $1'
+TEAM_VOTE = 'SELECT poll_choice_id FROM poll_votes WHERE poll_id = $1 AND team_code = $2'
+DELETE_TEAM_ANONYM_VOTE = 'DELETE FROM poll_anonym_active_votes WHERE team_code = $1'
+DELETE_TEAM_VOTE = 'DELETE FROM poll_votes WHERE poll_id = $1 AND team_code = $2'
+RECORD_ANONYM_VOTE = 'SELECT record_anonym_vote($1, $2, $3)'
+RECORD_VOTE = 'SELECT record_vote($1, $2, $3, $4)'
+
+ANONYM_ACTIVE_TALLY = (
+    'SELECT poll_choice_id, count(*) FROM poll_anonym_active_votes WHERE poll_id = $1 '
+    'GROUP BY poll_choice_id')
+ANONYM_TALLY = 'SELECT poll_choice_id, count FROM poll_anonym_votes WHERE poll_id = $1'
+POLL_VOTES = 'SELECT poll_choice_id, team_code, voted_by, voted_at FROM poll_votes WHERE poll_id = $1'
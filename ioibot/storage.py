@@ -1,29 +1,417 @@
+import asyncio
+import io
 import logging
+import os
+import pickle
+from contextlib import asynccontextmanager
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
+import aiohttp
 import asyncpg
 import pandas as pd
 
 from ioibot.config import Config
+from ioibot.errors import DatasourceError
+from ioibot.metrics import Gauge, Histogram
+from ioibot.migrations import migrate
+from ioibot.polls import PollRepository
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# table attribute on Storage -> config option holding its CSV export URL
+DATASOURCES = {
+    'teams': 'team_url',
+    'leaders': 'leader_url',
+    'contestants': 'contestant_url',
+    'testing_acc': 'testing_acc_url',
+    'translation_acc': 'translation_acc_url',
+    'objection_rooms': 'objection_room_url',
+    'tokens': 'token_url',
+}
+
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+# file in storage.store_path holding the last loaded tables
+SNAPSHOT_FILENAME = 'datasources.pickle'
+
+class Roster:
+    """Read-only lookup indexes over the roster tables.
+
+    A new Roster is built on every reload and replaces the previous one as a
+    whole, so readers always see indexes belonging to the same set of tables.
+
+    Args:
+        teams: The teams table.
+
+        leaders: The table of leaders, guests and committee members.
+
+        homeserver: The server name used to build full MXIDs from the `UserID`
+            column.
+
+        objection_rooms: The table pairing objection rooms with SC rooms.
+    """
+
+    def __init__(
+        self,
+        teams: pd.DataFrame,
+        leaders: pd.DataFrame,
+        homeserver: str,
+        objection_rooms: Optional[pd.DataFrame] = None,
+    ):
+        teams_by_code = {}
+        for team in teams.to_dict('records'):
+            if isinstance(team['Code'], str):
+                teams_by_code.setdefault(team['Code'], team)
+
+        users_by_mxid = {}
+        members_by_role = {}
+        for user in leaders.to_dict('records'):
+            # the first row wins, as it did with the DataFrame lookups
+            if isinstance(user['UserID'], str):
+                users_by_mxid.setdefault(f"@{user['UserID']}:{homeserver}", user)
+            members_by_role.setdefault(user['Role'], []).append(user)
+
+        sc_rooms = {}
+        if objection_rooms is not None:
+            for room_id, sc_room_id in zip(
+                    objection_rooms['Objection Room ID'], objection_rooms['SC Room ID']):
+                if isinstance(room_id, str):
+                    sc_rooms.setdefault(room_id, sc_room_id)
+
+        # MXID -> leaders row
+        self.users = MappingProxyType(users_by_mxid)
+        # team code -> teams row
+        self.teams = MappingProxyType(teams_by_code)
+        # team code -> team name, in spreadsheet order
+        self.team_names = MappingProxyType(
+            {code: team['Name'] for code, team in teams_by_code.items()})
+        # role -> leaders rows, in spreadsheet order
+        self.members = MappingProxyType(
+            {role: tuple(users) for role, users in members_by_role.items()})
+        # objection room ID -> SC room ID
+        self.sc_rooms = MappingProxyType(sc_rooms)
+
+db_pool_wait = Histogram(
+    "ioibot_db_pool_wait_seconds", "Time spent waiting for a database connection")
+db_pool_connections = Gauge(
+    "ioibot_db_pool_connections", "Database connections in the pool", ["state"])
+
+class InstrumentedPool:
+    """The database connection pool, recording how long acquiring a connection takes.
+
+    Has the query methods of asyncpg.Pool, each running on a connection
+    acquired for the query alone.
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Acquire a connection, used as `async with pool.acquire() as conn:`"""
+        with db_pool_wait.time():
+            conn = await self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs) -> List[asyncpg.Record]:
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs) -> Optional[asyncpg.Record]:
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, **kwargs)
+
+    async def copy_from_query(self, query: str, *args, **kwargs) -> str:
+        async with self.acquire() as conn:
+            return await conn.copy_from_query(query, *args, **kwargs)
+
 class Storage:
     def __init__(self, config: Config):
         self.config = config
-        self.contestants = pd.read_csv(config.contestant_url)
-        self.contestants.sort_values('ContestantCode')
-        self.testing_acc = pd.read_csv(config.testing_acc_url)
-        self.testing_acc.sort_values('ContestantCode')
-        self.tokens = pd.read_csv(config.token_url)
-        self.reload_csv()
-
-    def db_connect(self):
-        self.conn = asyncpg.create_pool(self.config.db_url)
-        return self.conn
-
-    def reload_csv(self):
-        self.teams = pd.read_csv(self.config.team_url)
-        self.leaders = pd.read_csv(self.config.leader_url)
-        self.translation_acc = pd.read_csv(self.config.translation_acc_url)
-        self.objection_rooms = pd.read_csv(self.config.objection_room_url)
+        self.snapshot_path = os.path.join(config.store_path, SNAPSHOT_FILENAME)
+        # table name -> {'url', 'etag', 'last_modified'} of the loaded table
+        self._sources = {}
+        self._revalidation = None
+        # bumped whenever the displayed poll results may have changed
+        self.poll_version = 0
+        self._poll_changed = asyncio.Event()
+        # poll operations, available once the database is connected
+        self.polls: Optional[PollRepository] = None
+        # (obj_room_id, sc_room_id, obj_thread_id) -> sc_thread_id, mirrors listening_threads
+        self._objection_threads: Dict[Tuple[str, str, str], str] = {}
+        # (sc_room_id, sc_thread_id) of SC threads known to exist
+        self.valid_sc_threads: Set[Tuple[str, str]] = set()
+
+    @asynccontextmanager
+    async def db_connect(self):
+        """Migrate the database to the current schema and connect to it.
+
+        Used as `async with store.db_connect():`, the pool is closed on exit.
+        """
+        # Migrate on a connection of its own, before the pool opens any
+        conn = await asyncpg.connect(self.config.db_url)
+        try:
+            await migrate(conn)
+        finally:
+            await conn.close()
+
+        pool = asyncpg.create_pool(
+            self.config.db_url,
+            min_size=self.config.db_pool_min_size,
+            max_size=self.config.db_pool_max_size,
+            max_inactive_connection_lifetime=self.config.db_pool_max_inactive_lifetime,
+            command_timeout=self.config.db_command_timeout,
+        )
+
+        db_pool_connections.labels("max").set_function(pool.get_max_size)
+        db_pool_connections.labels("open").set_function(pool.get_size)
+        db_pool_connections.labels("idle").set_function(pool.get_idle_size)
+        db_pool_connections.labels("in_use").set_function(
+            lambda: pool.get_size() - pool.get_idle_size())
+
+        # opens min_size connections, so the first commands don't have to
+        async with pool:
+            logger.info(f"Connected to the database with {pool.get_size()} connections")
+            self.conn = InstrumentedPool(pool)
+            self.polls = PollRepository(self.conn, self.poll_changed)
+            yield self.conn
+
+    async def load_objection_threads(self):
+        """Load the objection threads into memory, once the database is connected"""
+        rows = await self.conn.fetch('''
+            SELECT obj_room_id, sc_room_id, obj_thread_id, sc_thread_id
+            FROM listening_threads''')
+        self._objection_threads = {
+            (obj_room_id, sc_room_id, obj_thread_id): sc_thread_id
+            for obj_room_id, sc_room_id, obj_thread_id, sc_thread_id in rows
+        }
+        logger.info(f"Loaded {len(self._objection_threads)} objection threads")
+
+    def objection_thread(
+        self, obj_room_id: str, sc_room_id: str, obj_thread_id: str
+    ) -> Optional[str]:
+        """Get the SC thread that comments on an objection thread are relayed to"""
+        return self._objection_threads.get((obj_room_id, sc_room_id, obj_thread_id))
+
+    async def add_objection_thread(
+        self, obj_room_id: str, sc_room_id: str, obj_thread_id: str, sc_thread_id: str
+    ):
+        """Store the SC thread of a new objection, in the database and in memory"""
+        await self.conn.execute('''
+            INSERT INTO listening_threads (obj_room_id, sc_room_id, obj_thread_id, sc_thread_id)
+            VALUES ($1, $2, $3, $4)''', obj_room_id, sc_room_id, obj_thread_id, sc_thread_id)
+        self._objection_threads[(obj_room_id, sc_room_id, obj_thread_id)] = sc_thread_id
+        # the bot has just sent the message starting the thread
+        self.valid_sc_threads.add((sc_room_id, sc_thread_id))
+
+    async def export_votes(
+        self, output: Callable[[bytes], Awaitable[Any]], poll_id: Optional[int] = None
+    ) -> int:
+        """Stream the votes of non-anonymous polls as CSV, with a header row.
+
+        The rows are copied straight out of the database and handed to output
+        chunk by chunk, they are never collected in memory.
+
+        Args:
+            output: Called with each chunk of CSV data.
+
+            poll_id: The poll to export the votes of, all polls if None.
+
+        Returns:
+            The number of votes exported.
+        """
+        team_names = self.roster.team_names
+        status = await self.conn.copy_from_query('''
+            SELECT v.poll_id, p.question, v.team_code, t.name AS team_name,
+                v.voted_by, v.voted_at, c.marker, c.choice
+            FROM poll_votes v
+            JOIN polls p ON p.poll_id = v.poll_id
+            JOIN poll_choices c ON c.poll_choice_id = v.poll_choice_id
+            LEFT JOIN unnest($1::varchar[], $2::varchar[]) AS t(code, name)
+                ON t.code = v.team_code
+            WHERE NOT p.anonymous AND ($3::integer IS NULL OR v.poll_id = $3)
+            ORDER BY v.poll_id, v.team_code, c.poll_choice_id''',
+            list(team_names), [str(name) for name in team_names.values()], poll_id,
+            output=output, format='csv', header=True)
+        # the status is 'COPY <rows>'
+        return int(status.split()[-1])
+
+    def poll_changed(self):
+        """Signal that a vote, poll change or reload may have changed poll results"""
+        self.poll_version += 1
+        self._poll_changed.set()
+        self._poll_changed = asyncio.Event()
+
+    async def wait_poll_change(self, version: int, timeout: float):
+        """Wait until poll_version differs from the given version.
+
+        Raises:
+            asyncio.TimeoutError: If nothing changed within timeout seconds.
+        """
+        if self.poll_version == version:
+            await asyncio.wait_for(self._poll_changed.wait(), timeout)
+
+    async def load(self):
+        """Load the datasources for startup.
+
+        If a snapshot from a previous run exists it is used right away and the
+        datasources are revalidated in the background. Otherwise this waits for
+        the datasources to be downloaded.
+
+        Raises:
+            DatasourceError: If there is no snapshot and the datasources could
+                not be loaded.
+        """
+        if await asyncio.to_thread(self._read_snapshot):
+            logger.info(f"Loaded datasources from snapshot {self.snapshot_path}")
+            self._revalidation = asyncio.create_task(self._revalidate())
+        else:
+            await self.reload_csv()
+
+    async def _revalidate(self):
+        try:
+            await self.reload_csv()
+        except DatasourceError:
+            logger.warning("Revalidating the datasources failed, using the snapshot")
+
+    async def reload_csv(self):
+        """Download all datasources concurrently and swap the new tables in.
+
+        Datasources are fetched conditionally, so sheets that have not changed
+        since they were loaded are neither downloaded nor parsed again. The
+        tables are only replaced once every datasource has been fetched and
+        parsed, so a failure leaves the previously loaded tables untouched.
+
+        Raises:
+            DatasourceError: If any of the datasources could not be loaded.
+        """
+        async with aiohttp.ClientSession(timeout=FETCH_TIMEOUT) as session:
+            results = await asyncio.gather(
+                *(self._load_csv(session, name, getattr(self.config, option))
+                  for name, option in DATASOURCES.items()),
+                return_exceptions=True,
+            )
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for error in errors:
+                logger.error(str(error))
+            raise errors[0]
+
+        loaded = dict(zip(DATASOURCES, results))
+        if all(result is None for result in loaded.values()):
+            logger.debug("Datasources are unchanged")
+            return
+
+        tables = {}
+        sources = {}
+        for name, result in loaded.items():
+            if result is None:
+                tables[name] = getattr(self, name)
+                sources[name] = self._sources[name]
+            else:
+                tables[name], sources[name] = result
+
+        roster = await asyncio.to_thread(
+            Roster, tables['teams'], tables['leaders'], self.config.homeserver_url[8:],
+            tables['objection_rooms'])
+
+        # swap everything in at once, so that no reader sees a mix of old and new
+        for name, table in tables.items():
+            setattr(self, name, table)
+        self.roster = roster
+        self._sources = sources
+        self.poll_changed()
+
+        try:
+            await asyncio.to_thread(self._write_snapshot, tables, sources)
+        except OSError:
+            logger.exception(f"Unable to write snapshot {self.snapshot_path}")
+
+    async def _load_csv(
+        self, session: aiohttp.ClientSession, name: str, url: str
+    ) -> Optional[Tuple[pd.DataFrame, Dict[str, Optional[str]]]]:
+        """Fetch and parse a datasource.
+
+        Returns:
+            None if the loaded table is still up to date, otherwise the new table
+            together with the details needed to revalidate it later.
+        """
+        headers = {}
+        source = self._sources.get(name)
+        if source is not None and source['url'] == url:
+            if source['etag']:
+                headers['If-None-Match'] = source['etag']
+            if source['last_modified']:
+                headers['If-Modified-Since'] = source['last_modified']
+
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and headers:
+                    return None
+                response.raise_for_status()
+                body = await response.read()
+                source = {
+                    'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+            # parsing a large sheet takes a while, keep it off the event loop
+            table = await asyncio.to_thread(pd.read_csv, io.BytesIO(body))
+            return table, source
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise DatasourceError(f"Failed to load datasource '{name}': {e}") from e
+
+    def _read_snapshot(self) -> bool:
+        """Load the tables saved by a previous run.
+
+        Returns:
+            True if the snapshot was loaded, False if there is no usable snapshot.
+        """
+        if not os.path.exists(self.snapshot_path):
+            return False
+
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+            tables = snapshot['tables']
+            sources = snapshot['sources']
+            if set(tables) != set(DATASOURCES):
+                logger.warning(
+                    f"Ignoring snapshot {self.snapshot_path} with tables {sorted(tables)}")
+                return False
+            roster = Roster(
+                tables['teams'], tables['leaders'], self.config.homeserver_url[8:],
+                tables['objection_rooms'])
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError) as e:
+            logger.warning(
+                f"Ignoring unreadable snapshot {self.snapshot_path}: {type(e).__name__}: {e}")
+            return False
+
+        for name, table in tables.items():
+            setattr(self, name, table)
+        self.roster = roster
+        self._sources = sources
+        return True
+
+    def _write_snapshot(self, tables: Dict[str, pd.DataFrame], sources: Dict[str, dict]):
+        # write to a temporary file first, so that a crash never leaves a
+        # truncated snapshot behind
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(
+                {'tables': tables, 'sources': sources}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
@@ -0,0 +1,192 @@
+import unittest
+from unittest.mock import Mock
+
+import nio
+import pandas as pd
+
+from ioibot.bot_commands import POLL_LIST_PAGE_SIZE, Command, User, command_invocations
+from ioibot.errors import PollError
+from ioibot.outbound import get_scheduler
+from ioibot.polls import Poll, PollRepository
+from ioibot.storage import Roster, Storage
+
+
+class UserTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        teams = pd.DataFrame({
+            "Code": ["IDN", "HUN"],
+            "Name": ["Indonesia", "Hungary"],
+            "Voting": [1, 0],
+            "Visible": [1, 1],
+        })
+        leaders = pd.DataFrame({
+            "TeamCode": ["IDN", "HUN", "XXX", "IDN"],
+            "RealTeamCode": ["IDN", "HUN", "XXX", "IDN"],
+            "Name": ["Alice", "Bob", "Carol", "Alice Again"],
+            "Role": ["Team Leader", "HTC", "Team Leader", "Guest"],
+            "UserID": ["alice", "bob", "carol", "alice"],
+            "Chair": [0, 1, 0, 0],
+        })
+
+        self.fake_config = Mock()
+        self.fake_config.homeserver_url = "https://example.com"
+
+        self.fake_storage = Mock(spec=Storage)
+        self.fake_storage.roster = Roster(teams, leaders, "example.com")
+
+    def test_known_user(self):
+        """Tests that a user in the roster is resolved with their team"""
+        user = User(self.fake_storage, self.fake_config, "@alice:example.com")
+
+        self.assertEqual(user.role, "Team Leader")
+        self.assertEqual(user.team, "IDN")
+        self.assertEqual(user.country, "Indonesia")
+        self.assertEqual(user.name, "Alice")
+        self.assertTrue(user.is_leader())
+        self.assertFalse(user.is_tc())
+
+    def test_unknown_user(self):
+        """Tests that users missing from the roster or with an unknown team are rejected"""
+        user = User(self.fake_storage, self.fake_config, "@mallory:example.com")
+        self.assertEqual(user.role, "Unknown")
+
+        user = User(self.fake_storage, self.fake_config, "@carol:example.com")
+        self.assertEqual(user.role, "Unknown")
+
+        # MXIDs on a different homeserver must not match
+        user = User(self.fake_storage, self.fake_config, "@alice:example.org")
+        self.assertEqual(user.role, "Unknown")
+
+    def test_role_index(self):
+        """Tests that members are grouped by role in spreadsheet order"""
+        members = self.fake_storage.roster.members
+
+        self.assertEqual([m["Name"] for m in members["Team Leader"]], ["Alice", "Carol"])
+        self.assertEqual([m["Name"] for m in members["HTC"]], ["Bob"])
+
+
+class CommandTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        teams = pd.DataFrame({"Code": ["IDN"], "Name": ["Indonesia"], "Voting": [1]})
+        leaders = pd.DataFrame({
+            "TeamCode": ["IDN", "IDN"],
+            "RealTeamCode": ["IDN", "IDN"],
+            "Name": ["Alice", "Dave"],
+            "Role": ["Team Leader", "Guest"],
+            "UserID": ["alice", "dave"],
+        })
+        leaders.loc[len(leaders)] = ["IDN", "IDN", "Tom", "HTC", "tom"]
+
+        self.fake_client = Mock(spec=nio.AsyncClient)
+        self.fake_config = Mock()
+        self.fake_config.homeserver_url = "https://example.com"
+        self.fake_storage = Mock(spec=Storage)
+        self.fake_storage.roster = Roster(teams, leaders, "example.com")
+
+        self.fake_room = Mock(spec=nio.MatrixRoom)
+        self.fake_room.room_id = "!abcdefg:example.com"
+
+    async def run_command(self, sender: str, text: str) -> str:
+        """Run a command and return the body of the single message sent in reply"""
+        fake_event = Mock(spec=nio.RoomMessageText)
+        fake_event.sender = sender
+
+        command = Command(
+            self.fake_client, self.fake_storage, self.fake_config,
+            text, self.fake_room, fake_event,
+        )
+        await command.process()
+        await get_scheduler(self.fake_client).join()
+
+        self.fake_client.room_send.assert_called_once()
+        return self.fake_client.room_send.call_args.args[2]["body"]
+
+    async def test_dispatch(self):
+        """Tests that a command is dispatched to its handler and counted"""
+        invocations = command_invocations.labels("echo").value
+
+        body = await self.run_command("@alice:example.com", "echo hello there")
+
+        self.assertEqual(body, "hello there")
+        self.assertEqual(command_invocations.labels("echo").value, invocations + 1)
+
+    async def test_denied(self):
+        """Tests that users without the required role get the command's denial message"""
+        body = await self.run_command("@dave:example.com", "vote 1")
+
+        self.assertEqual(body, "Only Team Leader and Deputy Leader can use this command.")
+
+    async def test_unknown(self):
+        """Tests that unknown commands are answered with a hint"""
+        body = await self.run_command("@alice:example.com", "dance")
+
+        self.assertIn("Unknown command 'dance'", body)
+
+    async def test_poll_export(self):
+        """Tests that exported votes are uploaded as a CSV file"""
+        async def export_votes(output, poll_id):
+            await output(b"poll_id,team_code\n")
+            await output(b"1,IDN\n")
+            return 1
+
+        self.fake_storage.export_votes.side_effect = export_votes
+        self.fake_room.encrypted = False
+        uploaded = []
+
+        async def upload(file, **kwargs):
+            uploaded.append(file.read())
+            return nio.UploadResponse("mxc://example.com/export"), None
+
+        self.fake_client.upload.side_effect = upload
+
+        body = await self.run_command("@tom:example.com", "poll export all")
+
+        self.fake_storage.export_votes.assert_called_once()
+        self.assertEqual(uploaded, [b"poll_id,team_code\n1,IDN\n"])
+        self.assertEqual(body, "poll-all-votes.csv")
+        self.assertEqual(
+            self.fake_client.room_send.call_args.args[2]["url"], "mxc://example.com/export")
+
+    async def test_invalid_vote(self):
+        """Tests that an invalid vote is rejected from the cached poll without the database"""
+        self.fake_storage.polls = Mock(spec=PollRepository)
+        self.fake_storage.polls.active.return_value = Poll(
+            3, "Accept task A?", 1, True, False, False,
+            ((7, "Yes", "Y"), (8, "No", "N")),
+        )
+
+        body = await self.run_command("@alice:example.com", "vote 3")
+
+        self.assertEqual(body, "Invalid vote: Your vote must be between 1 and 2.")
+        # the spec has no conn, any database access would have raised
+        self.assertFalse(hasattr(self.fake_storage, "conn"))
+
+    async def test_poll_activate_error(self):
+        """Tests that a poll that cannot be activated is reported to HTC"""
+        self.fake_storage.polls = Mock(spec=PollRepository)
+        self.fake_storage.polls.activate.side_effect = PollError(
+            "Poll 1 is already active. Only one poll can be active at any time.  \n")
+
+        body = await self.run_command("@tom:example.com", "poll activate 2")
+
+        self.fake_storage.polls.activate.assert_awaited_once_with(2)
+        self.assertEqual(
+            body, "Poll 1 is already active. Only one poll can be active at any time.  \n")
+
+    async def test_poll_list(self):
+        """Tests that a page of polls is listed with a hint at the next page"""
+        self.fake_storage.polls = Mock(spec=PollRepository)
+        self.fake_storage.polls.page.return_value = [
+            Poll(4, "Accept task A?", 2, False, False, False, ((7, "Yes", "Y"), (8, "No", "N"))),
+        ], True
+
+        body = await self.run_command("@tom:example.com", "poll list --status closed --page 3")
+
+        self.fake_storage.polls.page.assert_awaited_once_with(2, 3, POLL_LIST_PAGE_SIZE)
+        self.assertIn("### [4] Accept task A?", body)
+        self.assertIn("- Y / Yes", body)
+        self.assertIn("`poll list --status closed --page 4`", body)
+
+
+if __name__ == "__main__":
+    unittest.main()
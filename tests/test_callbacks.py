@@ -1,10 +1,12 @@
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import nio
+import pandas as pd
 
+from ioibot import callbacks
 from ioibot.callbacks import Callbacks
-from ioibot.storage import Storage
+from ioibot.storage import Roster, Storage
 
 from tests.utils import make_awaitable, run_coroutine
 
@@ -19,6 +21,7 @@ class CallbacksTestCase(unittest.TestCase):
 
         # We don't spec config, as it doesn't currently have well defined attributes
         self.fake_config = Mock()
+        self.fake_config.command_prefix = "!c "
 
         self.callbacks = Callbacks(
             self.fake_client, self.fake_storage, self.fake_config
@@ -45,6 +48,35 @@ class CallbacksTestCase(unittest.TestCase):
         # Check that we attempted to join the room
         self.fake_client.join.assert_called_once_with(fake_room_id)
 
+    def test_message_outside_objection_room(self):
+        """Tests that chatter in rooms without an SC room never reaches Message"""
+        self.fake_storage.roster = Roster(
+            pd.DataFrame({"Code": []}),
+            pd.DataFrame({"UserID": [], "Role": []}),
+            "example.com",
+            pd.DataFrame({
+                "Objection Room ID": ["!objection:example.com"],
+                "SC Room ID": ["!sc:example.com"],
+            }),
+        )
+
+        fake_room = Mock(spec=nio.MatrixRoom)
+        fake_room.member_count = 10
+        fake_event = Mock(spec=nio.RoomMessageText)
+        fake_event.sender = "@some_other_fake_user:example.com"
+        fake_event.body = "hello everyone"
+
+        with patch.object(callbacks, "Message") as message:
+            message.return_value.process.return_value = make_awaitable(None)
+
+            fake_room.room_id = "!lobby:example.com"
+            run_coroutine(self.callbacks.message(fake_room, fake_event))
+            message.assert_not_called()
+
+            fake_room.room_id = "!objection:example.com"
+            run_coroutine(self.callbacks.message(fake_room, fake_event))
+            message.assert_called_once()
+
 
 if __name__ == "__main__":
     unittest.main()
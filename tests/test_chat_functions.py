@@ -0,0 +1,56 @@
+import unittest
+from collections import OrderedDict
+from unittest.mock import patch
+
+from ioibot import chat_functions
+from ioibot.chat_functions import register_templates, render_markdown, split_message
+
+
+class RenderMarkdownTestCase(unittest.TestCase):
+    def test_cached(self):
+        """Tests that a message is only converted once while it stays in the cache"""
+        with patch.object(chat_functions, "markdown", wraps=chat_functions.markdown) as markdown:
+            self.assertEqual(render_markdown("**cached**"), "<p><strong>cached</strong></p>")
+            self.assertEqual(render_markdown("**cached**"), "<p><strong>cached</strong></p>")
+
+        markdown.assert_called_once_with("**cached**")
+
+    def test_eviction(self):
+        """Tests that the least recently used message is evicted first"""
+        with patch.object(chat_functions, "MARKDOWN_CACHE_SIZE", 2), \
+                patch.object(chat_functions, "_rendered_cache", OrderedDict()):
+            render_markdown("first")
+            render_markdown("second")
+            render_markdown("first")
+            render_markdown("third")
+
+            self.assertIn("first", chat_functions._rendered_cache)
+            self.assertNotIn("second", chat_functions._rendered_cache)
+
+    def test_templates(self):
+        """Tests that registered templates are rendered up front and never converted again"""
+        register_templates("*static*")
+
+        with patch.object(chat_functions, "markdown") as markdown:
+            self.assertEqual(render_markdown("*static*"), "<p><em>static</em></p>")
+
+        markdown.assert_not_called()
+
+
+class SplitMessageTestCase(unittest.TestCase):
+    def test_blocks(self):
+        """Tests that blocks are packed into messages without being split"""
+        messages = split_message(["a" * 4, "b" * 4, "c" * 4], limit=10)
+
+        self.assertEqual(messages, ["aaaa\n\nbbbb", "cccc"])
+
+    def test_long_block(self):
+        """Tests that a block over the limit is split between lines, long lines are cut"""
+        messages = split_message(["x", "11\n22\n33", "é" * 6], limit=6)
+
+        self.assertEqual(messages, ["x\n\n11", "22\n33", "ééé", "ééé"])
+        self.assertTrue(all(len(message.encode()) <= 6 for message in messages))
+
+
+if __name__ == "__main__":
+    unittest.main()
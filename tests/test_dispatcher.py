@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+from ioibot.dispatcher import EventDispatcher
+
+
+class EventDispatcherTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.dispatcher = EventDispatcher(workers=4)
+        self.dispatcher.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.dispatcher.stop()
+
+    async def test_order_per_key(self):
+        """Tests that callbacks of one key run in order while other keys run in parallel"""
+        log = []
+        release_a = asyncio.Event()
+
+        async def handle(key, value):
+            if value == "a0":
+                await release_a.wait()
+            log.append(value)
+
+        await self.dispatcher.dispatch("a", handle, "a", "a0")
+        await self.dispatcher.dispatch("a", handle, "a", "a1")
+        await self.dispatcher.dispatch("b", handle, "b", "b0")
+
+        # "b" is not held up by the blocked callback of "a"
+        while "b0" not in log:
+            await asyncio.sleep(0)
+        self.assertEqual(log, ["b0"])
+
+        release_a.set()
+        await self.dispatcher.join()
+        self.assertEqual(log, ["b0", "a0", "a1"])
+
+    async def test_error(self):
+        """Tests that a failing callback is logged and doesn't stop its key"""
+        log = []
+
+        async def fail():
+            raise ValueError("broken")
+
+        async def handle():
+            log.append("handled")
+
+        with self.assertLogs("ioibot.dispatcher", "ERROR"):
+            await self.dispatcher.dispatch("a", fail)
+            await self.dispatcher.dispatch("a", handle)
+            await self.dispatcher.join()
+
+        self.assertEqual(log, ["handled"])
+
+    async def test_wait_handled(self):
+        """Tests that waiting for the callbacks dispatched so far ignores later ones"""
+        release = {"a": asyncio.Event(), "b": asyncio.Event()}
+
+        await self.dispatcher.dispatch("a", release["a"].wait)
+        sequence = self.dispatcher.dispatched
+        await self.dispatcher.dispatch("b", release["b"].wait)
+
+        waiter = asyncio.create_task(self.dispatcher.wait_handled(sequence))
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        release["a"].set()
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(self.dispatcher.handled, sequence)
+
+        release["b"].set()
+        await self.dispatcher.join()
+        self.assertEqual(self.dispatcher.handled, self.dispatcher.dispatched)
+
+
+if __name__ == "__main__":
+    unittest.main()
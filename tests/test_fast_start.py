@@ -0,0 +1,101 @@
+import asyncio
+import tempfile
+import time
+import unittest
+from unittest.mock import AsyncMock, Mock
+
+import nio
+
+from ioibot.dispatcher import EventDispatcher
+from ioibot.fast_start import FastStart
+
+
+def make_event(age: float) -> nio.RoomMessageText:
+    event = Mock(spec=nio.RoomMessageText)
+    event.server_timestamp = int((time.time() - age) * 1000)
+    return event
+
+
+class FastStartTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    async def test_skip_backlog(self):
+        """Tests that only old events of the first sync are skipped"""
+        fast_start = FastStart(self.tmpdir.name, horizon=60)
+        fast_start.load()
+        callback = AsyncMock()
+        wrapped = fast_start.wrap(callback)
+
+        await wrapped(Mock(), make_event(age=3600))
+        callback.assert_not_called()
+        await wrapped(Mock(), make_event(age=10))
+        callback.assert_called_once()
+
+        await fast_start.sync(Mock(spec=nio.SyncResponse, next_batch="s1"))
+
+        # A late event from a server with a skewed clock is still handled
+        await wrapped(Mock(), make_event(age=3600))
+        self.assertEqual(callback.call_count, 2)
+
+    async def test_checkpoint(self):
+        """Tests that events handled before a restart are not handled again"""
+        handled = make_event(age=10)
+        fast_start = FastStart(self.tmpdir.name, horizon=60)
+        fast_start.load()
+        self.assertFalse(fast_start.is_stale(handled))
+        await fast_start.sync(Mock(spec=nio.SyncResponse, next_batch="s1"))
+        await fast_start.flush()
+
+        restarted = FastStart(self.tmpdir.name, horizon=60)
+        restarted.load()
+
+        self.assertEqual(restarted.sync_token, "s1")
+        self.assertTrue(restarted.is_stale(handled))
+        self.assertFalse(restarted.is_stale(make_event(age=1)))
+
+    async def test_rooms_out_of_order(self):
+        """Tests that a newer event of one room does not make older events of another room stale"""
+        fast_start = FastStart(self.tmpdir.name, horizon=60)
+        fast_start.load()
+
+        self.assertFalse(fast_start.is_stale(make_event(age=10)))
+        self.assertFalse(fast_start.is_stale(make_event(age=20)))
+
+    async def test_checkpoint_after_handling(self):
+        """Tests that the checkpoint moves to the last sync whose events were all handled"""
+        dispatcher = EventDispatcher(workers=2)
+        dispatcher.start()
+        self.addAsyncCleanup(dispatcher.stop)
+        fast_start = FastStart(self.tmpdir.name, horizon=60, dispatcher=dispatcher)
+        fast_start.load()
+        restarted = FastStart(self.tmpdir.name, horizon=60)
+
+        first, slow = asyncio.Event(), asyncio.Event()
+        await dispatcher.dispatch("!a", first.wait)
+        await fast_start.sync(Mock(spec=nio.SyncResponse, next_batch="s1"))
+        await dispatcher.dispatch("!b", slow.wait)
+        await fast_start.sync(Mock(spec=nio.SyncResponse, next_batch="s2"))
+        await asyncio.sleep(0)
+
+        # a crash now must replay the event still being handled
+        restarted.load()
+        self.assertIsNone(restarted.sync_token)
+
+        # the event of s2 still running doesn't hold up the checkpoint of s1
+        first.set()
+        for _ in range(100):
+            if fast_start.sync_token == "s1":
+                break
+            await asyncio.sleep(0.01)
+        restarted.load()
+        self.assertEqual(restarted.sync_token, "s1")
+
+        slow.set()
+        await fast_start.flush()
+        restarted.load()
+        self.assertEqual(restarted.sync_token, "s2")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, Mock, patch
+
+import pandas as pd
+from aiohttp.test_utils import TestClient, TestServer
+
+from ioibot import http_server
+from ioibot.http_server import make_app
+from ioibot.polls import Poll, PollRepository
+from ioibot.storage import Roster, Storage
+
+
+class HttpServerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.store = Storage(Mock(store_path="/nonexistent", webapp_export_token=None))
+        self.store.roster = Roster(
+            pd.DataFrame({"Code": ["IDN"], "Name": ["Indonesia"]}),
+            pd.DataFrame({"UserID": [], "Role": []}),
+            "example.com",
+        )
+        self.store.polls = Mock(spec=PollRepository)
+        self.store.polls.displayed = AsyncMock(return_value=Poll(
+            1, "Accept task A?", 1, True, False, False, ((1, "Yes", "Y"), (2, "No", "N"))))
+        self.store.polls.votes = AsyncMock(return_value=[])
+
+        self.client = TestClient(TestServer(make_app(self.store)))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_not_modified(self):
+        """Tests that a matching ETag gets 304 until the poll result changes"""
+        response = await self.client.get("/api/polls")
+        self.assertEqual(response.status, 200)
+        etag = response.headers["ETag"]
+        self.assertEqual((await response.json())["votes"][0]["choice_id"], None)
+
+        response = await self.client.get("/api/polls", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(self.store.polls.votes.await_count, 1)
+
+        self.store.polls.votes.return_value = [(1, "IDN", "@alice:example.com", datetime(2024, 9, 1))]
+        self.store.poll_changed()
+
+        response = await self.client.get("/api/polls", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual((await response.json())["votes"][0]["choice_id"], 1)
+
+    async def test_stream(self):
+        """Tests that every change of the result is pushed exactly once"""
+        with patch.object(http_server, "keepalive_interval", 0.1):
+            response = await self.client.get("/api/polls/stream")
+            self.assertEqual(response.headers["Content-Type"], "text/event-stream")
+
+            frame = await response.content.readuntil(b"\n\n")
+            self.assertEqual(json.loads(frame[len(b"data: "):])["question"], "Accept task A?")
+
+            self.store.poll_changed()
+            frame = await response.content.readuntil(b"\n\n")
+            self.assertTrue(frame.startswith(b"data: "))
+
+            # nothing changed since, only keepalives follow
+            for _ in range(3):
+                frame = await asyncio.wait_for(response.content.readuntil(b"\n\n"), 1)
+                self.assertEqual(frame, b": keepalive\n\n")
+            response.close()
+
+        self.assertEqual(self.store.polls.votes.await_count, 2)
+
+    async def test_export_restricted(self):
+        """Tests that votes are only exported with the configured token"""
+        async def export_votes(write, poll_id):
+            await write(b"poll_id,team_code\n1,IDN\n")
+            return 1
+
+        self.store.export_votes = AsyncMock(side_effect=export_votes)
+
+        response = await self.client.get("/api/polls/export?poll=1")
+        self.assertEqual(response.status, 404)
+
+        self.store.config.webapp_export_token = "secret"
+        for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": "Basic secret"}):
+            response = await self.client.get("/api/polls/export?poll=1", headers=headers)
+            self.assertEqual(response.status, 401)
+        self.store.export_votes.assert_not_called()
+
+        response = await self.client.get(
+            "/api/polls/export?poll=1", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.text(), "poll_id,team_code\n1,IDN\n")
+        self.store.export_votes.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from unittest.mock import Mock
+from urllib.parse import parse_qs, urlsplit
+
+import nio
+
+from ioibot.fast_start import FastStart
+from ioibot.main import loop
+
+
+class StopSyncing(Exception):
+    pass
+
+
+class LoopTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+        self.config = Mock()
+        self.config.user_token = "token"
+        self.config.user_id = "@bot:example.com"
+        self.config.sync_lazy_load_members = True
+        self.config.sync_timeline_types = ["m.room.message"]
+
+        self.client = nio.AsyncClient(
+            "https://example.com", "@bot:example.com",
+            config=nio.AsyncClientConfig(encryption_enabled=False),
+        )
+        self.client.access_token = "token"
+        self.client.load_store = Mock()
+        self.client.loaded_sync_token = "s0"
+
+        # query parameters of the sync requests
+        self.syncs = []
+        # errcode to answer the first sync with
+        self.resume_error = None
+        self.client._send = self.send
+
+    async def send(self, response_class, method, path, *args, **kwargs):
+        if response_class is nio.UploadFilterResponse:
+            return nio.UploadFilterResponse.from_dict({"filter_id": "filter"})
+
+        self.syncs.append(parse_qs(urlsplit(path).query))
+        if len(self.syncs) > 3:
+            raise StopSyncing()
+        if self.resume_error and len(self.syncs) == 1:
+            return nio.SyncError.from_dict({"errcode": self.resume_error, "error": "Unknown token"})
+        response = nio.SyncResponse.from_dict({"next_batch": f"s{len(self.syncs)}"})
+        await self.client.receive_response(response)
+        return response
+
+    async def test_resume_once(self):
+        """Tests that only the first sync after a restart uses the stored token and gets the full state"""
+        fast_start = FastStart(self.tmpdir.name, horizon=60)
+
+        with self.assertRaises(StopSyncing):
+            await loop(self.config, self.client, fast_start)
+
+        self.assertEqual(
+            [sync.get("since") for sync in self.syncs],
+            [["s0"], ["s1"], ["s2"], ["s3"]])
+        # the full state only once, the long-polling syncs get what changed
+        self.assertEqual(
+            [sync.get("full_state") for sync in self.syncs],
+            [["true"], None, None, None])
+
+    async def test_resume_failed(self):
+        """Tests that an unusable sync token is replaced by an initial sync whose backlog is skipped"""
+        self.resume_error = "M_UNKNOWN_POS"
+        fast_start = FastStart(self.tmpdir.name, horizon=60)
+        fast_start.load()
+        self.client.add_response_callback(fast_start.sync, (nio.SyncResponse,))
+
+        with self.assertLogs("ioibot.main", "WARNING"), self.assertRaises(StopSyncing):
+            await loop(self.config, self.client, fast_start)
+
+        self.assertEqual(
+            [sync.get("since") for sync in self.syncs],
+            [["s0"], None, ["s2"], ["s3"]])
+        # catching up ended with the initial sync, not with the failed one
+        self.assertFalse(fast_start._catching_up)
+        await fast_start.flush()
+        self.assertEqual(fast_start.sync_token, "s3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import AsyncMock, Mock
+
+import nio
+import pandas as pd
+
+from ioibot.message_responses import Message
+from ioibot.outbound import get_scheduler
+from ioibot.storage import Roster, Storage
+
+
+class MessageTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.fake_client = Mock(spec=nio.AsyncClient)
+        self.fake_client.room_get_event.return_value = Mock(spec=nio.RoomGetEventResponse)
+
+        self.store = Storage(Mock(store_path="/nonexistent"))
+        self.store.roster = Roster(
+            pd.DataFrame({"Code": []}),
+            pd.DataFrame({"UserID": [], "Role": []}),
+            "example.com",
+            pd.DataFrame({
+                "Objection Room ID": ["!objection:example.com"],
+                "SC Room ID": ["!sc:example.com"],
+            }),
+        )
+        self.store.conn = Mock()
+        self.store.conn.execute = AsyncMock()
+
+        self.fake_room = Mock(spec=nio.MatrixRoom)
+        self.fake_room.room_id = "!objection:example.com"
+
+    async def comment(self, thread_id: str):
+        fake_event = Mock(spec=nio.RoomMessageText)
+        fake_event.sender = "@alice:example.com"
+        fake_event.event_id = "$comment"
+        fake_event.source = {"content": {"m.relates_to": {
+            "rel_type": "m.thread", "event_id": thread_id}}}
+
+        message = Message(
+            self.fake_client, self.store, Mock(), "comment", self.fake_room, fake_event)
+        await message.process()
+        await get_scheduler(self.fake_client).join()
+
+    async def test_relay_from_cache(self):
+        """Tests that comments are relayed without reading the database, validating the SC thread once"""
+        self.store._objection_threads[
+            ("!objection:example.com", "!sc:example.com", "$objection")] = "$sc_thread"
+
+        await self.comment("$objection")
+        await self.comment("$objection")
+
+        self.fake_client.room_get_event.assert_called_once_with("!sc:example.com", "$sc_thread")
+        sent = [call.args for call in self.fake_client.room_send.call_args_list]
+        self.assertEqual([args[0] for args in sent].count("!sc:example.com"), 2)
+
+    async def test_new_objection_thread(self):
+        """Tests that a thread stored by the objection command is relayed to right away"""
+        await self.store.add_objection_thread(
+            "!objection:example.com", "!sc:example.com", "$objection", "$sc_thread")
+
+        await self.comment("$objection")
+
+        self.store.conn.execute.assert_awaited_once()
+        self.fake_client.room_get_event.assert_not_called()
+        self.assertEqual(self.fake_client.room_send.call_args_list[0].args[0], "!sc:example.com")
+
+    async def test_unknown_thread(self):
+        """Tests that comments in threads that aren't objections are ignored"""
+        await self.comment("$chatter")
+
+        self.fake_client.room_send.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from ioibot.metrics import REGISTRY, Counter, Gauge, Histogram
+
+
+class MetricsTestCase(unittest.TestCase):
+    def tearDown(self) -> None:
+        # Don't leave the test metrics behind in the global registry
+        del REGISTRY[-1]
+
+    def test_counter(self):
+        """Tests that counters are rendered per label, with label values escaped"""
+        counter = Counter("test_total", "A test counter", ["name"])
+        counter.labels("a").inc()
+        counter.labels("a").inc(2)
+        counter.labels('say "hi"').inc()
+
+        self.assertEqual(
+            counter.render(),
+            "# HELP test_total A test counter\n"
+            "# TYPE test_total counter\n"
+            'test_total{name="a"} 3\n'
+            'test_total{name="say \\"hi\\""} 1\n',
+        )
+
+    def test_gauge_function(self):
+        """Tests that a gauge backed by a function is read on every render"""
+        values = [1, 2]
+        gauge = Gauge("test_gauge", "A test gauge")
+        gauge.set_function(values.pop)
+
+        self.assertIn("test_gauge 2\n", gauge.render())
+        self.assertIn("test_gauge 1\n", gauge.render())
+
+    def test_histogram(self):
+        """Tests that histogram buckets are rendered cumulatively"""
+        histogram = Histogram("test_seconds", "A test histogram", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(
+            histogram.render(),
+            "# HELP test_seconds A test histogram\n"
+            "# TYPE test_seconds histogram\n"
+            'test_seconds_bucket{le="0.1"} 1\n'
+            'test_seconds_bucket{le="1"} 2\n'
+            'test_seconds_bucket{le="+Inf"} 3\n'
+            "test_seconds_sum 5.55\n"
+            "test_seconds_count 3\n",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
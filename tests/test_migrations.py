@@ -0,0 +1,15 @@
+import unittest
+
+from ioibot.migrations import load_migrations
+
+
+class MigrationsTestCase(unittest.TestCase):
+    def test_versions(self):
+        """Tests that migrations are numbered without gaps or duplicates"""
+        versions = [version for version, name, sql in load_migrations()]
+
+        self.assertEqual(versions, list(range(1, len(versions) + 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
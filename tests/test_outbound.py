@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+from unittest.mock import Mock, patch
+
+import nio
+
+from ioibot import outbound
+from ioibot.outbound import OutboundScheduler
+
+
+def notice(body: str) -> dict:
+    return {"msgtype": "m.notice", "format": "org.matrix.custom.html", "body": body,
+            "formatted_body": f"<p>{body}</p>"}
+
+
+class OutboundSchedulerTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.fake_client = Mock(spec=nio.AsyncClient)
+        self.fake_client.room_send.return_value = nio.RoomSendResponse("$event", "!room")
+
+    def sent_bodies(self, room_id: str):
+        return [
+            call.args[2]["body"]
+            for call in self.fake_client.room_send.call_args_list
+            if call.args[0] == room_id
+        ]
+
+    async def test_order(self):
+        """Tests that events are sent to each room in the order they were queued"""
+        scheduler = OutboundScheduler(self.fake_client)
+        for i in range(3):
+            scheduler.send("!a", "m.room.message", notice(f"a{i}"))
+            scheduler.send("!b", "m.room.message", notice(f"b{i}"))
+        await scheduler.join()
+
+        self.assertEqual(self.sent_bodies("!a"), ["a0", "a1", "a2"])
+        self.assertEqual(self.sent_bodies("!b"), ["b0", "b1", "b2"])
+
+    async def test_coalesce(self):
+        """Tests that queued notices are merged, but only when enabled and allowed"""
+        scheduler = OutboundScheduler(self.fake_client, coalesce_notices=True)
+        first = scheduler.send("!a", "m.room.message", notice("one"), coalesce=True)
+        second = scheduler.send("!a", "m.room.message", notice("two"), coalesce=True)
+        third = scheduler.send("!a", "m.room.message", notice("three"), coalesce=True)
+        scheduler.send("!a", "m.room.message", notice("alone"))
+        await scheduler.join()
+
+        self.assertEqual(self.sent_bodies("!a"), ["one\n\ntwo\n\nthree", "alone"])
+        self.assertIs(first.result(), second.result())
+        self.assertIs(first.result(), third.result())
+
+    async def test_rate_limited(self):
+        """Tests that an event is retried after the delay asked for by the homeserver"""
+        self.fake_client.room_send.side_effect = [
+            nio.RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", retry_after_ms=20),
+            nio.RoomSendResponse("$event", "!a"),
+        ]
+        scheduler = OutboundScheduler(self.fake_client)
+
+        with patch.object(outbound.asyncio, "sleep", wraps=outbound.asyncio.sleep) as sleep:
+            response = await scheduler.send("!a", "m.room.message", notice("hi"))
+
+        self.assertEqual(response.event_id, "$event")
+        self.assertEqual(self.fake_client.room_send.call_count, 2)
+        self.assertAlmostEqual(sleep.call_args.args[0], 0.02, places=2)
+
+    async def test_cancelled_worker(self):
+        """Tests that events queued after a room's worker was cancelled are still sent"""
+        async def room_send(room_id, message_type, content, **kwargs):
+            if content["body"] == "stuck":
+                await asyncio.Event().wait()
+            return nio.RoomSendResponse("$event", room_id)
+
+        self.fake_client.room_send.side_effect = room_send
+        scheduler = OutboundScheduler(self.fake_client)
+
+        first = scheduler.send("!a", "m.room.message", notice("stuck"))
+        queued = scheduler.send("!a", "m.room.message", notice("queued"))
+        await asyncio.sleep(0)
+        scheduler._rooms["!a"].worker.cancel()
+        await scheduler.join()
+
+        self.assertIsNone(first.result())
+        self.assertIsNone(queued.result())
+
+        response = await scheduler.send("!a", "m.room.message", notice("later"))
+        self.assertEqual(response.event_id, "$event")
+        self.assertEqual(self.sent_bodies("!a"), ["stuck", "later"])
+
+
+if __name__ == "__main__":
+    unittest.main()
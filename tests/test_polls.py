@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from ioibot import queries
+from ioibot.polls import PollCache
+
+
+class PollCacheTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.conn = MagicMock()
+        self.conn.fetchrow = AsyncMock(return_value=(3, "Accept task A?", 1, True, False, True))
+        # the database returns the choices in no particular order
+        self.conn.fetch = AsyncMock(return_value=[(8, "No", "N"), (7, "Yes", "Y")])
+
+        self.pool = MagicMock()
+        self.pool.acquire.return_value.__aenter__.return_value = self.conn
+
+    async def test_active(self):
+        """Tests that the active poll is read once, with its choices sorted by ID"""
+        cache = PollCache()
+
+        poll = await cache.active(self.pool)
+        self.assertIs(await cache.active(self.pool), poll)
+
+        self.conn.fetchrow.assert_awaited_once_with(queries.ACTIVE_POLL)
+        self.assertEqual(poll.poll_id, 3)
+        self.assertTrue(poll.multiple_choice)
+        self.assertEqual(poll.choices, ((7, "Yes", "Y"), (8, "No", "N")))
+        self.assertEqual(poll.choice_id(2), 8)
+
+    async def test_no_poll(self):
+        """Tests that the absence of a displayed poll is cached too"""
+        self.conn.fetchrow.return_value = None
+        cache = PollCache()
+
+        self.assertIsNone(await cache.displayed(self.pool))
+        self.assertIsNone(await cache.displayed(self.pool))
+
+        self.conn.fetchrow.assert_awaited_once_with(queries.DISPLAYED_POLL)
+        self.conn.fetch.assert_not_awaited()
+
+    async def test_invalidate(self):
+        """Tests that invalidating forces a new read, also of a read still in progress"""
+        cache = PollCache()
+        await cache.active(self.pool)
+        cache.invalidate()
+        await cache.active(self.pool)
+        self.assertEqual(self.conn.fetchrow.await_count, 2)
+
+        # a poll command finishing while the poll is being read
+        read = asyncio.Event()
+        row = self.conn.fetchrow.return_value
+
+        async def fetchrow(query):
+            await read.wait()
+            return row
+
+        self.conn.fetchrow.side_effect = fetchrow
+        cache.invalidate()
+        reading = asyncio.create_task(cache.active(self.pool))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        self.conn.fetchrow.side_effect = None
+        read.set()
+        await reading
+
+        await cache.active(self.pool)
+        self.assertEqual(self.conn.fetchrow.await_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
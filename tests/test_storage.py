@@ -0,0 +1,157 @@
+import os
+import tempfile
+import types
+import unittest
+from typing import Dict, List
+from unittest.mock import AsyncMock, Mock
+
+import asyncpg
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ioibot.errors import DatasourceError
+from ioibot.storage import DATASOURCES, InstrumentedPool, Storage, db_pool_wait
+
+CSVS = {
+    'teams': "Code,Name,Voting,Visible\nIDN,Indonesia,1,1\n",
+    'leaders': "TeamCode,RealTeamCode,Name,Role,UserID,Chair\nIDN,IDN,Alice,Team Leader,alice,0\n",
+    'contestants': "ContestantCode,RealTeamCode,FirstName,LastName,Online,Password\nIDN1,IDN,Budi,S,0,pw\n",
+    'testing_acc': "ContestantCode,RealTeamCode,FirstName,LastName,Password\nIDN1-test,IDN,Budi,S,pw\n",
+    'translation_acc': "TeamCode,Password\nIDN,pw\n",
+    'objection_rooms': "Objection Room ID,SC Room ID\n!obj:example.com,!sc:example.com\n",
+    'tokens': "UserID,Token\nalice,secret\n",
+}
+
+
+class DatasourceServer:
+    """Serves the datasource CSVs with an ETag, answering 304 to a matching If-None-Match"""
+
+    def __init__(self):
+        self.csvs = dict(CSVS)
+        # name -> status to answer with instead of the CSV
+        self.failing: Dict[str, int] = {}
+        # name -> headers of the requests for it
+        self.requests: Dict[str, List[dict]] = {name: [] for name in CSVS}
+        app = web.Application()
+        app.router.add_get("/{name}.csv", self.handle)
+        self.server = TestServer(app)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        self.requests[name].append(dict(request.headers))
+        if name in self.failing:
+            return web.Response(status=self.failing[name])
+
+        etag = f'"{hash(self.csvs[name]) & 0xffffffff:x}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=self.csvs[name], content_type="text/csv", headers={"ETag": etag})
+
+    def url(self, name: str) -> str:
+        return str(self.server.make_url(f"/{name}.csv"))
+
+
+class StorageTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+        self.source = DatasourceServer()
+        await self.source.server.start_server()
+        self.addAsyncCleanup(self.source.server.close)
+
+        self.config = types.SimpleNamespace(
+            homeserver_url="https://example.com", store_path=self.tmpdir.name)
+        for name, option in DATASOURCES.items():
+            setattr(self.config, option, self.source.url(name))
+
+        self.store = Storage(self.config)
+        await self.store.reload_csv()
+
+    async def test_failed_source_keeps_tables(self):
+        """Tests that a failed download leaves every table, the roster and the snapshot as they were"""
+        tables = {name: getattr(self.store, name) for name in DATASOURCES}
+        roster = self.store.roster
+        os.remove(self.store.snapshot_path)
+
+        self.source.csvs['teams'] = "Code,Name,Voting,Visible\nHUN,Hungary,1,1\n"
+        self.source.failing['leaders'] = 500
+        with self.assertRaises(DatasourceError):
+            await self.store.reload_csv()
+
+        for name, table in tables.items():
+            self.assertIs(getattr(self.store, name), table)
+        self.assertIs(self.store.roster, roster)
+        self.assertFalse(os.path.exists(self.store.snapshot_path))
+
+    async def test_not_modified(self):
+        """Tests that unchanged datasources are revalidated with their ETag and kept"""
+        tables = {name: getattr(self.store, name) for name in DATASOURCES}
+        version = self.store.poll_version
+
+        await self.store.reload_csv()
+
+        for name, table in tables.items():
+            self.assertIs(getattr(self.store, name), table)
+            self.assertIn("If-None-Match", self.source.requests[name][-1])
+        self.assertEqual(self.store.poll_version, version)
+
+        self.source.csvs['teams'] = "Code,Name,Voting,Visible\nHUN,Hungary,1,1\n"
+        await self.store.reload_csv()
+
+        self.assertEqual(list(self.store.teams['Code']), ["HUN"])
+        self.assertIs(self.store.leaders, tables['leaders'])
+
+    async def test_url_changed(self):
+        """Tests that the validators of a datasource are not sent to a new URL"""
+        self.config.team_url = self.source.url("teams") + "?sheet=2"
+
+        await self.store.reload_csv()
+
+        self.assertNotIn("If-None-Match", self.source.requests['teams'][-1])
+        self.assertIn("If-None-Match", self.source.requests['leaders'][-1])
+
+    async def test_snapshot(self):
+        """Tests that a restart starts from the snapshot and revalidates it in the background"""
+        restarted = Storage(self.config)
+        with self.assertLogs("ioibot.storage", "INFO"):
+            await restarted.load()
+        await restarted._revalidation
+
+        self.assertEqual(list(restarted.teams['Code']), ["IDN"])
+        self.assertIn("@alice:example.com", restarted.roster.users)
+        self.assertIn("If-None-Match", self.source.requests['teams'][-1])
+
+    def test_corrupt_snapshot(self):
+        """Tests that a truncated or corrupt snapshot is ignored with a warning"""
+        with open(self.store.snapshot_path, 'rb') as f:
+            snapshot = f.read()
+
+        for content in (snapshot[:len(snapshot) // 2], b"not a pickle", b""):
+            with open(self.store.snapshot_path, 'wb') as f:
+                f.write(content)
+
+            restarted = Storage(self.config)
+            with self.assertLogs("ioibot.storage", "WARNING") as logs:
+                self.assertFalse(restarted._read_snapshot())
+            self.assertIn("Ignoring unreadable snapshot", logs.output[0])
+
+
+class InstrumentedPoolTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_acquire(self):
+        """Tests that queries time acquiring their connection and release it afterwards"""
+        conn = Mock()
+        conn.fetchval = AsyncMock(return_value=1)
+        pool = Mock(spec=asyncpg.Pool)
+        pool.acquire = AsyncMock(return_value=conn)
+        acquires = db_pool_wait.labels().count
+
+        self.assertEqual(await InstrumentedPool(pool).fetchval("SELECT $1", 1), 1)
+
+        conn.fetchval.assert_awaited_once_with("SELECT $1", 1)
+        pool.release.assert_awaited_once_with(conn)
+        self.assertEqual(db_pool_wait.labels().count, acquires + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -71,100 +71,103 @@ function updateChart(status) {
 
 }
 
-function fetchPollResult() {
-  $.get("/api/polls", function(json_data) {
-
-    const get_data = function() {
-      if ($.isEmptyObject(json_data)) { return false; }
-
-      const data = json_data;
-      const question = data.question;
-      const anonymous = data.anonymous;
-      const multiple_choice = data.multiple_choice;
-      const status = data.status;
-      const ungrouped_votes = data.votes;
-
-      if (anonymous) {
+function showPollResult(json_data) {
+
+  const get_data = function() {
+    if ($.isEmptyObject(json_data)) { return false; }
+
+    const data = json_data;
+    const question = data.question;
+    const anonymous = data.anonymous;
+    const multiple_choice = data.multiple_choice;
+    const status = data.status;
+    const ungrouped_votes = data.votes;
+
+    if (anonymous) {
+      choices = Object.fromEntries(
+        data.choices.map(
+          e => [e.choice_id, {choice: e.choice, marker: e.marker, count: 0}]
+        )
+      )
+    } else {
+      if(status == 1) {
         choices = Object.fromEntries(
-          data.choices.map(
+          [...data.choices.map(
             e => [e.choice_id, {choice: e.choice, marker: e.marker, count: 0}]
-          )
+            ),
+            [null, {choice: "Pending", marker: "⏳", count: 0}]
+          ]
         )
       } else {
-        if(status == 1) {
-          choices = Object.fromEntries(
-            [...data.choices.map(
-              e => [e.choice_id, {choice: e.choice, marker: e.marker, count: 0}]
-              ),
-              [null, {choice: "Pending", marker: "⏳", count: 0}]
-            ]
-          )
-        } else {
-          choices = Object.fromEntries(
-            [...data.choices.map(
-              e => [e.choice_id, {choice: e.choice, marker: e.marker, count: 0}]
-              ),
-              [null, {choice: "Pending", marker: "", count: 0}]
-            ]
-          )
-        }
+        choices = Object.fromEntries(
+          [...data.choices.map(
+            e => [e.choice_id, {choice: e.choice, marker: e.marker, count: 0}]
+            ),
+            [null, {choice: "Pending", marker: "", count: 0}]
+          ]
+        )
       }
+    }
 
 
-      // group votes by the team code
-      $("#question").text(question);
-      $("#anonymous").text(anonymous ? 'Yes' : 'No');
-      $("#multiple-choice").text(multiple_choice ? 'Yes' : 'No');
-      $("#status").html(DOMPurify.sanitize(`<span class="fw-bold text-${['info', 'success', 'warning'][status]}">${['Inactive', 'Active', 'closed'][status]}</span>`));
-      if (anonymous) {
-        ungrouped_votes.forEach(vote => {
-          choices[vote.choice_id].count += vote.count;
-        });
+    // group votes by the team code
+    $("#question").text(question);
+    $("#anonymous").text(anonymous ? 'Yes' : 'No');
+    $("#multiple-choice").text(multiple_choice ? 'Yes' : 'No');
+    $("#status").html(DOMPurify.sanitize(`<span class="fw-bold text-${['info', 'success', 'warning'][status]}">${['Inactive', 'Active', 'closed'][status]}</span>`));
+    if (anonymous) {
+      ungrouped_votes.forEach(vote => {
+        choices[vote.choice_id].count += vote.count;
+      });
 
-        $('#result').html('');
-      } else {
-        ungrouped_votes.forEach(vote => {
-          choices[vote.choice_id].count += 1;
-        });
-
-        const votes = groupBy(ungrouped_votes, 'team_code');
-        // sort by team code
-        const sorted_votes = Object.entries(votes).sort((a, b) => a[0].localeCompare(b[0]));
-
-        $('#result').html(DOMPurify.sanitize(
-          sorted_votes.map(([team_code, votes_by_team]) => (` 
-                    <div class="col-12 col-sm-6 col-md-4 col-lg-3 col-xl-2 text-nowrap text-truncate">
-                    ${
-                      votes_by_team.map(vote => `<span title="${vote.voted_at ?? "pending"} / ${vote.voted_by ?? "pending"}">${choices[vote.choice_id].marker}</span>`).join('')
-                    } 
-                      &emsp; <span title="${team_code}">${team_code}</span>
-                    </div>
-                  `)).join('')
-        ))
-      }
+      $('#result').html('');
+    } else {
+      ungrouped_votes.forEach(vote => {
+        choices[vote.choice_id].count += 1;
+      });
+
+      const votes = groupBy(ungrouped_votes, 'team_code');
+      // sort by team code
+      const sorted_votes = Object.entries(votes).sort((a, b) => a[0].localeCompare(b[0]));
+
+      $('#result').html(DOMPurify.sanitize(
+        sorted_votes.map(([team_code, votes_by_team]) => (` 
+                  <div class="col-12 col-sm-6 col-md-4 col-lg-3 col-xl-2 text-nowrap text-truncate">
+                  ${
+                    votes_by_team.map(vote => `<span title="${vote.voted_at ?? "pending"} / ${vote.voted_by ?? "pending"}">${choices[vote.choice_id].marker}</span>`).join('')
+                  } 
+                    &emsp; <span title="${team_code}">${team_code}</span>
+                  </div>
+                `)).join('')
+      ))
+    }
 
-      if (!anonymous && status != 1) {
-        delete choices.null;
-      }
+    if (!anonymous && status != 1) {
+      delete choices.null;
+    }
 
-      updateChart(status);
+    updateChart(status);
 
-      return true;
-    };
-    
-    const success = get_data();
+    return true;
+  };
+  
+  const success = get_data();
 
-    if (success) {
-      $('#poll-exists').show();
-      $('#no-poll').hide();
-      setup()
-    } else {
-      $('#poll-exists').hide();
-      $('#no-poll').show();
-    }
+  if (success) {
+    $('#poll-exists').show();
+    $('#no-poll').hide();
+    setup()
+  } else {
+    $('#poll-exists').hide();
+    $('#no-poll').show();
+  }
+}
 
-    setTimeout(function () {
-      fetchPollResult();
-    }, 3000); 
-  });
+// the server pushes a new result whenever a vote or the displayed poll changes,
+// EventSource reconnects by itself if the connection drops
+function subscribePollResult() {
+  const source = new EventSource("/api/polls/stream");
+  source.onmessage = function(event) {
+    showPollResult(JSON.parse(event.data));
+  };
 }